@@ -1,22 +1,95 @@
-from flask import Flask, request, render_template, jsonify, redirect, url_for
+from flask import Flask, Request, request, g, render_template, jsonify, redirect, url_for, Response, stream_with_context
 import os
 import io
+import json
+import time
 import base64
+import zipfile
+import threading
+from collections import OrderedDict
 from PIL import Image
-from scripts.invoice_detector import InvoiceHashDetector
+from scripts.invoice_detector import InvoiceHashDetector, DEFAULT_PAGE_WORKERS
+from scripts.documents import is_pdf, is_multipage, iter_pages
+from scripts.field_index import INDEXED_FIELDS
+from scripts.decode_guard import DecodeBudgetExceeded, probe_image
+from scripts.job_queue import JobQueue, LANES, LANE_INTERACTIVE, LANE_BULK
+from scripts.verdict_cache import VerdictCache, digest_stream
+from scripts.upload_stream import HashingSpooledFile, DEFAULT_SPOOL_BYTES
+from scripts.metrics import (stage, start_request_timings, request_timings, format_timing_header,
+                             render_metrics, REQUEST_SECONDS)
 import logging
 from werkzeug.utils import secure_filename
+from werkzeug.exceptions import RequestEntityTooLarge
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+class HashingRequest(Request):
+    """Request that digests uploaded files while they are received (see HashingSpooledFile)"""
+    
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return HashingSpooledFile(app.config['UPLOAD_SPOOL_BYTES'])
+
 app = Flask(__name__)
+app.request_class = HashingRequest
 app.config['SECRET_KEY'] = 'your-secret-key-here'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+app.config['UPLOAD_SPOOL_BYTES'] = int(os.environ.get('UPLOAD_SPOOL_BYTES', DEFAULT_SPOOL_BYTES))  # in memory per upload
+app.config['MAX_BATCH_CONTENT_LENGTH'] = 512 * 1024 * 1024  # 512MB max per batch request
+app.config['BATCH_WORKERS'] = int(os.environ.get('BATCH_WORKERS', os.cpu_count() or 1))
+app.config['PAGE_WORKERS'] = int(os.environ.get('PAGE_WORKERS', DEFAULT_PAGE_WORKERS))  # per multi-page upload
+app.config['DB_WATCH_INTERVAL'] = float(os.environ.get('DB_WATCH_INTERVAL', 2.0))  # 0 disables hot reload
+# What /upload echoes back: 'none' (the browser already has the file) or a small 'thumbnail'
+app.config['PREVIEW_MODE'] = os.environ.get('PREVIEW_MODE', 'none')
+app.config['THUMBNAIL_SIZE'] = int(os.environ.get('THUMBNAIL_SIZE', 256))  # longest side in pixels
+app.config['THUMBNAIL_CACHE_SIZE'] = 256
+
+PREVIEW_MODES = ('none', 'thumbnail')
+
+# Verdicts of recent uploads, keyed on a digest of the raw bytes. VERDICT_CACHE_PATH
+# (e.g. /tmp/invoice-verdicts.sqlite) shares them between worker processes.
+app.config['VERDICT_CACHE_SIZE'] = int(os.environ.get('VERDICT_CACHE_SIZE', 4096))  # 0 disables the cache
+app.config['VERDICT_CACHE_TTL'] = float(os.environ.get('VERDICT_CACHE_TTL', 3600))  # seconds
+app.config['VERDICT_CACHE_PATH'] = os.environ.get('VERDICT_CACHE_PATH')
+
+verdict_cache = VerdictCache(app.config['VERDICT_CACHE_SIZE'], app.config['VERDICT_CACHE_TTL'],
+                             app.config['VERDICT_CACHE_PATH'])
+
+# Decode guardrails, checked from the image header before any pixels are decoded (0 disables one).
+# A4 at 600dpi is about 35M pixels; larger JPEGs are decoded at reduced scale, others rejected.
+app.config['MAX_IMAGE_PIXELS'] = int(os.environ.get('MAX_IMAGE_PIXELS', 40_000_000))
+app.config['MAX_REQUEST_PIXELS'] = int(os.environ.get('MAX_REQUEST_PIXELS', 200_000_000))  # all pages of an upload
+app.config['MAX_DECODE_SECONDS'] = float(os.environ.get('MAX_DECODE_SECONDS', 10))  # no new page after this
+app.config['MAX_PAGES'] = int(os.environ.get('MAX_PAGES', 50))
+
+# Asynchronous /jobs: a SQLite queue shared by all worker processes, run by JOB_WORKERS
+# threads per process of which JOB_INTERACTIVE_WORKERS only take small single-image jobs
+app.config['JOBS_PATH'] = os.environ.get('JOBS_PATH', 'invoice_jobs.sqlite')
+app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', 2))  # 0: only queue and poll in this process
+app.config['JOB_INTERACTIVE_WORKERS'] = int(os.environ.get('JOB_INTERACTIVE_WORKERS', 1))
+app.config['JOB_SMALL_BYTES'] = int(os.environ.get('JOB_SMALL_BYTES', 4 * 1024 * 1024))  # interactive lane limits
+app.config['JOB_SMALL_PIXELS'] = int(os.environ.get('JOB_SMALL_PIXELS', 16_000_000))
+app.config['JOB_MAX_WAIT'] = float(os.environ.get('JOB_MAX_WAIT', 30))  # longest long-poll in seconds
+app.config['JOB_TTL'] = float(os.environ.get('JOB_TTL', 3600))  # seconds finished jobs stay pollable
 
-# Initialize the detector
-detector = InvoiceHashDetector()
+# Connects on first use, so importing the app does not touch the queue file;
+# the worker threads are started by create_app (or post_fork under gunicorn)
+job_queue = JobQueue(app.config['JOBS_PATH'], app.config['JOB_TTL'])
+
+# Add a per-request X-Timing header with the time spent in each stage
+app.config['TIMING_HEADER'] = os.environ.get('TIMING_HEADER', '0').lower() in ('1', 'true', 'yes')
+
+# Recently generated thumbnails keyed by (invoice hash, size)
+thumbnail_cache = OrderedDict()
+thumbnail_cache_lock = threading.Lock()
+
+# Initialize the detector (INVOICE_HASH_DB may point at a .pkl or a binary .ihdb store)
+detector = InvoiceHashDetector(os.environ.get('INVOICE_HASH_DB', 'legitimate_invoice_hashes.pkl'))
+detector.max_image_pixels = app.config['MAX_IMAGE_PIXELS'] or None
+detector.max_request_pixels = app.config['MAX_REQUEST_PIXELS'] or None
+detector.max_decode_seconds = app.config['MAX_DECODE_SECONDS'] or None
+detector.max_pages = app.config['MAX_PAGES'] or None
 
 # Load the hash database on startup
 def load_detector():
@@ -29,18 +102,142 @@ def load_detector():
     except Exception as e:
         logger.error(f"Error loading detector: {e}")
 
-load_detector()
+def start_watching():
+    """Swap in rebuilt/compacted databases without restarting the workers"""
+    if app.config['DB_WATCH_INTERVAL'] > 0:
+        detector.watch_database(app.config['DB_WATCH_INTERVAL'])
+
+def start_job_workers():
+    """Run queued /jobs on background threads of this process"""
+    if app.config['JOB_WORKERS'] > 0:
+        job_queue.start_workers(run_job, app.config['JOB_WORKERS'], app.config['JOB_INTERACTIVE_WORKERS'])
+
+_loaded = False
+_started = False
+_init_lock = threading.Lock()
+
+def create_app(watch=True):
+    """
+    App factory for WSGI servers (see gunicorn.conf.py)
+    
+    Loads the hash database once per process. With a preforking server the
+    factory runs in the master before the workers are forked, so the loaded
+    database pages are shared copy-on-write; pass watch=False there and start
+    the watcher and job workers in each worker instead, since threads do not
+    survive a fork.
+    """
+    global _loaded, _started
+    with _init_lock:
+        if not _loaded:
+            load_detector()
+            _loaded = True
+        if watch and not _started:
+            start_watching()
+            start_job_workers()
+            _started = True
+    return app
+
+@app.before_request
+def load_on_first_request():
+    """Without the factory (flask run, tests) the database is loaded by the first request"""
+    if not _loaded:
+        create_app()
 
 def allowed_file(filename):
     """Check if the uploaded file is allowed"""
-    ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'tiff'}
+    ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'tiff', 'tif', 'pdf'}
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def make_thumbnail(image, size, budget=None):
+    """Encode a small JPEG preview of an image (or an upload stream) as a data URL"""
+    if not hasattr(image, 'save') and is_pdf(image):
+        # First page of a PDF
+        image = next(iter_pages(image, detector.pdf_dpi, budget))
+    image = detector.open_image(image)
+    if image.format == 'JPEG':
+        # Let the JPEG decoder scale down while decoding (no-op if already decoded)
+        image.draft('RGB', (2 * size, 2 * size))
+    image = detector.prepare_image(image, budget)
+    # reduce() is a cheap box downscale by an integer factor; the final resize
+    # then only touches a few times more pixels than the thumbnail has
+    factor = max(1, max(image.size) // (2 * size))
+    thumbnail = image.reduce(factor) if factor > 1 else image.copy()
+    thumbnail.thumbnail((size, size))
+    
+    img_buffer = io.BytesIO()
+    thumbnail.save(img_buffer, format='JPEG', quality=75)
+    return f"data:image/jpeg;base64,{base64.b64encode(img_buffer.getvalue()).decode()}"
+
+def get_thumbnail(image, invoice_hash, size, budget=None):
+    """make_thumbnail with a small LRU cache keyed by the invoice hash"""
+    if not invoice_hash:
+        return make_thumbnail(image, size, budget)
+    
+    key = (invoice_hash, size)
+    with thumbnail_cache_lock:
+        if key in thumbnail_cache:
+            thumbnail_cache.move_to_end(key)
+            return thumbnail_cache[key]
+    
+    thumbnail = make_thumbnail(image, size, budget)
+    with thumbnail_cache_lock:
+        thumbnail_cache[key] = thumbnail
+        while len(thumbnail_cache) > app.config['THUMBNAIL_CACHE_SIZE']:
+            thumbnail_cache.popitem(last=False)
+    return thumbnail
+
+@app.before_request
+def start_timing():
+    g.request_start = time.perf_counter()
+    start_request_timings()
+
+@app.after_request
+def finish_timing(response):
+    stages = request_timings()
+    start = g.get('request_start')
+    if start is not None:
+        REQUEST_SECONDS.observe(request.endpoint or 'unknown', time.perf_counter() - start)
+    if app.config['TIMING_HEADER'] and stages:
+        response.headers['X-Timing'] = format_timing_header(stages)
+    return response
+
 @app.route('/')
 def index():
     """Main page"""
     return render_template('index.html')
 
+def detect_upload(stream, upload_digest, budget):
+    """
+    Verdict for one uploaded invoice (an image or a multi-page document)
+    
+    Resubmitted invoices are answered from the verdict cache without decoding them.
+    
+    Returns:
+        (result, image): the image is decoded if a single image was checked,
+        otherwise the stream (for the thumbnail)
+    """
+    cache_token = detector.cache_token()
+    with stage('cache_lookup'):
+        result = verdict_cache.get(upload_digest, cache_token)
+    image = stream
+    
+    if result is None:
+        if is_multipage(stream):
+            # PDFs and multi-page TIFFs: a verdict per page plus one for the document
+            result = detector.detect_document(stream, app.config['PAGE_WORKERS'], budget)
+            stream.seek(0)
+        else:
+            # Open the image straight from the upload stream (no extra in-memory copy),
+            # check its header against the budget and convert it to RGB if necessary
+            image = detector.prepare_image(stream, budget)
+            
+            # Detect if the invoice is fake
+            result = detector.detect_fake_invoice(image)
+        # Only cache if the database did not change while detecting
+        if result.get('hash') and detector.cache_token() == cache_token:
+            verdict_cache.put(upload_digest, cache_token, result)
+    return result, image
+
 @app.route('/upload', methods=['POST'])
 def upload_file():
     """Handle file upload and invoice detection"""
@@ -54,55 +251,279 @@ def upload_file():
             return jsonify({'error': 'No file selected'}), 400
         
         if not allowed_file(file.filename):
-            return jsonify({'error': 'Invalid file type. Please upload an image file.'}), 400
-        
-        # Read and process the image
-        image_data = file.read()
-        image = Image.open(io.BytesIO(image_data))
-        
-        # Convert to RGB if necessary
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
+            return jsonify({'error': 'Invalid file type. Please upload an image or PDF file.'}), 400
         
-        # Detect if the invoice is fake
-        result = detector.detect_fake_invoice(image)
+        preview = request.values.get('preview', app.config['PREVIEW_MODE'])
+        if preview not in PREVIEW_MODES:
+            return jsonify({'error': f"Invalid preview mode. Use one of: {', '.join(PREVIEW_MODES)}"}), 400
         
-        # Convert image to base64 for display
-        img_buffer = io.BytesIO()
-        image.save(img_buffer, format='JPEG', quality=85)
-        img_base64 = base64.b64encode(img_buffer.getvalue()).decode()
+        # The digest was computed while the upload was being received
+        upload_digest = getattr(file.stream, 'digest', None) or digest_stream(file.stream)
+        # Pixel and time budget for everything this request decodes
+        budget = detector.decode_budget()
+        result, image = detect_upload(file.stream, upload_digest, budget)
         
-        # Prepare response
+        # Prepare response; the verdict is all API clients need
         response = {
             'success': True,
             'result': result,
-            'image': f"data:image/jpeg;base64,{img_base64}",
             'filename': secure_filename(file.filename)
         }
         
-        return jsonify(response)
+        if preview == 'thumbnail':
+            with stage('thumbnail'):
+                response['thumbnail'] = get_thumbnail(image, result.get('hash'), app.config['THUMBNAIL_SIZE'], budget)
         
+        with stage('response'):
+            return jsonify(response)
+        
+    except (DecodeBudgetExceeded, Image.DecompressionBombError, RequestEntityTooLarge) as e:
+        # Rejected from the request size or the image header, before the pixels were decoded
+        logger.warning(f"Rejected upload: {e}")
+        return jsonify({'error': str(e)}), 413
     except Exception as e:
         logger.error(f"Error processing upload: {e}")
         return jsonify({'error': f'Error processing image: {str(e)}'}), 500
 
+def iter_batch_files(files):
+    """Yield (filename, bytes) for uploaded images, expanding .zip archives"""
+    for file in files:
+        if file.filename.lower().endswith('.zip'):
+            with zipfile.ZipFile(file.stream) as archive:
+                for member in archive.infolist():
+                    if not member.is_dir() and allowed_file(member.filename):
+                        yield member.filename, archive.read(member)
+        elif allowed_file(file.filename):
+            yield secure_filename(file.filename), file.read()
+        else:
+            yield secure_filename(file.filename), None
+
+@app.route('/upload/batch', methods=['POST'])
+def upload_batch():
+    """
+    Check many invoices in one request
+    
+    Accepts several 'files' fields and/or .zip archives of images. Results are
+    streamed back as NDJSON in completion order, one line per invoice, followed
+    by a summary line.
+    """
+    request.max_content_length = app.config['MAX_BATCH_CONTENT_LENGTH']
+    files = request.files.getlist('files') or request.files.getlist('file')
+    if not files:
+        return jsonify({'error': 'No files uploaded'}), 400
+    
+    # Uploaded files are closed once the view returns, so read them up front;
+    # the detection itself still streams
+    start = time.perf_counter()
+    sources, invalid = [], []
+    for filename, data in iter_batch_files(files):
+        if data is None:
+            invalid.append(filename)
+        else:
+            sources.append((filename, data))
+    
+    def generate():
+        total = fake = 0
+        try:
+            for item in detector.detect_fake_invoices(sources, max_workers=app.config['BATCH_WORKERS']):
+                total += 1
+                fake += 1 if item['result']['is_fake'] else 0
+                yield json.dumps({
+                    'filename': item['name'],
+                    'result': item['result'],
+                    'elapsed_ms': item['elapsed_ms']
+                }) + '\n'
+            
+            for filename in invalid:
+                yield json.dumps({'filename': filename, 'error': 'Invalid file type'}) + '\n'
+        except Exception as e:
+            logger.error(f"Error processing batch upload: {e}")
+            yield json.dumps({'error': f'Error processing batch: {str(e)}'}) + '\n'
+        
+        yield json.dumps({'summary': {
+            'total': total,
+            'fake': fake,
+            'legitimate': total - fake,
+            'invalid': len(invalid),
+            'elapsed_ms': round((time.perf_counter() - start) * 1000, 3)
+        }}) + '\n'
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+def job_lane(file):
+    """Interactive for a small single-page image, bulk otherwise (read from the header only)"""
+    stream = file.stream
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(0)
+    if size > app.config['JOB_SMALL_BYTES'] or is_multipage(stream):
+        return LANE_BULK
+    try:
+        width, height = probe_image(Image.open(stream))['size']
+    except Exception:
+        # Not an image PIL understands; the job reports the error
+        return LANE_INTERACTIVE
+    finally:
+        stream.seek(0)
+    return LANE_INTERACTIVE if width * height <= app.config['JOB_SMALL_PIXELS'] else LANE_BULK
+
+def run_job(job):
+    """Run one /jobs job on a job worker thread (see JobQueue.start_workers)"""
+    if job['kind'] == 'detect':
+        file = job['files'][0]
+        try:
+            with open(file['path'], 'rb') as stream:
+                result, _ = detect_upload(stream, job['digest'], detector.decode_budget())
+        except (DecodeBudgetExceeded, Image.DecompressionBombError) as e:
+            raise ValueError(f"Rejected upload: {e}")
+        except Image.UnidentifiedImageError:
+            raise ValueError(f"{file['name']} is not an image or PDF that can be read")
+        return {'filename': file['name'], 'result': result}
+    
+    # Batch: several images checked on the detector's process pool
+    sources = [(file['name'], file['path']) for file in job['files']]
+    items = list(detector.detect_fake_invoices(sources, max_workers=app.config['BATCH_WORKERS']))
+    items.sort(key=lambda item: item['index'])
+    fake = sum(1 for item in items if item['result']['is_fake'])
+    return {
+        'results': [{'filename': item['name'], 'result': item['result']} for item in items]
+                   + [{'filename': filename, 'error': 'Invalid file type'} for filename in job['invalid']],
+        'summary': {
+            'total': len(items),
+            'fake': fake,
+            'legitimate': len(items) - fake,
+            'invalid': len(job['invalid'])
+        }
+    }
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    """
+    Queue a detection and return its job id right away
+    
+    One 'file' is checked like /upload; several 'files' (or .zip archives)
+    are checked like /upload/batch. Small single-image checks go to the
+    interactive lane and everything else to the bulk lane; 'lane=bulk'
+    sends a small check to the bulk lane too. Poll GET /jobs/<id> for the
+    result.
+    """
+    request.max_content_length = app.config['MAX_BATCH_CONTENT_LENGTH']
+    try:
+        files = request.files.getlist('files') or request.files.getlist('file')
+        if not files or not files[0].filename:
+            return jsonify({'error': 'No file uploaded'}), 400
+        requested_lane = request.values.get('lane')
+        if requested_lane is not None and requested_lane not in LANES:
+            return jsonify({'error': f"Invalid lane. Use one of: {', '.join(LANES)}"}), 400
+        
+        if len(files) == 1 and not files[0].filename.lower().endswith('.zip'):
+            file = files[0]
+            if not allowed_file(file.filename):
+                return jsonify({'error': 'Invalid file type. Please upload an image or PDF file.'}), 400
+            digest = getattr(file.stream, 'digest', None) or digest_stream(file.stream)
+            lane = LANE_BULK if requested_lane == LANE_BULK else job_lane(file)
+            job = job_queue.submit('detect', [(secure_filename(file.filename), file.stream)], lane,
+                                   {'digest': digest})
+        else:
+            sources, invalid = [], []
+            for filename, data in iter_batch_files(files):
+                if data is None:
+                    invalid.append(filename)
+                else:
+                    sources.append((filename, io.BytesIO(data)))
+            job = job_queue.submit('batch', sources, LANE_BULK, {'invalid': invalid})
+    except RequestEntityTooLarge as e:
+        return jsonify({'error': str(e)}), 413
+    except Exception as e:
+        logger.error(f"Error queueing job: {e}")
+        return jsonify({'error': f'Error queueing job: {str(e)}'}), 500
+    
+    response = jsonify(job)
+    response.headers['Location'] = url_for('get_job', job_id=job['job_id'])
+    return response, 202
+
+@app.route('/jobs/<job_id>')
+def get_job(job_id):
+    """
+    Status of a job, with its result once done
+    
+    With ?wait=<seconds> (at most JOB_MAX_WAIT) the request is held until the
+    job finishes or the time is up (long polling).
+    """
+    try:
+        wait = min(max(float(request.args.get('wait', 0)), 0.0), app.config['JOB_MAX_WAIT'])
+    except ValueError:
+        return jsonify({'error': 'wait must be a number of seconds'}), 400
+    job = job_queue.wait(job_id, wait) if wait else job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    response = jsonify(job)
+    if job['status'] not in ('done', 'failed'):
+        response.headers['Retry-After'] = '1'
+    return response
+
+@app.route('/lookup')
+def lookup_fields():
+    """
+    Look up legitimate invoices by ground truth fields without an image
+    
+    Query parameters: any of invoice_no, iban, seller_tax_id, client_tax_id
+    and total, plus an optional image hash to check against the matches.
+    """
+    fields = {field: request.args[field] for field in INDEXED_FIELDS if request.args.get(field)}
+    if not fields:
+        return jsonify({'error': f"Give at least one of: {', '.join(INDEXED_FIELDS)}"}), 400
+    try:
+        return jsonify(detector.lookup_fields(fields, request.args.get('hash') or None))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
 @app.route('/stats')
 def get_stats():
     """Get database statistics"""
     try:
         stats = detector.get_database_stats()
+        stats['verdict_cache'] = verdict_cache.stats()
+        stats['jobs'] = job_queue.stats()
         return jsonify(stats)
     except Exception as e:
         logger.error(f"Error getting stats: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/metrics')
+def metrics():
+    """Prometheus text exposition of stage latencies, database and cache state (per worker process)"""
+    snapshot = detector.snapshot_info()
+    cache = verdict_cache.stats()
+    jobs = job_queue.stats()
+    gauges = {
+        'invoice_db_entries': ('Legitimate invoice hashes in the database', len(detector.legitimate_hashes)),
+        'invoice_db_snapshot_version': ('Database snapshot version loaded by this process',
+                                        snapshot['snapshot_version']),
+        'invoice_db_snapshot_age_seconds': ('Seconds since the database snapshot was loaded',
+                                            snapshot['snapshot_age_seconds']),
+        'invoice_db_snapshot_load_seconds': ('Time it took to load the database snapshot',
+                                             snapshot['snapshot_load_seconds']),
+        'invoice_verdict_cache_entries': ('Verdicts held in the in-process cache', cache['entries']),
+        'invoice_thumbnail_cache_entries': ('Thumbnails held in the in-process cache', len(thumbnail_cache)),
+        'invoice_jobs_queued_interactive': ('Interactive jobs waiting for a worker', jobs[LANE_INTERACTIVE]['queued']),
+        'invoice_jobs_queued_bulk': ('Bulk jobs waiting for a worker', jobs[LANE_BULK]['queued'])
+    }
+    counters = {
+        'invoice_verdict_cache_hits_total': ('Verdict cache hits', cache['hits']),
+        'invoice_verdict_cache_misses_total': ('Verdict cache misses', cache['misses'])
+    }
+    return Response(render_metrics(gauges, counters), mimetype='text/plain; version=0.0.4')
+
 @app.route('/health')
 def health_check():
     """Health check endpoint"""
     return jsonify({
         'status': 'healthy',
-        'database_loaded': len(detector.legitimate_hashes) > 0
+        'database_loaded': len(detector.legitimate_hashes) > 0,
+        **detector.snapshot_info()
     })
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    # Development server; use gunicorn (gunicorn.conf.py) in production
+    create_app().run(debug=True, host='0.0.0.0', port=int(os.environ.get('PORT', 5000)))
@@ -0,0 +1,55 @@
+"""
+Production serving configuration for gunicorn
+
+    gunicorn            # picks up this file from the working directory
+    WEB_WORKERS=8 WEB_THREADS=2 gunicorn
+
+The app is created in the master before the workers are forked, so the
+hash database is loaded once and its pages are shared copy-on-write by all
+workers. Each worker then starts its own hot-reload watcher and is
+recycled after a bounded number of requests. Every worker also runs
+job worker threads for /jobs; they share one SQLite queue (JOBS_PATH).
+"""
+import gc
+import os
+
+# WSGI app factory; the watcher is started per worker in post_fork
+wsgi_app = 'app:create_app(watch=False)'
+preload_app = True
+
+bind = os.environ.get('BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('WEB_WORKERS', os.cpu_count() or 1))
+# Threads per worker; hashing releases the GIL for most of an upload
+threads = int(os.environ.get('WEB_THREADS', 4))
+worker_class = 'gthread' if threads > 1 else 'sync'
+
+# Graceful recycling: a worker finishes its requests and exits after about
+# max_requests, and the master forks a fresh one from the preloaded app
+max_requests = int(os.environ.get('WEB_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.environ.get('WEB_MAX_REQUESTS_JITTER', max_requests // 10))
+timeout = int(os.environ.get('WEB_TIMEOUT', 120))
+graceful_timeout = int(os.environ.get('WEB_GRACEFUL_TIMEOUT', 30))
+
+accesslog = os.environ.get('WEB_ACCESS_LOG')  # '-' logs requests to stdout
+
+def when_ready(server):
+    # Move everything loaded so far out of the garbage collector's reach, so
+    # collections in the workers do not write to (and copy) the shared pages
+    gc.freeze()
+
+def post_fork(server, worker):
+    from app import detector, start_watching, start_job_workers
+    # Recycled workers are forked from the master's snapshot; catch up with
+    # any rebuild or change log entries since it was loaded
+    try:
+        detector.reload_if_changed()
+    except Exception as e:
+        server.log.error(f"Error refreshing hash database in worker {worker.pid}: {e}")
+    start_watching()
+    start_job_workers()
+
+def worker_exit(server, worker):
+    from app import job_queue
+    # Let running jobs finish before a recycled worker exits; jobs cut off
+    # anyway are requeued once their lease expires
+    job_queue.stop_workers(timeout=graceful_timeout)
@@ -1,8 +1,14 @@
 import json
-import pickle
-from collections import Counter
 import logging
 
+try:
+    from scripts.invoice_detector import InvoiceHashDetector
+    from scripts.shard_client import is_remote_database
+except ImportError:
+    # Running from inside scripts/
+    from invoice_detector import InvoiceHashDetector
+    from shard_client import is_remote_database
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -10,58 +16,50 @@ def analyze_hash_database(db_path="legitimate_invoice_hashes.pkl"):
     """Analyze the hash database for insights"""
     
     try:
-        # Load the database
-        with open(db_path, 'rb') as f:
-            db_data = pickle.load(f)
-        
-        legitimate_hashes = db_data['legitimate_hashes']
-        invoice_metadata = db_data['invoice_metadata']
+        # Statistics stored in the database header; pickle entries are not unpickled
+        # and the entries of other formats are not walked
+        summary = InvoiceHashDetector(db_path).read_database_summary()
+        if summary is None:
+            if is_remote_database(db_path):
+                raise ValueError("Databases served by shard servers have no statistics")
+            raise FileNotFoundError(db_path)
+        stats = summary['stats']
         
         logger.info("=== Hash Database Analysis ===")
-        logger.info(f"Total legitimate invoice hashes: {len(legitimate_hashes)}")
-        logger.info(f"Metadata entries: {len(invoice_metadata)}")
-        
-        # Analyze by split
-        split_counter = Counter()
-        source_counter = Counter()
-        
-        for hash_val, metadata in invoice_metadata.items():
-            split_counter[metadata.get('split', 'unknown')] += 1
-            source_counter[metadata.get('source', 'unknown')] += 1
+        logger.info(f"Total legitimate invoice hashes: {summary['total_hashes']}")
+        logger.info(f"Metadata entries: {summary['metadata_entries']}")
         
         logger.info("\n=== Distribution by Split ===")
-        for split, count in split_counter.items():
+        for split, count in stats['distributions']['split'].items():
             logger.info(f"  {split}: {count} invoices")
         
         logger.info("\n=== Distribution by Source ===")
-        for source, count in source_counter.items():
+        for source, count in stats['distributions']['source'].items():
             logger.info(f"  {source}: {count} invoices")
         
         # Sample hash analysis
         logger.info("\n=== Sample Hashes ===")
-        sample_hashes = list(legitimate_hashes)[:10]
+        sample_hashes = stats['sample_hashes']
         for i, hash_val in enumerate(sample_hashes, 1):
             logger.info(f"  {i}. {hash_val}")
         
-        # Hash length analysis
-        if legitimate_hashes:
-            hash_lengths = [len(h) for h in legitimate_hashes]
+        if stats['hash_length']:
             logger.info(f"\n=== Hash Statistics ===")
-            logger.info(f"  Hash length: {hash_lengths[0]} characters (SHA256)")
-            logger.info(f"  All hashes same length: {len(set(hash_lengths)) == 1}")
-        
-        # Check for duplicates (shouldn't be any in a set, but good to verify)
-        logger.info(f"  Unique hashes: {len(legitimate_hashes)}")
-        logger.info(f"  Duplicate check passed: {len(legitimate_hashes) == len(set(legitimate_hashes))}")
+            logger.info(f"  Hash length: {stats['hash_length']} characters ({summary['digest_algorithm']})")
+        if summary['confirm_algorithm']:
+            logger.info(f"  Confirmation digest: {summary['confirm_algorithm']}")
+        logger.info(f"  Unique hashes: {summary['total_hashes']}")
         
         # Save analysis report
         analysis_report = {
-            "total_hashes": len(legitimate_hashes),
-            "metadata_entries": len(invoice_metadata),
-            "split_distribution": dict(split_counter),
-            "source_distribution": dict(source_counter),
+            "total_hashes": summary['total_hashes'],
+            "metadata_entries": summary['metadata_entries'],
+            "split_distribution": stats['distributions']['split'],
+            "source_distribution": stats['distributions']['source'],
             "sample_hashes": sample_hashes,
-            "hash_length": len(list(legitimate_hashes)[0]) if legitimate_hashes else 0
+            "hash_length": stats['hash_length'],
+            "digest_algorithm": summary['digest_algorithm'],
+            "confirm_algorithm": summary['confirm_algorithm']
         }
         
         with open("database_analysis.json", "w") as f:
@@ -0,0 +1,578 @@
+import argparse
+import glob
+import http.client
+import io
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+import logging
+
+import numpy as np
+from PIL import Image
+
+try:
+    from scripts.invoice_detector import InvoiceHashDetector, HASH_MODES
+    from scripts.hash_store import BinaryHashStore
+    from scripts.build_hash_db import HashDatabaseBuilder
+    from scripts.digests import new_digest, available_algorithms
+except ImportError:
+    # Running from inside scripts/ (e.g. python benchmark.py)
+    from invoice_detector import InvoiceHashDetector, HASH_MODES
+    from hash_store import BinaryHashStore
+    from build_hash_db import HashDatabaseBuilder
+    from digests import new_digest, available_algorithms
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_IMAGES_DIR = os.path.join(REPO_ROOT, 'images')
+SECTIONS = ('startup', 'hash', 'digest', 'load', 'upload', 'serve', 'build')
+
+# Synthetic image sizes for hash throughput: thumbnail, screen, A4 at 150 and 300 dpi
+HASH_IMAGE_SIZES = ((256, 256), (1024, 768), (1240, 1754), (2480, 3508))
+DEFAULT_DB_SIZES = (1000, 100000, 10000000)
+# Pickles of more entries than this are skipped by default (tens of GB of RAM at 10M)
+DEFAULT_MAX_PICKLE_ENTRIES = 1000000
+
+# Modules timed by the startup section, with what a server runs after importing
+# them: the web app (created by its factory, which loads the database) and the detector alone
+STARTUP_MODULES = {'app': 'app.create_app(watch=False)', 'scripts.invoice_detector': ''}
+# Build-only dependencies the serving path must not import
+HEAVY_MODULES = ('datasets', 'pyarrow', 'pandas', 'torch', 'transformers', 'multiprocessing')
+
+# Runs in a fresh interpreter, so nothing is imported before the measurement starts
+_STARTUP_CHILD = '''
+import json, sys, time
+start = time.perf_counter()
+import {module}
+{setup}
+seconds = time.perf_counter() - start
+# VmHWM rather than ru_maxrss, which carries over the forking parent's peak
+with open('/proc/self/status') as f:
+    peak_kb = next(int(line.split()[1]) for line in f if line.startswith('VmHWM:'))
+print(json.dumps({{
+    'import_seconds': round(seconds, 4),
+    'peak_rss_mb': round(peak_kb / 1024, 1),
+    'modules': len(sys.modules),
+    'heavy_modules': sorted(name for name in {heavy!r} if name in sys.modules)
+}}))
+'''
+
+def fixture_paths(images_dir):
+    """Bundled invoice images (images/<split>/<split>_image_<idx>.png)"""
+    return sorted(glob.glob(os.path.join(images_dir, '*', '*_image_*')))
+
+def percentiles(samples_ms):
+    """Summary statistics of a list of latencies in milliseconds"""
+    samples = np.asarray(samples_ms, dtype=np.float64)
+    return {
+        'count': int(samples.size),
+        'mean_ms': round(float(samples.mean()), 3),
+        'p50_ms': round(float(np.percentile(samples, 50)), 3),
+        'p90_ms': round(float(np.percentile(samples, 90)), 3),
+        'p99_ms': round(float(np.percentile(samples, 99)), 3),
+        'max_ms': round(float(samples.max()), 3)
+    }
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def synthetic_invoice(width, height, seed=0):
+    """Noisy RGB image of the given size (noise defeats any compression shortcuts)"""
+    rng = np.random.default_rng(seed)
+    return Image.fromarray(rng.integers(0, 256, (height, width, 3), dtype=np.uint8), 'RGB')
+
+def bench_startup(images_dir, work_dir, repeat=5):
+    """Import time and memory of the web app (with its database load) and the detector module"""
+    db_path = os.path.join(work_dir, 'startup-bench.pkl')
+    build_fixture_database(images_dir, db_path)
+    env = dict(os.environ, INVOICE_HASH_DB=db_path, DB_WATCH_INTERVAL='0')
+
+    results = []
+    for module, setup in STARTUP_MODULES.items():
+        code = _STARTUP_CHILD.format(module=module, setup=setup, heavy=HEAVY_MODULES)
+        runs = [
+            json.loads(subprocess.run([sys.executable, '-c', code], cwd=REPO_ROOT, env=env, capture_output=True,
+                                      text=True, check=True).stdout.strip().splitlines()[-1])
+            for _ in range(repeat)
+        ]
+        result = min(runs, key=lambda run: run['import_seconds'])
+        result.update({
+            'module': module,
+            'median_import_seconds': sorted(run['import_seconds'] for run in runs)[len(runs) // 2],
+            'runs': repeat
+        })
+        results.append(result)
+        logger.info(f"startup {module:26} {result['median_import_seconds']:.3f}s median, "
+                    f"{result['peak_rss_mb']} MB peak RSS, heavy modules: {result['heavy_modules'] or 'none'}")
+    return results
+
+def bench_hash(images_dir, repeat=3):
+    """generate_sha256_hash throughput per image size and hash mode"""
+    images = [(f"{w}x{h}", synthetic_invoice(w, h)) for w, h in HASH_IMAGE_SIZES]
+    fixtures = fixture_paths(images_dir)
+    if fixtures:
+        fixture = Image.open(fixtures[0])
+        fixture.load()
+        images.append((f"fixture {fixture.size[0]}x{fixture.size[1]}", fixture.convert('RGB')))
+
+    results = []
+    for hash_mode in HASH_MODES:
+        detector = InvoiceHashDetector(hash_db_path=None, hash_mode=hash_mode)
+        for label, image in images:
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                detector.generate_sha256_hash(image)
+                timings.append(time.perf_counter() - start)
+            best = min(timings)
+            megapixels = image.size[0] * image.size[1] / 1e6
+            results.append({
+                'hash_mode': hash_mode,
+                'image': label,
+                'megapixels': round(megapixels, 3),
+                'best_ms': round(best * 1000, 3),
+                'images_per_second': round(1 / best, 2),
+                'rgb_mb_per_second': round(megapixels * 3 / best, 1)
+            })
+            logger.info(f"hash {hash_mode:5} {label:24} {best * 1000:9.2f} ms")
+    return results
+
+def bench_digest(images_dir, repeat=5):
+    """
+    Per-MB cost of each available digest algorithm on the bundled fixtures
+
+    Measures the digest alone, over what it is fed in each hash mode: the raw
+    RGB pixel buffer (pixel) and the PNG file bytes (png), so decoding and
+    encoding are left out.
+    """
+    fixtures = fixture_paths(images_dir)
+    buffers = {'pixel': [], 'png': []}
+    for path in fixtures:
+        with open(path, 'rb') as f:
+            buffers['png'].append(f.read())
+        with Image.open(path) as image:
+            buffers['pixel'].append(image.convert('RGB').tobytes())
+    if not fixtures:
+        logger.warning(f"No fixtures in {images_dir}, skipping the digest benchmark")
+        return []
+
+    results = []
+    for algorithm in available_algorithms():
+        for kind, payloads in buffers.items():
+            megabytes = sum(len(payload) for payload in payloads) / 1e6
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                for payload in payloads:
+                    digest = new_digest(algorithm)
+                    digest.update(payload)
+                    digest.digest()
+                timings.append(time.perf_counter() - start)
+            best = min(timings)
+            results.append({
+                'algorithm': algorithm,
+                'input': kind,
+                'fixtures': len(payloads),
+                'megabytes': round(megabytes, 3),
+                'ms_per_mb': round(best * 1000 / megabytes, 4),
+                'mb_per_second': round(megabytes / best, 1)
+            })
+            logger.info(f"digest {algorithm:8} {kind:5} {megabytes:8.1f} MB {megabytes / best:9.1f} MB/s")
+    return results
+
+def write_synthetic_database(path, entries, seed=0):
+    """Write a database of random digests with small metadata documents"""
+    rng = np.random.default_rng(seed)
+    digests = rng.integers(0, 256, (entries, 32), dtype=np.uint8)
+    hashes = [row.tobytes().hex() for row in digests]
+    metadata = {h: {'split': 'synthetic', 'index': i, 'source': 'benchmark'} for i, h in enumerate(hashes)}
+
+    if path.endswith('.ihdb'):
+        BinaryHashStore.write(path, hashes, metadata, header={'hash_mode': 'pixel'})
+    else:
+        detector = InvoiceHashDetector(path)
+        detector.legitimate_hashes = set(hashes)
+        detector.invoice_metadata = metadata
+        detector.save_hash_database()
+    return hashes[:1000]
+
+def _load_child(db_path, probe_path):
+    """Runs in a fresh interpreter: load a database and report time, RSS and lookup latency"""
+    import resource
+
+    def rss_mb():
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+
+    with open(probe_path) as f:
+        probes = json.load(f)
+
+    rss_before = rss_mb()
+    detector = InvoiceHashDetector(db_path)
+    start = time.perf_counter()
+    detector.load_hash_database()
+    load_seconds = time.perf_counter() - start
+    rss_loaded = rss_mb()
+
+    start = time.perf_counter()
+    found = sum(1 for h in probes if h in detector.legitimate_hashes)
+    lookup_us = (time.perf_counter() - start) / len(probes) * 1e6
+
+    print(json.dumps({
+        'load_seconds': round(load_seconds, 4),
+        'rss_delta_mb': round(rss_loaded - rss_before, 1),
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'lookup_us': round(lookup_us, 3),
+        'lookups_found': found
+    }))
+
+def bench_load(sizes, formats, max_pickle_entries, work_dir):
+    """load_hash_database time and memory per database size and format"""
+    results = []
+    for entries in sizes:
+        for db_format in formats:
+            if db_format == 'pkl' and entries > max_pickle_entries:
+                logger.info(f"load  skipping {entries} entries as pickle (--max-pickle-entries)")
+                continue
+            path = os.path.join(work_dir, f"synthetic-{entries}.{db_format}")
+            start = time.perf_counter()
+            probes = write_synthetic_database(path, entries)
+            write_seconds = time.perf_counter() - start
+
+            probe_path = path + '.probes.json'
+            with open(probe_path, 'w') as f:
+                json.dump(probes, f)
+            # A fresh interpreter per measurement, so RSS is not polluted by earlier runs
+            child = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--load-child', path, probe_path],
+                capture_output=True, text=True, check=True
+            )
+            result = json.loads(child.stdout.strip().splitlines()[-1])
+            result.update({
+                'entries': entries,
+                'format': db_format,
+                'file_mb': round(os.path.getsize(path) / 2**20, 1),
+                'write_seconds': round(write_seconds, 3)
+            })
+            results.append(result)
+            logger.info(f"load  {db_format:4} {entries:>10} entries: {result['load_seconds']:.4f}s, "
+                        f"+{result['rss_delta_mb']} MB RSS, {result['lookup_us']} us/lookup")
+            for leftover in (path, probe_path, os.path.splitext(path)[0] + '.json', path + '.json'):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+    return results
+
+def build_fixture_database(images_dir, db_path):
+    """Hash every bundled fixture into a database, returning the number of invoices"""
+    detector = InvoiceHashDetector(db_path)
+    for path in fixture_paths(images_dir):
+        detector.index_invoice(path, {'source': 'fixture', 'filename': os.path.basename(path)})
+    detector.save_hash_database()
+    return len(detector.legitimate_hashes)
+
+def upload_payloads(fixtures):
+    """(filename, bytes) of half genuine fixtures, half tampered copies (one changed pixel)"""
+    payloads = []
+    for path in fixtures:
+        with open(path, 'rb') as f:
+            payloads.append((os.path.basename(path), f.read()))
+        image = Image.open(path).convert('RGB')
+        image.putpixel((0, 0), (255, 0, 0))
+        buffer = io.BytesIO()
+        image.save(buffer, format='PNG')
+        payloads.append(('tampered-' + os.path.basename(path), buffer.getvalue()))
+    return payloads
+
+def bench_upload(images_dir, work_dir, concurrency_levels, requests_per_level, verdict_cache=False):
+    """/upload latency percentiles under concurrent load through the Flask test client"""
+    fixtures = fixture_paths(images_dir)
+    if not fixtures:
+        logger.warning(f"No fixtures in {images_dir}, skipping the upload benchmark")
+        return None
+
+    db_path = os.path.join(work_dir, 'upload-bench.pkl')
+    build_fixture_database(images_dir, db_path)
+    # app.py reads its configuration from the environment when imported
+    os.environ['INVOICE_HASH_DB'] = db_path
+    os.environ['DB_WATCH_INTERVAL'] = '0'
+    os.environ['VERDICT_CACHE_SIZE'] = '4096' if verdict_cache else '0'
+    os.environ.pop('VERDICT_CACHE_PATH', None)
+    # /upload only; no job worker threads competing for the CPU
+    os.environ['JOB_WORKERS'] = '0'
+    os.environ['JOBS_PATH'] = os.path.join(work_dir, 'upload-bench-jobs.sqlite')
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+    import app as web_app
+    flask_app = web_app.create_app()
+    payloads = upload_payloads(fixtures)
+
+    results = []
+    for concurrency in concurrency_levels:
+        latencies = []
+        errors = 0
+        lock = threading.Lock()
+        counter = iter(range(requests_per_level))
+
+        def worker():
+            nonlocal errors
+            client = flask_app.test_client()
+            for i in counter:
+                name, data = payloads[i % len(payloads)]
+                start = time.perf_counter()
+                response = client.post('/upload', data={'file': (io.BytesIO(data), name)})
+                elapsed = (time.perf_counter() - start) * 1000
+                with lock:
+                    latencies.append(elapsed)
+                    if response.status_code != 200:
+                        errors += 1
+
+        start = time.perf_counter()
+        threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall_seconds = time.perf_counter() - start
+
+        result = {'concurrency': concurrency, 'errors': errors,
+                  'requests_per_second': round(len(latencies) / wall_seconds, 2)}
+        result.update(percentiles(latencies))
+        results.append(result)
+        logger.info(f"upload concurrency {concurrency:3}: p50 {result['p50_ms']} ms, "
+                    f"p99 {result['p99_ms']} ms, {result['requests_per_second']} req/s")
+    return {'verdict_cache': verdict_cache, 'fixtures': len(fixtures), 'levels': results}
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def _multipart_upload(name, data):
+    """Body and content type of a multipart/form-data /upload request"""
+    boundary = uuid.uuid4().hex
+    body = (f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{name}"\r\n'
+            f'Content-Type: application/octet-stream\r\n\r\n').encode() + data + f'\r\n--{boundary}--\r\n'.encode()
+    return body, f'multipart/form-data; boundary={boundary}'
+
+def _wait_for_server(port, process, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode}")
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            connection.request('GET', '/health')
+            if connection.getresponse().status == 200:
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Server did not answer on port {port} within {timeout}s")
+
+def _drive_server(port, payloads, concurrency, requests_total):
+    """Send requests_total uploads over concurrency connections; returns latencies and errors"""
+    bodies = [_multipart_upload(name, data) for name, data in payloads]
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+    counter = iter(range(requests_total))
+
+    def worker():
+        nonlocal errors
+        for i in counter:
+            body, content_type = bodies[i % len(bodies)]
+            start = time.perf_counter()
+            try:
+                # A new connection per request, as independent API clients would make
+                connection = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+                connection.request('POST', '/upload', body, {'Content-Type': content_type})
+                response = connection.getresponse()
+                response.read()
+                ok = response.status == 200
+                connection.close()
+            except OSError:
+                ok = False
+            elapsed = (time.perf_counter() - start) * 1000
+            with lock:
+                latencies.append(elapsed)
+                errors += not ok
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors, time.perf_counter() - start
+
+def bench_serve(images_dir, work_dir, concurrency_levels, requests_per_level, web_workers=None, web_threads=4):
+    """
+    /upload throughput over HTTP: the Flask development server (python app.py)
+    against gunicorn with gunicorn.conf.py, both on the fixture database
+    """
+    fixtures = fixture_paths(images_dir)
+    if not fixtures:
+        logger.warning(f"No fixtures in {images_dir}, skipping the serve benchmark")
+        return None
+    if shutil.which('gunicorn') is None:
+        logger.warning("gunicorn is not installed, skipping the serve benchmark")
+        return None
+
+    db_path = os.path.join(work_dir, 'serve-bench.pkl')
+    build_fixture_database(images_dir, db_path)
+    payloads = upload_payloads(fixtures)
+    web_workers = web_workers or os.cpu_count() or 1
+    servers = {
+        'dev_server': [sys.executable, 'app.py'],
+        'gunicorn': ['gunicorn', '-c', 'gunicorn.conf.py']
+    }
+
+    results = {}
+    for name, command in servers.items():
+        port = _free_port()
+        env = dict(os.environ, INVOICE_HASH_DB=db_path, DB_WATCH_INTERVAL='0', VERDICT_CACHE_SIZE='0',
+                   JOB_WORKERS='0', JOBS_PATH=os.path.join(work_dir, 'serve-bench-jobs.sqlite'),
+                   PORT=str(port), BIND=f'127.0.0.1:{port}', WEB_WORKERS=str(web_workers),
+                   WEB_THREADS=str(web_threads))
+        env.pop('VERDICT_CACHE_PATH', None)
+        process = subprocess.Popen(command, cwd=REPO_ROOT, env=env,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        levels = []
+        try:
+            _wait_for_server(port, process)
+            for concurrency in concurrency_levels:
+                latencies, errors, wall_seconds = _drive_server(port, payloads, concurrency, requests_per_level)
+                level = {'concurrency': concurrency, 'errors': errors,
+                         'requests_per_second': round(len(latencies) / wall_seconds, 2)}
+                level.update(percentiles(latencies))
+                levels.append(level)
+                logger.info(f"{name} concurrency {concurrency:3}: p50 {level['p50_ms']} ms, "
+                            f"p99 {level['p99_ms']} ms, {level['requests_per_second']} req/s")
+        finally:
+            process.terminate()
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        results[name] = levels
+    return {'fixtures': len(fixtures), 'web_workers': web_workers, 'web_threads': web_threads, **results}
+
+def bench_build(images_dir, work_dir, workers):
+    """HashDatabaseBuilder throughput over the bundled fixtures"""
+    fixtures = fixture_paths(images_dir)
+    if not fixtures:
+        logger.warning(f"No fixtures in {images_dir}, skipping the build benchmark")
+        return None
+
+    db_path = os.path.join(work_dir, 'build-bench.pkl')
+    detector = InvoiceHashDetector(db_path)
+    builder = HashDatabaseBuilder(detector, source='local', images_dir=images_dir, workers=workers,
+                                  shard_size=4, checkpoint_dir=os.path.join(work_dir, 'build-bench.build'))
+    start = time.perf_counter()
+    builder.build()
+    seconds = time.perf_counter() - start
+    result = {
+        'samples': len(fixtures),
+        'invoices': len(detector.legitimate_hashes),
+        'workers': builder.workers,
+        'seconds': round(seconds, 3),
+        'samples_per_second': round(len(fixtures) / seconds, 2)
+    }
+    logger.info(f"build {result['samples']} samples with {result['workers']} workers: "
+                f"{result['samples_per_second']} samples/s")
+    return result
+
+def run_benchmarks(sections=SECTIONS, images_dir=DEFAULT_IMAGES_DIR, db_sizes=DEFAULT_DB_SIZES,
+                   db_formats=('ihdb', 'pkl'), max_pickle_entries=DEFAULT_MAX_PICKLE_ENTRIES,
+                   concurrency_levels=(1, 4, 16), upload_requests=200, verdict_cache=False, workers=None,
+                   web_workers=None, web_threads=4):
+    """
+    Run the selected benchmark sections offline
+
+    Returns:
+        JSON-serializable dictionary of results, with the commit and machine they were measured on
+    """
+    report = {
+        'meta': {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count()
+        }
+    }
+    work_dir = tempfile.mkdtemp(prefix='invoice-bench-')
+    try:
+        if 'startup' in sections:
+            report['startup'] = bench_startup(images_dir, work_dir)
+        if 'hash' in sections:
+            report['hash'] = bench_hash(images_dir)
+        if 'digest' in sections:
+            report['digest'] = bench_digest(images_dir)
+        if 'load' in sections:
+            report['load'] = bench_load(db_sizes, db_formats, max_pickle_entries, work_dir)
+        if 'upload' in sections:
+            report['upload'] = bench_upload(images_dir, work_dir, concurrency_levels, upload_requests,
+                                            verdict_cache)
+        if 'serve' in sections:
+            report['serve'] = bench_serve(images_dir, work_dir, concurrency_levels, upload_requests,
+                                          web_workers, web_threads)
+        if 'build' in sections:
+            report['build'] = bench_build(images_dir, work_dir, workers)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return report
+
+def _int_list(value):
+    return tuple(int(item) for item in value.split(',') if item)
+
+def main():
+    if len(sys.argv) == 4 and sys.argv[1] == '--load-child':
+        logging.disable(logging.INFO)
+        _load_child(sys.argv[2], sys.argv[3])
+        return
+
+    parser = argparse.ArgumentParser(description="Offline benchmarks for startup, hashing, digests, loading, uploads, serving and building")
+    parser.add_argument('--only', default=','.join(SECTIONS), help=f"Comma-separated sections ({', '.join(SECTIONS)})")
+    parser.add_argument('--images-dir', default=DEFAULT_IMAGES_DIR, help="Fixture images/<split>/ directory")
+    parser.add_argument('--db-sizes', type=_int_list, default=DEFAULT_DB_SIZES, help="Synthetic database sizes")
+    parser.add_argument('--db-formats', default='ihdb,pkl', help="Database formats to load (ihdb, pkl)")
+    parser.add_argument('--max-pickle-entries', type=int, default=DEFAULT_MAX_PICKLE_ENTRIES,
+                        help="Skip pickle databases larger than this")
+    parser.add_argument('--concurrency', type=_int_list, default=(1, 4, 16), help="Concurrent /upload clients")
+    parser.add_argument('--upload-requests', type=int, default=200, help="Requests per concurrency level")
+    parser.add_argument('--verdict-cache', action='store_true', help="Keep the verdict cache enabled for /upload")
+    parser.add_argument('--workers', type=int, default=None, help="Build worker processes (default: CPU count)")
+    parser.add_argument('--web-workers', type=int, default=None, help="gunicorn workers for serve (default: CPU count)")
+    parser.add_argument('--web-threads', type=int, default=4, help="Threads per gunicorn worker for serve")
+    parser.add_argument('--output', default='benchmark.json', help="Where to write the JSON results")
+    args = parser.parse_args()
+
+    sections = tuple(section for section in args.only.split(',') if section)
+    unknown = set(sections) - set(SECTIONS)
+    if unknown:
+        parser.error(f"Unknown sections: {', '.join(sorted(unknown))}")
+
+    report = run_benchmarks(sections, args.images_dir, args.db_sizes, tuple(args.db_formats.split(',')),
+                            args.max_pickle_entries, args.concurrency, args.upload_requests,
+                            args.verdict_cache, args.workers, args.web_workers, args.web_threads)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"Benchmark results written to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,273 @@
+import argparse
+import json
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+import logging
+
+try:
+    from scripts.invoice_detector import InvoiceHashDetector, iter_local_dataset, HASH_MODES, HASH_MODE_PIXEL
+    from scripts.digests import DIGEST_ALGORITHMS, DEFAULT_DIGEST_ALGORITHM
+except ImportError:
+    # Running from inside scripts/ (e.g. python build_hash_db.py)
+    from invoice_detector import InvoiceHashDetector, iter_local_dataset, HASH_MODES, HASH_MODE_PIXEL
+    from digests import DIGEST_ALGORITHMS, DEFAULT_DIGEST_ALGORITHM
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+HUB_DATASET = "katanaml-org/invoices-donut-data-v1"
+SPLITS = ('train', 'validation', 'test')
+DEFAULT_SHARD_SIZE = 64
+
+# Detector used for hashing inside worker processes
+_worker_detector = None
+
+def _init_worker(hash_mode, tile_grid=None, digest_algorithm=DEFAULT_DIGEST_ALGORITHM, confirm_algorithm=None):
+    global _worker_detector
+    _worker_detector = InvoiceHashDetector(hash_db_path=None, hash_mode=hash_mode, digest_algorithm=digest_algorithm,
+                                           confirm_algorithm=confirm_algorithm)
+    _worker_detector.tile_grid = tile_grid
+
+def _hash_shard(rows):
+    """
+    Hash one shard inside a worker process
+
+    Args:
+        rows: List of (metadata, image source) tuples; the source is encoded
+            image bytes or a file path
+
+    Returns:
+        List of checkpoint entries ({'hash', 'perceptual_hash', 'metadata'})
+    """
+    entries = []
+    for metadata, source in rows:
+        try:
+            image = _worker_detector.open_image(source)
+            fingerprint = _worker_detector.fingerprint_invoice(image)
+            if fingerprint:
+                metadata = _worker_detector.index_metadata(image, metadata)
+        except Exception as e:
+            logger.error(f"Error processing sample {metadata['index']} in {metadata['split']}: {e}")
+            continue
+        if not fingerprint:
+            continue
+        invoice_hash, perceptual_hash = fingerprint
+        entries.append({
+            'hash': invoice_hash,
+            'perceptual_hash': format(perceptual_hash, 'x'),
+            'metadata': metadata
+        })
+    return entries
+
+class HashDatabaseBuilder:
+    """
+    Parallel, resumable hash database builder
+
+    Each split is cut into shards of shard_size samples. Shards are read in
+    batches, hashed across a process pool and written to checkpoint_dir as
+    soon as they finish; shards that already have a checkpoint are skipped,
+    so an interrupted build resumes where it stopped. Once every shard is
+    done, the checkpoints are merged into the detector's database.
+    """
+
+    def __init__(self, detector, source='hub', images_dir='images', workers=None,
+                 shard_size=DEFAULT_SHARD_SIZE, checkpoint_dir=None, splits=SPLITS):
+        """
+        Args:
+            detector: InvoiceHashDetector to build into (its hash_db_path and hash_mode are used)
+            source: 'hub' for the Hugging Face dataset or 'local' for images_dir
+            images_dir: Local images/<split>/ directory with *_gt_*.txt sidecars
+            workers: Number of worker processes (defaults to the CPU count)
+            shard_size: Samples per shard / checkpoint
+            checkpoint_dir: Where shard checkpoints are kept (defaults to <hash_db_path>.build/)
+            splits: Dataset splits to include
+        """
+        if source not in ('hub', 'local'):
+            raise ValueError(f"Unknown dataset source: {source}")
+        self.detector = detector
+        self.source = source
+        self.images_dir = images_dir
+        self.workers = workers or os.cpu_count() or 1
+        self.shard_size = shard_size
+        self.checkpoint_dir = checkpoint_dir or f"{detector.hash_db_path}.build"
+        self.splits = splits
+
+    def _manifest(self):
+        manifest = {
+            'source': self.source,
+            'images_dir': os.path.abspath(self.images_dir) if self.source == 'local' else None,
+            'hash_mode': self.detector.hash_mode,
+            'shard_size': self.shard_size,
+            'splits': list(self.splits)
+        }
+        if self.detector.tile_grid:
+            # Only recorded when set, so checkpoints made without tiles still resume
+            manifest['tile_grid'] = self.detector.tile_grid
+        if self.detector.digest_algorithm != DEFAULT_DIGEST_ALGORITHM or self.detector.confirm_algorithm:
+            manifest['digest_algorithm'] = self.detector.digest_algorithm
+            manifest['confirm_algorithm'] = self.detector.confirm_algorithm
+        return manifest
+
+    def _prepare_checkpoint_dir(self):
+        """Create the checkpoint directory, refusing to resume a build with different settings"""
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        manifest_path = os.path.join(self.checkpoint_dir, 'manifest.json')
+        manifest = self._manifest()
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'r') as f:
+                existing = json.load(f)
+            if existing != manifest:
+                raise RuntimeError(f"Checkpoints in {self.checkpoint_dir} were made with different build "
+                                   f"settings ({existing}); remove the directory to start over")
+        else:
+            self._write_json(manifest_path, manifest)
+
+    @staticmethod
+    def _write_json(path, data):
+        """Write JSON atomically so an interrupted build never leaves a partial checkpoint"""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def _shard_path(self, split_name, shard):
+        return os.path.join(self.checkpoint_dir, f"{split_name}-{shard:05d}.json")
+
+    def _iter_hub_shards(self):
+        """Yield (split, shard, rows) from the Hugging Face dataset, reading one shard per batch"""
+        from datasets import load_dataset, Image as ImageFeature
+
+        logger.info(f"Loading {HUB_DATASET} dataset from Hugging Face...")
+        dataset = load_dataset(HUB_DATASET)
+        for split_name in self.splits:
+            # Keep the encoded image bytes; decoding happens in the workers
+            split_data = dataset[split_name].cast_column('image', ImageFeature(decode=False))
+            logger.info(f"{split_name} samples: {len(split_data)}")
+            for shard, start in enumerate(range(0, len(split_data), self.shard_size)):
+                if os.path.exists(self._shard_path(split_name, shard)):
+                    continue
+                batch = split_data[start:start + self.shard_size]
+                rows = []
+                for offset, (image, ground_truth) in enumerate(zip(batch['image'], batch['ground_truth'])):
+                    if image is None:
+                        logger.warning(f"No image found in sample {start + offset} of {split_name}")
+                        continue
+                    rows.append((self._metadata(split_name, start + offset, ground_truth, 'donut-data-v1'),
+                                 image.get('bytes') or image.get('path')))
+                yield split_name, shard, rows
+
+    def _iter_local_shards(self):
+        """Yield (split, shard, rows) from a local images/<split>/ directory"""
+        for split_name in self.splits:
+            samples = list(iter_local_dataset(self.images_dir, (split_name,)))
+            logger.info(f"{split_name} samples: {len(samples)}")
+            for shard, start in enumerate(range(0, len(samples), self.shard_size)):
+                if os.path.exists(self._shard_path(split_name, shard)):
+                    continue
+                rows = [
+                    (self._metadata(split_name, idx, ground_truth, 'local'), image_path)
+                    for _, idx, image_path, ground_truth in samples[start:start + self.shard_size]
+                ]
+                yield split_name, shard, rows
+
+    @staticmethod
+    def _metadata(split_name, idx, ground_truth, source):
+        return {
+            'split': split_name,
+            'index': idx,
+            'ground_truth': ground_truth,
+            'source': source
+        }
+
+    def build_shards(self):
+        """Hash every shard that has no checkpoint yet"""
+        self._prepare_checkpoint_dir()
+        shards = self._iter_hub_shards() if self.source == 'hub' else self._iter_local_shards()
+        total_processed = 0
+
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                 initargs=(self.detector.hash_mode, self.detector.tile_grid,
+                                           self.detector.digest_algorithm,
+                                           self.detector.confirm_algorithm)) as executor:
+            pending = {}
+
+            def collect(done):
+                nonlocal total_processed
+                for future in done:
+                    split_name, shard = pending.pop(future)
+                    entries = future.result()
+                    self._write_json(self._shard_path(split_name, shard), entries)
+                    total_processed += len(entries)
+                    logger.info(f"Checkpointed {split_name} shard {shard} "
+                                f"({total_processed} invoices processed this run)")
+
+            for split_name, shard, rows in shards:
+                pending[executor.submit(_hash_shard, rows)] = (split_name, shard)
+                # Bound the number of shards held in memory
+                if len(pending) >= 2 * self.workers:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+
+        return total_processed
+
+    def merge_shards(self):
+        """Merge all shard checkpoints into the detector's database and save it"""
+        shard_files = sorted(
+            name for name in os.listdir(self.checkpoint_dir)
+            if name.endswith('.json') and name != 'manifest.json'
+        )
+        for name in shard_files:
+            with open(os.path.join(self.checkpoint_dir, name), 'r') as f:
+                for entry in json.load(f):
+                    self.detector.add_fingerprint(entry['hash'], int(entry['perceptual_hash'], 16),
+                                                  entry['metadata'])
+
+        logger.info(f"Merged {len(shard_files)} shards: "
+                    f"{len(self.detector.legitimate_hashes)} unique hashes in database")
+        self.detector.save_hash_database()
+
+    def build(self, keep_checkpoints=False):
+        """Build all shards, merge them and (unless keep_checkpoints) remove the checkpoints"""
+        processed = self.build_shards()
+        logger.info(f"Successfully processed {processed} legitimate invoices")
+        self.merge_shards()
+        if not keep_checkpoints:
+            shutil.rmtree(self.checkpoint_dir, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the legitimate invoice hash database")
+    parser.add_argument('--source', choices=('hub', 'local'), default='hub',
+                        help="Hugging Face dataset or a local images/<split>/ directory")
+    parser.add_argument('--images-dir', default="images", help="Local images/<split>/ directory")
+    parser.add_argument('--output', default="legitimate_invoice_hashes.pkl",
+                        help="Database path (.pkl or .ihdb)")
+    parser.add_argument('--hash-mode', choices=HASH_MODES, default=HASH_MODE_PIXEL)
+    parser.add_argument('--algorithm', choices=tuple(DIGEST_ALGORITHMS), default=DEFAULT_DIGEST_ALGORITHM,
+                        help="Digest of the database keys")
+    parser.add_argument('--confirm', choices=tuple(DIGEST_ALGORITHMS), default=None,
+                        help="Dual-key mode: also store this digest and confirm it on every match")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument('--shard-size', type=int, default=DEFAULT_SHARD_SIZE, help="Samples per checkpoint")
+    parser.add_argument('--checkpoint-dir', default=None, help="Checkpoint directory (default: <output>.build)")
+    parser.add_argument('--keep-checkpoints', action='store_true', help="Keep shard checkpoints after merging")
+    parser.add_argument('--tiles', type=int, default=None, metavar='GRID',
+                        help="Store GRID x GRID tile digests per invoice to localize tampering (e.g. 16)")
+    args = parser.parse_args()
+
+    detector = InvoiceHashDetector(args.output, hash_mode=args.hash_mode, digest_algorithm=args.algorithm,
+                                   confirm_algorithm=args.confirm)
+    detector.tile_grid = args.tiles
+    builder = HashDatabaseBuilder(detector, source=args.source, images_dir=args.images_dir,
+                                  workers=args.workers, shard_size=args.shard_size,
+                                  checkpoint_dir=args.checkpoint_dir)
+    builder.build(keep_checkpoints=args.keep_checkpoints)
+
+if __name__ == "__main__":
+    main()
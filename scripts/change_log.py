@@ -0,0 +1,116 @@
+import json
+import os
+import time
+from contextlib import contextmanager
+import logging
+
+try:
+    import fcntl
+except ImportError:
+    # No advisory locks on Windows; a single writer process is assumed there
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+@contextmanager
+def file_lock(path):
+    """Hold an exclusive advisory lock on path (created if missing) for the duration of the block"""
+    with open(path, 'a') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+class HashChangeLog:
+    """
+    Append-only JSONL log of changes made on top of a hash database snapshot
+
+    Every add/revoke is one appended line, so a write costs O(1) I/O no
+    matter how large the database is. Readers remember how far they have
+    read and only parse new lines. Compaction folds the log into a new
+    snapshot and replaces the log with an empty file; readers notice the
+    new file (different inode) and reload the snapshot.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock_path = f"{path}.lock"
+        self._offset = 0
+        self._file_id = None
+
+    @property
+    def position(self):
+        """(file id, byte offset) up to which records have been read"""
+        return self._file_id, self._offset
+
+    def append(self, record):
+        """Durably append one record (a JSON-serializable dict)"""
+        record = dict(record, ts=time.time())
+        line = json.dumps(record) + '\n'
+        with file_lock(self.lock_path):
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def file_id(self):
+        """Identity of the log file currently on disk (compaction replaces it with a new one)"""
+        return self._current_file_id()[0]
+
+    def _current_file_id(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None, 0
+        return (stat.st_dev, stat.st_ino), stat.st_size
+
+    def read_new(self):
+        """
+        Read the records appended since the last call
+
+        Returns:
+            (reset, records) where reset is True if the log was replaced by
+            compaction since the last read, in which case records are read from
+            the start of the new log and the caller must reload the snapshot first
+        """
+        file_id, size = self._current_file_id()
+        reset = self._file_id is not None and file_id != self._file_id
+        if reset or size < self._offset:
+            reset = True
+            self._offset = 0
+        self._file_id = file_id
+
+        if file_id is None or size == self._offset:
+            return reset, []
+
+        records = []
+        with open(self.path, 'rb') as f:
+            f.seek(self._offset)
+            data = f.read(size - self._offset)
+        # Only consume complete lines; a concurrent append may be half-written
+        end = data.rfind(b'\n') + 1
+        for line in data[:end].splitlines():
+            if line.strip():
+                records.append(json.loads(line))
+        self._offset += end
+        return reset, records
+
+    def pending_records(self):
+        """Number of records currently in the log (i.e. not yet compacted)"""
+        if not os.path.exists(self.path):
+            return 0
+        with open(self.path, 'rb') as f:
+            return sum(1 for line in f if line.strip())
+
+    def reset(self):
+        """Replace the log with an empty file; call with the lock held, after compaction"""
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self._offset = 0
+        self._file_id = self._current_file_id()[0]
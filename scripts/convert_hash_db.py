@@ -0,0 +1,56 @@
+import argparse
+import os
+import logging
+
+try:
+    from scripts.invoice_detector import InvoiceHashDetector
+    from scripts.hash_store import BINARY_DB_EXTENSION, DEFAULT_SHARD_COUNT
+except ImportError:
+    # Running from inside scripts/ (e.g. python convert_hash_db.py)
+    from invoice_detector import InvoiceHashDetector
+    from hash_store import BINARY_DB_EXTENSION, DEFAULT_SHARD_COUNT
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def convert_hash_database(db_path="legitimate_invoice_hashes.pkl", output_path=None, shard_count=DEFAULT_SHARD_COUNT):
+    """
+    Convert a hash database between the pickle, binary store and sharded formats
+
+    The output format follows the output path's extension (.ihdb for the
+    memory-mapped binary store, .shards for a sharded store directory,
+    anything else for a pickle).
+
+    Args:
+        db_path: Existing hash database
+        output_path: Destination (defaults to db_path with the .ihdb extension)
+        shard_count: Number of shards when converting to a sharded store
+
+    Returns:
+        Number of converted entries
+    """
+    detector = InvoiceHashDetector(db_path)
+    if not detector.load_hash_database():
+        raise FileNotFoundError(f"Hash database {db_path} not found")
+
+    output_path = output_path or os.path.splitext(db_path)[0] + BINARY_DB_EXTENSION
+    if os.path.abspath(output_path) == os.path.abspath(db_path):
+        raise ValueError("Output path must differ from the input database")
+
+    detector.hash_db_path = output_path
+    detector.shard_count = shard_count
+    detector.save_hash_database()
+    logger.info(f"Converted {len(detector.legitimate_hashes)} entries from {db_path} to {output_path}")
+    return len(detector.legitimate_hashes)
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert a hash database between pickle, binary store and sharded formats")
+    parser.add_argument('--db', default="legitimate_invoice_hashes.pkl", help="Existing hash database")
+    parser.add_argument('--output', default=None, help="Output path (defaults to <db>.ihdb; use <name>.shards to shard)")
+    parser.add_argument('--shards', type=int, default=DEFAULT_SHARD_COUNT, help="Shard count for a .shards output")
+    args = parser.parse_args()
+
+    convert_hash_database(args.db, args.output, args.shards)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+import threading
+from collections import Counter
+from itertools import islice
+
+# Metadata fields whose value distribution is tracked
+DISTRIBUTION_FIELDS = ('split', 'source')
+SAMPLE_SIZE = 5
+
+class DatabaseStats:
+    """
+    Summary statistics of a hash database: entry count, split and source
+    distributions, digest length and a few sample hashes
+
+    Computed once when the database is saved, stored in its header and then
+    kept up to date as invoices are added and revoked, so reading them never
+    walks the database.
+    """
+
+    def __init__(self, count=0, distributions=None, hash_length=0, sample_hashes=None):
+        self.count = count
+        self.distributions = {field: Counter((distributions or {}).get(field, {})) for field in DISTRIBUTION_FIELDS}
+        self.hash_length = hash_length
+        self.sample_hashes = list(sample_hashes or [])
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def compute(cls, hashes, metadata):
+        """
+        Statistics of a database by walking it once
+
+        Args:
+            hashes: Iterable of hex digests
+            metadata: Mapping of hex digest -> metadata dictionary
+        """
+        stats = cls()
+        for invoice_hash in hashes:
+            stats.add(invoice_hash, metadata.get(invoice_hash))
+        return stats
+
+    @staticmethod
+    def _value(metadata, field):
+        return str((metadata or {}).get(field, 'unknown'))
+
+    def add(self, invoice_hash, metadata):
+        with self._lock:
+            self.count += 1
+            for field in DISTRIBUTION_FIELDS:
+                self.distributions[field][self._value(metadata, field)] += 1
+            self.hash_length = self.hash_length or len(invoice_hash)
+            if len(self.sample_hashes) < SAMPLE_SIZE:
+                self.sample_hashes.append(invoice_hash)
+
+    def remove(self, invoice_hash, metadata):
+        with self._lock:
+            self.count -= 1
+            for field in DISTRIBUTION_FIELDS:
+                counter = self.distributions[field]
+                value = self._value(metadata, field)
+                counter[value] -= 1
+                if counter[value] <= 0:
+                    del counter[value]
+            if invoice_hash in self.sample_hashes:
+                self.sample_hashes.remove(invoice_hash)
+
+    def refill_samples(self, hashes):
+        """Top the samples back up from the database after revocations (reads SAMPLE_SIZE entries)"""
+        with self._lock:
+            if len(self.sample_hashes) < min(SAMPLE_SIZE, self.count):
+                self.sample_hashes = list(islice(hashes, SAMPLE_SIZE))
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'count': self.count,
+                'distributions': {field: dict(counter) for field, counter in self.distributions.items()},
+                'hash_length': self.hash_length,
+                'sample_hashes': list(self.sample_hashes)
+            }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['count'], data.get('distributions'), data.get('hash_length', 0), data.get('sample_hashes'))
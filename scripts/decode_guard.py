@@ -0,0 +1,100 @@
+import math
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# info key recording the original size of an image decoded at reduced resolution
+DOWNSAMPLED_KEY = 'downsampled_from'
+
+class DecodeBudgetExceeded(ValueError):
+    """An upload would take more pixels or time to decode than its budget allows"""
+
+def probe_image(image):
+    """
+    Format, size, mode and frame count of an opened but not yet decoded image
+
+    PIL's Image.open only parses the header, so this costs no pixel decoding.
+    """
+    return {
+        'format': image.format,
+        'size': image.size,
+        'mode': image.mode,
+        'frames': getattr(image, 'n_frames', 1)
+    }
+
+class DecodeBudget:
+    """
+    Pixel and time budget for decoding one request
+
+    Every image or page is admitted from its header before it is decoded:
+    one larger than max_image_pixels is rejected (JPEGs are decoded at a
+    reduced scale with Image.draft instead, if that brings them under the
+    limit), pages are charged against max_total_pixels for the request, and
+    nothing new is admitted after max_seconds. Decoding one admitted image
+    is bounded by its pixel count, so memory and latency per request stay
+    bounded too.
+    """
+
+    def __init__(self, max_image_pixels=None, max_total_pixels=None, max_seconds=None, max_frames=None):
+        """
+        Args:
+            max_image_pixels: Largest image or page decoded at full resolution (None: no limit)
+            max_total_pixels: Pixels all pages of the request may decode together
+            max_seconds: Time after which no further page is decoded
+            max_frames: Most frames or pages a document may have
+        """
+        self.max_image_pixels = max_image_pixels
+        self.max_total_pixels = max_total_pixels
+        self.max_seconds = max_seconds
+        self.max_frames = max_frames
+        self.started = time.monotonic()
+        self.pixels = 0
+
+    def check_time(self):
+        if self.max_seconds and time.monotonic() - self.started > self.max_seconds:
+            raise DecodeBudgetExceeded(f"Decoding took longer than the {self.max_seconds:g}s budget")
+
+    def check_frames(self, frames):
+        if self.max_frames and frames > self.max_frames:
+            raise DecodeBudgetExceeded(f"Document has {frames} pages, more than the limit of {self.max_frames}")
+
+    def charge(self, size):
+        """Admit an image of size (width, height) about to be decoded"""
+        self.check_time()
+        pixels = size[0] * size[1]
+        if self.max_image_pixels and pixels > self.max_image_pixels:
+            raise DecodeBudgetExceeded(
+                f"Image of {size[0]}x{size[1]} pixels exceeds the limit of {self.max_image_pixels} pixels"
+            )
+        if self.max_total_pixels and self.pixels + pixels > self.max_total_pixels:
+            raise DecodeBudgetExceeded(f"Request exceeds the budget of {self.max_total_pixels} decoded pixels")
+        self.pixels += pixels
+
+    def admit(self, image):
+        """
+        Admit an opened image before image.load() decodes it
+
+        Returns:
+            The image, possibly switched to a reduced-scale JPEG decode; its
+            info[DOWNSAMPLED_KEY] then holds the original size
+
+        Raises:
+            DecodeBudgetExceeded: If the image is over budget
+        """
+        if not getattr(image, 'tile', None):
+            # Already decoded (or created in memory), nothing left to bound
+            return image
+        probe = probe_image(image)
+        self.check_frames(probe['frames'])
+        width, height = probe['size']
+        if self.max_image_pixels and width * height > self.max_image_pixels and probe['format'] == 'JPEG':
+            # The JPEG decoder can scale by 1/2, 1/4 or 1/8 while decoding, so the
+            # full-resolution pixels are never materialized
+            scale = 2 ** min(3, math.ceil(math.log2(math.sqrt(width * height / self.max_image_pixels))))
+            image.draft('RGB', (width // scale, height // scale))
+            if image.size != (width, height):
+                image.info[DOWNSAMPLED_KEY] = [width, height]
+                logger.info(f"Decoding {width}x{height} JPEG at {image.size[0]}x{image.size[1]}")
+        self.charge(image.size)
+        return image
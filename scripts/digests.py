@@ -0,0 +1,57 @@
+import hashlib
+
+# Digest used for databases whose header names none (every database before
+# algorithms became configurable)
+DEFAULT_DIGEST_ALGORITHM = 'sha256'
+
+# Metadata key holding an invoice's confirmation digest in dual-key databases
+CONFIRM_METADATA_KEY = 'confirm_hash'
+
+def _blake3():
+    try:
+        from blake3 import blake3
+    except ImportError:
+        raise ValueError("The blake3 digest needs the blake3 package (pip install blake3)") from None
+    return blake3(max_threads=1)
+
+# Digest constructors by name. Every digest is 32 bytes, the key size of the
+# binary and sharded stores (hash_store.DIGEST_SIZE), so all of them fit every
+# database format. hashlib's sha256 comes from OpenSSL, which uses the CPU's
+# SHA extensions (SHA-NI / ARMv8 crypto) where available.
+DIGEST_ALGORITHMS = {
+    'sha256': hashlib.sha256,
+    'blake2b': lambda: hashlib.blake2b(digest_size=32),
+    'blake3': _blake3
+}
+
+def new_digest(algorithm=None):
+    """
+    A new hash object of the named algorithm (DEFAULT_DIGEST_ALGORITHM if None)
+
+    Raises:
+        ValueError: If the algorithm is unknown or its package is not installed
+    """
+    algorithm = algorithm or DEFAULT_DIGEST_ALGORITHM
+    try:
+        constructor = DIGEST_ALGORITHMS[algorithm]
+    except KeyError:
+        raise ValueError(f"Unknown digest algorithm: {algorithm} "
+                         f"(choose from {', '.join(DIGEST_ALGORITHMS)})") from None
+    return constructor()
+
+def check_algorithm(algorithm):
+    """Raise ValueError unless the algorithm (if any) can be used here"""
+    if algorithm is not None:
+        new_digest(algorithm)
+    return algorithm
+
+def available_algorithms():
+    """Names of the algorithms usable in this environment"""
+    available = []
+    for algorithm in DIGEST_ALGORITHMS:
+        try:
+            new_digest(algorithm)
+        except ValueError:
+            continue
+        available.append(algorithm)
+    return available
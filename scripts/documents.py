@@ -0,0 +1,108 @@
+import io
+from PIL import Image, ImageSequence
+import logging
+
+logger = logging.getLogger(__name__)
+
+PDF_MAGIC = b'%PDF-'
+# Resolution PDF pages are rasterized at; a database of PDF invoices must be built at the same one
+DEFAULT_PDF_DPI = 150
+
+def _peek(source, size):
+    """First bytes of raw bytes or a seekable binary stream (the stream position is kept)"""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return bytes(source[:size])
+    if hasattr(source, 'read') and hasattr(source, 'seek'):
+        start = source.tell()
+        head = source.read(size)
+        source.seek(start)
+        return head
+    if isinstance(source, str):
+        with open(source, 'rb') as f:
+            return f.read(size)
+    return b''
+
+def is_pdf(source):
+    """Whether bytes, a path or a binary stream hold a PDF"""
+    return _peek(source, len(PDF_MAGIC)) == PDF_MAGIC
+
+def is_multipage(source):
+    """
+    Whether a source should be checked page by page: any PDF, or an image
+    with several frames (multi-page TIFF, animated GIF)
+
+    Only the image header is read; streams are rewound afterwards.
+    """
+    if hasattr(source, 'save'):
+        return getattr(source, 'n_frames', 1) > 1
+    if is_pdf(source):
+        return True
+    start = source.tell() if hasattr(source, 'seek') else None
+    try:
+        image = Image.open(io.BytesIO(source) if isinstance(source, (bytes, bytearray, memoryview)) else source)
+        return getattr(image, 'n_frames', 1) > 1
+    except Exception:
+        # Not an image PIL understands; the single-image path reports the error
+        return False
+    finally:
+        if start is not None:
+            source.seek(start)
+
+def _open_pdf(source):
+    try:
+        import pypdfium2
+    except ImportError:
+        raise ValueError("PDF invoices need the optional pypdfium2 package (pip install pypdfium2)")
+    if isinstance(source, (bytearray, memoryview)):
+        source = bytes(source)
+    return pypdfium2.PdfDocument(source)
+
+def iter_pages(source, dpi=DEFAULT_PDF_DPI, budget=None):
+    """
+    Yield the pages of an invoice document one at a time
+
+    Image frames are read lazily with ImageSequence and PDF pages are
+    rasterized one at a time with pypdfium2, so only the pages being
+    checked are ever held in memory.
+
+    Args:
+        source: PIL Image, bytes, path or binary stream of an image or PDF
+        dpi: Rasterization resolution for PDF pages
+        budget: Optional decode_guard.DecodeBudget each page is charged against
+            before it is rasterized or decoded
+
+    Yields:
+        PIL Images, one per page, independent of each other
+    """
+    if not hasattr(source, 'save') and is_pdf(source):
+        pdf = _open_pdf(source)
+        try:
+            if budget is not None:
+                budget.check_frames(len(pdf))
+            for index in range(len(pdf)):
+                page = pdf[index]
+                try:
+                    if budget is not None:
+                        # Page size in points, known before anything is rasterized
+                        width, height = page.get_size()
+                        budget.charge((round(width * dpi / 72), round(height * dpi / 72)))
+                    yield page.render(scale=dpi / 72).to_pil()
+                finally:
+                    page.close()
+        finally:
+            pdf.close()
+        return
+
+    if hasattr(source, 'save'):
+        image = source
+    elif isinstance(source, (bytes, bytearray, memoryview)):
+        image = Image.open(io.BytesIO(source))
+    else:
+        image = Image.open(source)
+    if budget is not None:
+        budget.check_frames(getattr(image, 'n_frames', 1))
+    for frame in ImageSequence.Iterator(image):
+        if budget is not None:
+            budget.charge(frame.size)
+        # copy() decodes this frame only and detaches it from the next seek
+        yield frame.copy()
@@ -0,0 +1,114 @@
+import argparse
+import json
+import os
+import logging
+
+import numpy as np
+
+try:
+    from scripts.invoice_detector import InvoiceHashDetector
+    from scripts.field_index import extract_fields
+    from scripts.tile_hash import TILE_METADATA_KEY
+    from scripts.hash_store import DIGEST_SIZE
+except ImportError:
+    # Running from inside scripts/
+    from invoice_detector import InvoiceHashDetector
+    from field_index import extract_fields
+    from tile_hash import TILE_METADATA_KEY
+    from hash_store import DIGEST_SIZE
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Metadata fields exported as categorical columns (int32 codes plus labels)
+CATEGORICAL_COLUMNS = ('split', 'source')
+COLUMNS_MANIFEST = 'columns.json'
+
+def export_columns(db_path="legitimate_invoice_hashes.pkl", output_dir=None):
+    """
+    Export a hash database as NumPy column files for ad-hoc analysis
+
+    Every column is a .npy file with one row per invoice, written through a
+    memory map as the database is walked, so exporting needs little memory
+    and the columns can be opened with np.load(path, mmap_mode='r'):
+
+        digest      (N, 32) uint8    image digest
+        split       (N,) int32       code into columns.json labels ('unknown' if missing)
+        source      (N,) int32       code into columns.json labels
+        index       (N,) int64       dataset index (-1 if missing)
+        total       (N,) float64     gross total from the ground truth (NaN if missing)
+        has_tiles   (N,) bool        whether tile digests are stored
+        perceptual  (N, B) uint8     perceptual hash (only if the database has them)
+
+    Args:
+        db_path: Hash database (any format)
+        output_dir: Destination directory (defaults to <db>.columns)
+
+    Returns:
+        Number of exported rows
+    """
+    detector = InvoiceHashDetector(db_path)
+    if not detector.load_hash_database():
+        raise FileNotFoundError(f"Hash database {db_path} not found")
+
+    output_dir = output_dir or os.path.splitext(db_path)[0] + '.columns'
+    os.makedirs(output_dir, exist_ok=True)
+    hashes = detector.legitimate_hashes
+    count = len(hashes)
+
+    def column(name, dtype, shape=()):
+        return np.lib.format.open_memmap(os.path.join(output_dir, f"{name}.npy"), mode='w+',
+                                         dtype=dtype, shape=(count,) + shape)
+
+    digests = column('digest', np.uint8, (DIGEST_SIZE,))
+    categorical = {name: column(name, np.int32) for name in CATEGORICAL_COLUMNS}
+    labels = {name: {} for name in CATEGORICAL_COLUMNS}
+    indexes = column('index', np.int64)
+    totals = column('total', np.float64)
+    has_tiles = column('has_tiles', np.bool_)
+
+    keys = []
+    for row, invoice_hash in enumerate(hashes):
+        keys.append(invoice_hash)
+        metadata = detector.invoice_metadata.get(invoice_hash) or {}
+        digests[row] = np.frombuffer(bytes.fromhex(invoice_hash), dtype=np.uint8)
+        for name in CATEGORICAL_COLUMNS:
+            value = str(metadata.get(name, 'unknown'))
+            categorical[name][row] = labels[name].setdefault(value, len(labels[name]))
+        index = metadata.get('index')
+        indexes[row] = index if isinstance(index, int) else -1
+        total = dict(extract_fields(metadata)).get('total')
+        totals[row] = float(total) if total else np.nan
+        has_tiles[row] = TILE_METADATA_KEY in metadata
+
+    columns = ['digest', *CATEGORICAL_COLUMNS, 'index', 'total', 'has_tiles']
+    if len(detector.perceptual_index) and count:
+        np.save(os.path.join(output_dir, 'perceptual.npy'), detector.perceptual_index.rows_for(keys))
+        columns.append('perceptual')
+
+    for array in (digests, indexes, totals, has_tiles, *categorical.values()):
+        array.flush()
+    with open(os.path.join(output_dir, COLUMNS_MANIFEST), 'w') as f:
+        json.dump({
+            'database': os.path.abspath(db_path),
+            'hash_mode': detector.hash_mode,
+            'digest_algorithm': detector.digest_algorithm,
+            'rows': count,
+            'columns': columns,
+            # Code -> label for each categorical column
+            'labels': {name: list(values) for name, values in labels.items()}
+        }, f, indent=2)
+
+    logger.info(f"Exported {count} rows ({', '.join(columns)}) to {output_dir}")
+    return count
+
+def main():
+    parser = argparse.ArgumentParser(description="Export a hash database as NumPy column files")
+    parser.add_argument('--db', default="legitimate_invoice_hashes.pkl", help="Hash database")
+    parser.add_argument('--output', default=None, help="Output directory (defaults to <db>.columns)")
+    args = parser.parse_args()
+
+    export_columns(args.db, args.output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+import json
+import os
+import re
+import sqlite3
+from decimal import Decimal, InvalidOperation
+import logging
+
+try:
+    from scripts.metadata_store import ReadOnlyDatabase
+except ImportError:
+    # Running from inside scripts/
+    from metadata_store import ReadOnlyDatabase
+
+logger = logging.getLogger(__name__)
+
+FIELD_INDEX_EXTENSION = '.fields'
+
+# Ground truth fields that identify an invoice: where to find them in gt_parse
+FIELD_SOURCES = {
+    'invoice_no': ('header', 'invoice_no'),
+    'iban': ('header', 'iban'),
+    'seller_tax_id': ('header', 'seller_tax_id'),
+    'client_tax_id': ('header', 'client_tax_id'),
+    'total': ('summary', 'total_gross_worth'),
+}
+INDEXED_FIELDS = tuple(FIELD_SOURCES)
+
+def normalize_code(value):
+    """Invoice numbers, IBANs and tax IDs: upper case letters and digits only"""
+    return re.sub(r'[^0-9A-Z]', '', str(value).upper()) or None
+
+def normalize_amount(value):
+    """
+    Amounts such as "$ 1.234,50", "1,234.50" or "96,73" as a plain decimal string ("96.73")
+
+    The last '.' or ',' followed by one or two digits is the decimal separator.
+    """
+    text = re.sub(r'[^0-9.,-]', '', str(value))
+    if not re.search(r'\d', text):
+        return None
+    match = re.search(r'[.,](\d{1,2})$', text)
+    if match:
+        whole, fraction = text[:match.start()], match.group(1)
+    else:
+        whole, fraction = text, '0'
+    whole = re.sub(r'[.,]', '', whole)
+    try:
+        return f"{Decimal(f'{whole or 0}.{fraction}'):.2f}"
+    except InvalidOperation:
+        return None
+
+NORMALIZERS = {
+    'invoice_no': normalize_code,
+    'iban': normalize_code,
+    'seller_tax_id': normalize_code,
+    'client_tax_id': normalize_code,
+    'total': normalize_amount,
+}
+
+def normalize(field, value):
+    """Normalized form of a field value, or None if it is empty or invalid"""
+    if field not in NORMALIZERS:
+        raise ValueError(f"Unknown field: {field}")
+    if value is None or value == '':
+        return None
+    return NORMALIZERS[field](value)
+
+def extract_fields(metadata):
+    """
+    (field, normalized value) pairs from an invoice's ground truth
+
+    The ground truth is the dataset's JSON string (or an already decoded
+    dictionary) of the form {"gt_parse": {"header": {...}, "summary": {...}}}.
+    """
+    ground_truth = (metadata or {}).get('ground_truth')
+    if isinstance(ground_truth, str):
+        try:
+            ground_truth = json.loads(ground_truth)
+        except ValueError:
+            return []
+    if not isinstance(ground_truth, dict):
+        return []
+    parsed = ground_truth.get('gt_parse', ground_truth)
+
+    fields = []
+    for field, (section, key) in FIELD_SOURCES.items():
+        value = (parsed.get(section) or {}).get(key)
+        normalized = normalize(field, value) if value is not None else None
+        if normalized:
+            fields.append((field, normalized))
+    return fields
+
+class FieldIndex:
+    """
+    Maps normalized ground truth fields (invoice number, IBAN, tax IDs,
+    total) to the hashes of the legitimate invoices that carry them
+
+    The index is a SQLite file written with the database, with an index on
+    (field, value), so a lookup is a single index probe. Invoices added
+    after the file was written are kept in an in-memory map on top of it.
+    Revoked invoices are not removed here; callers filter the returned
+    hashes by database membership.
+
+    A save replaces the file; forked workers keep reading the file they
+    inherited (see ReadOnlyDatabase), and an unpickled index re-opens it only
+    if the index there still has its index_id.
+    """
+
+    def __init__(self, path=None, index_id=None, database=None):
+        """
+        Args:
+            path: SQLite file written by FieldIndex.write (None for an in-memory index)
+            index_id: Id of the file, tying it to the database it was written with
+            database: Already open ReadOnlyDatabase of path (when unpickling)
+        """
+        self.path = path
+        self.index_id = index_id
+        self.added = {}
+        self._database = database
+        if path and database is None:
+            self._database = ReadOnlyDatabase(path)
+
+    def __reduce__(self):
+        return (_restore_field_index, (self.path, self.index_id, self.added, self._database))
+
+    def stored_index_id(self):
+        """index_id recorded in the file"""
+        rows = self._database.query("SELECT value FROM info WHERE key = 'index_id'")
+        return rows[0][0] if rows else None
+
+    @classmethod
+    def load(cls, path, index_id):
+        """
+        Open a saved index
+
+        Returns:
+            The index, or None if the file is missing or was written for a
+            different database (index_id does not match)
+        """
+        if not os.path.exists(path):
+            return None
+        try:
+            index = cls(path, index_id)
+            stored_id = index.stored_index_id()
+        except (OSError, sqlite3.Error) as e:
+            logger.warning(f"Ignoring invalid field index {path}: {e}")
+            return None
+        if stored_id != index_id:
+            logger.warning(f"Ignoring field index {path}: it was built for a different database")
+            return None
+        return index
+
+    def lookup(self, field, value):
+        """Hashes of the invoices whose field has this value (normalized first)"""
+        normalized = normalize(field, value)
+        if not normalized:
+            return []
+        hashes = dict.fromkeys(self.added.get((field, normalized), ()))
+        if self.path:
+            rows = self._database.query('SELECT hash FROM fields WHERE field = ? AND value = ?', (field, normalized))
+            hashes.update(dict.fromkeys(row[0] for row in rows))
+        return list(hashes)
+
+    def add(self, invoice_hash, metadata):
+        """Index an invoice added after the file was written"""
+        for field, value in extract_fields(metadata):
+            # Replaced rather than mutated, so concurrent lookups never see a set change size
+            self.added[(field, value)] = self.added.get((field, value), frozenset()) | {invoice_hash}
+
+    @staticmethod
+    def write(path, metadata):
+        """
+        Write the index of a mapping of hash -> metadata to a new SQLite file
+
+        Returns:
+            The id of the new index
+        """
+        index_id = os.urandom(16).hex()
+        tmp_path = f"{path}.tmp"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        connection = sqlite3.connect(tmp_path)
+        try:
+            connection.execute('PRAGMA journal_mode=OFF')
+            connection.execute('CREATE TABLE info (key TEXT PRIMARY KEY, value TEXT)')
+            connection.execute('CREATE TABLE fields (field TEXT, value TEXT, hash TEXT)')
+            connection.execute("INSERT INTO info (key, value) VALUES ('index_id', ?)", (index_id,))
+            connection.executemany(
+                'INSERT INTO fields (field, value, hash) VALUES (?, ?, ?)',
+                ((field, value, invoice_hash)
+                 for invoice_hash, invoice_metadata in metadata.items()
+                 for field, value in extract_fields(invoice_metadata))
+            )
+            # Built after the rows are in, which is much faster than maintaining it per insert
+            connection.execute('CREATE INDEX fields_by_value ON fields (field, value)')
+            connection.commit()
+        finally:
+            connection.close()
+        os.replace(tmp_path, path)
+        return index_id
+
+def _restore_field_index(path, index_id, added, database):
+    index = FieldIndex(path, index_id, database)
+    if path and index.stored_index_id() != index_id:
+        raise FileNotFoundError(f"Field index {path} was replaced by a newer save")
+    index.added = added
+    return index
@@ -0,0 +1,507 @@
+import bisect
+import json
+import mmap
+import os
+import struct
+import time
+from collections.abc import Mapping, Sequence
+from typing import Dict, Iterable, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+# File layout (all integers little-endian):
+#
+#   preamble   MAGIC, format version (u16), header length (u32)
+#   header     JSON: entry count, digest size, hash mode, section offsets, ...
+#   digests    count * DIGEST_SIZE raw digests, sorted ascending
+#   meta_index (count + 1) * u64 offsets into the metadata section
+#   metadata   concatenated UTF-8 JSON documents, one per digest (same order)
+#   perceptual optional count * N bytes of perceptual hashes (same order)
+#
+# Sections start on SECTION_ALIGNMENT boundaries so NumPy can view them in place.
+MAGIC = b'IHDB'
+FORMAT_VERSION = 1
+DIGEST_SIZE = 32
+SECTION_ALIGNMENT = 64
+BINARY_DB_EXTENSION = '.ihdb'
+
+_PREAMBLE = struct.Struct('<4sHI')
+
+def is_binary_store(path):
+    """Whether a database path refers to the binary store format"""
+    return path.endswith(BINARY_DB_EXTENSION)
+
+def _pad(f):
+    """Pad a file being written up to the next section boundary"""
+    remainder = f.tell() % SECTION_ALIGNMENT
+    if remainder:
+        f.write(b'\0' * (SECTION_ALIGNMENT - remainder))
+    return f.tell()
+
+class _DigestSequence(Sequence):
+    """Read-only sequence view of the sorted digests as hex strings"""
+
+    def __init__(self, store):
+        self._store = store
+
+    def __len__(self):
+        return len(self._store)
+
+    def __getitem__(self, position):
+        position = int(position)
+        if position < 0:
+            position += len(self._store)
+        if not 0 <= position < len(self._store):
+            raise IndexError(position)
+        return self._store.digest_at(position)
+
+class _MetadataView(Mapping):
+    """Read-only mapping view of the metadata section; entries are decoded on access"""
+
+    def __init__(self, store):
+        self._store = store
+
+    def __getitem__(self, hex_digest):
+        position = self._store.find(hex_digest)
+        if position < 0:
+            raise KeyError(hex_digest)
+        return self._store.metadata_at(position)
+
+    def __contains__(self, hex_digest):
+        return self._store.find(hex_digest) >= 0
+
+    def __iter__(self):
+        return iter(self._store)
+
+    def __len__(self):
+        return len(self._store)
+
+class BinaryHashStore:
+    """
+    Memory-mapped, read-only hash database
+
+    Opening a store only parses the small header; digests are looked up with a
+    binary search directly on the mapped pages and metadata is decoded per
+    entry on demand. Forked workers share the page cache instead of each
+    holding a private copy of the database.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Zero-length files cannot be mapped
+            self._file.close()
+            raise ValueError(f"{path} is not a hash store (empty file)")
+
+        magic, version, header_length = _PREAMBLE.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a hash store (bad magic {magic!r})")
+        if version != FORMAT_VERSION:
+            self.close()
+            raise ValueError(f"Unsupported hash store version {version} in {path}")
+
+        header_start = _PREAMBLE.size
+        self.header = json.loads(self._mm[header_start:header_start + header_length])
+        self._count = self.header['count']
+        self._sections = self.header['sections']
+        self._digests_offset = self._sections['digests'][0]
+        self._meta_index_offset = self._sections['meta_index'][0]
+        self._metadata_offset = self._sections['metadata'][0]
+
+    def __reduce__(self):
+        # Process pools re-open the mapping instead of pickling its contents
+        return (self.__class__, (self.path,))
+
+    def close(self):
+        self._mm.close()
+        self._file.close()
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, hex_digest):
+        return self.find(hex_digest) >= 0
+
+    def __iter__(self):
+        for position in range(self._count):
+            yield self.digest_at(position)
+
+    def digest_at(self, position):
+        """Hex digest stored at a position of the sorted digest array"""
+        start = self._digests_offset + position * DIGEST_SIZE
+        return self._mm[start:start + DIGEST_SIZE].hex()
+
+    def find(self, hex_digest):
+        """Position of a hex digest in the sorted array, or -1 if absent"""
+        try:
+            digest = bytes.fromhex(hex_digest)
+        except (TypeError, ValueError):
+            return -1
+        if len(digest) != DIGEST_SIZE:
+            return -1
+
+        mm, base = self._mm, self._digests_offset
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            start = base + middle * DIGEST_SIZE
+            if mm[start:start + DIGEST_SIZE] < digest:
+                low = middle + 1
+            else:
+                high = middle
+
+        start = base + low * DIGEST_SIZE
+        if low < self._count and mm[start:start + DIGEST_SIZE] == digest:
+            return low
+        return -1
+
+    def metadata_at(self, position):
+        """Decode the metadata stored for a position"""
+        start, end = struct.unpack_from('<2Q', self._mm, self._meta_index_offset + position * 8)
+        return json.loads(self._mm[self._metadata_offset + start:self._metadata_offset + end])
+
+    @property
+    def digests(self):
+        """Sequence of hex digests in stored (sorted) order"""
+        return _DigestSequence(self)
+
+    @property
+    def metadata(self):
+        """Lazy mapping of hex digest -> metadata"""
+        return _MetadataView(self)
+
+    def perceptual_rows(self):
+        """
+        Zero-copy (count, N) uint8 NumPy view of the perceptual hashes, aligned
+        with the digest order, or None if the store has no perceptual section
+        """
+        if 'perceptual' not in self._sections:
+            return None
+        import numpy as np
+
+        offset, size = self._sections['perceptual']
+        rows = np.frombuffer(self._mm, dtype=np.uint8, count=size, offset=offset)
+        return rows.reshape(self._count, -1) if self._count else rows.reshape(0, 0)
+
+    @staticmethod
+    def write(path, hashes: Iterable[str], metadata: Dict[str, Dict], header: Optional[Dict] = None,
+              perceptual_rows=None):
+        """
+        Write a hash store atomically (to a temporary file, then renamed)
+
+        Args:
+            path: Destination path
+            hashes: Hex digests
+            metadata: Mapping of hex digest -> JSON-serializable metadata
+            header: Extra header fields (e.g. hash_mode)
+            perceptual_rows: Optional callable mapping the sorted hex digests to a
+                (count, N) uint8 array of perceptual hashes
+        """
+        digests = sorted(bytes.fromhex(h) for h in hashes)
+        if any(len(d) != DIGEST_SIZE for d in digests):
+            raise ValueError(f"All digests must be {DIGEST_SIZE} bytes")
+        hex_digests = [d.hex() for d in digests]
+        perceptual = perceptual_rows(hex_digests) if perceptual_rows and digests else None
+
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            # Sections are written first, then the header is filled in. Its size is
+            # reserved generously up front so offsets do not depend on it.
+            header_reserve = 4096 + len(json.dumps(header or {}))
+            f.write(b'\0' * (_PREAMBLE.size + header_reserve))
+            sections = {}
+
+            start = _pad(f)
+            f.write(b''.join(digests))
+            sections['digests'] = [start, f.tell() - start]
+
+            encoded = [json.dumps(metadata.get(h, {})).encode('utf-8') for h in hex_digests]
+            offsets = [0]
+            for document in encoded:
+                offsets.append(offsets[-1] + len(document))
+            start = _pad(f)
+            f.write(struct.pack(f'<{len(offsets)}Q', *offsets))
+            sections['meta_index'] = [start, f.tell() - start]
+
+            start = _pad(f)
+            f.write(b''.join(encoded))
+            sections['metadata'] = [start, f.tell() - start]
+
+            if perceptual is not None:
+                start = _pad(f)
+                f.write(perceptual.tobytes())
+                sections['perceptual'] = [start, f.tell() - start]
+
+            full_header = dict(header or {})
+            full_header.update({'count': len(digests), 'digest_size': DIGEST_SIZE, 'sections': sections})
+            header_bytes = json.dumps(full_header).encode('utf-8')
+            if len(header_bytes) > header_reserve:
+                raise ValueError("Hash store header too large")
+
+            f.seek(0)
+            f.write(_PREAMBLE.pack(MAGIC, FORMAT_VERSION, len(header_bytes)))
+            f.write(header_bytes)
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(tmp_path, path)
+        logger.info(f"Wrote {len(digests)} digests to binary hash store {path}")
+
+class LayeredHashSet:
+    """
+    Set-like view of a read-only base (e.g. a BinaryHashStore) plus in-memory
+    additions and removals, so small changes never copy the whole base
+    """
+
+    def __init__(self, base):
+        self.base = base
+        self.added = set()
+        self.removed = set()
+
+    def __contains__(self, hex_digest):
+        if hex_digest in self.added:
+            return True
+        return hex_digest not in self.removed and hex_digest in self.base
+
+    def __len__(self):
+        return len(self.base) - len(self.removed) + len(self.added)
+
+    def __iter__(self):
+        yield from self.added
+        for hex_digest in self.base:
+            if hex_digest not in self.removed:
+                yield hex_digest
+
+    def add(self, hex_digest):
+        if hex_digest in self.base:
+            self.removed.discard(hex_digest)
+        else:
+            self.added.add(hex_digest)
+
+    def discard(self, hex_digest):
+        self.added.discard(hex_digest)
+        if hex_digest in self.base:
+            self.removed.add(hex_digest)
+
+class LayeredMapping(Mapping):
+    """Mapping counterpart of LayeredHashSet for invoice metadata"""
+
+    def __init__(self, base):
+        self.base = base
+        self.added = {}
+        self.removed = set()
+
+    def __getitem__(self, hex_digest):
+        if hex_digest in self.added:
+            return self.added[hex_digest]
+        if hex_digest in self.removed:
+            raise KeyError(hex_digest)
+        return self.base[hex_digest]
+
+    def __contains__(self, hex_digest):
+        if hex_digest in self.added:
+            return True
+        return hex_digest not in self.removed and hex_digest in self.base
+
+    def __iter__(self):
+        yield from self.added
+        for hex_digest in self.base:
+            if hex_digest not in self.removed and hex_digest not in self.added:
+                yield hex_digest
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __setitem__(self, hex_digest, metadata):
+        self.removed.discard(hex_digest)
+        self.added[hex_digest] = metadata
+
+    def pop(self, hex_digest, default=None):
+        value = self.get(hex_digest, default)
+        self.added.pop(hex_digest, None)
+        if hex_digest in self.base:
+            self.removed.add(hex_digest)
+        return value
+
+SHARDED_DB_EXTENSION = '.shards'
+SHARD_MANIFEST = 'manifest.json'
+DEFAULT_SHARD_COUNT = 16
+
+def is_sharded_store(path):
+    """Whether a database path refers to a sharded store directory"""
+    return path.rstrip('/\\').endswith(SHARDED_DB_EXTENSION)
+
+def shard_of(hex_digest, shard_count):
+    """
+    Shard holding a hex digest: shards cover equal, contiguous ranges of the
+    16-bit digest prefix, so shard order is also global digest order
+    """
+    try:
+        return int(hex_digest[:4], 16) * shard_count >> 16
+    except (TypeError, ValueError):
+        return None
+
+class _ShardedSequence(Sequence):
+    """Read-only sequence of the digests of several shards, in shard order"""
+
+    def __init__(self, stores):
+        self._stores = stores
+        self._starts = []
+        total = 0
+        for store in stores:
+            self._starts.append(total)
+            total += len(store)
+        self._total = total
+
+    def __len__(self):
+        return self._total
+
+    def __getitem__(self, position):
+        position = int(position)
+        if position < 0:
+            position += self._total
+        if not 0 <= position < self._total:
+            raise IndexError(position)
+        shard = bisect.bisect_right(self._starts, position) - 1
+        return self._stores[shard].digest_at(position - self._starts[shard])
+
+class _ShardedMetadataView(Mapping):
+    """Read-only mapping view that routes each lookup to one shard"""
+
+    def __init__(self, store):
+        self._store = store
+
+    def __getitem__(self, hex_digest):
+        shard = self._store.shard_store(hex_digest)
+        if shard is None:
+            raise KeyError(hex_digest)
+        return shard.metadata[hex_digest]
+
+    def __contains__(self, hex_digest):
+        return hex_digest in self._store
+
+    def __iter__(self):
+        return iter(self._store)
+
+    def __len__(self):
+        return len(self._store)
+
+class ShardedHashStore:
+    """
+    Hash database partitioned by digest prefix into independent binary stores
+
+    A directory holds a manifest and one .ihdb file per shard. Lookups touch
+    a single shard's pages, and a process can open just a subset of the
+    shards (e.g. a shard server serving half of the database). Rewrites go
+    to new shard files and then replace the manifest atomically, so readers
+    holding the previous shards keep working.
+    """
+
+    def __init__(self, path, shards=None):
+        """
+        Args:
+            path: Store directory
+            shards: Shard numbers to open (all if None)
+        """
+        self.path = path
+        self.selected = sorted(shards) if shards is not None else None
+        with open(os.path.join(path, SHARD_MANIFEST), 'r') as f:
+            self.header = json.load(f)
+        self.shard_count = self.header['shard_count']
+        numbers = self.selected if self.selected is not None else range(self.shard_count)
+        self._stores = {
+            number: BinaryHashStore(os.path.join(path, self.header['shards'][number]['file']))
+            for number in numbers
+        }
+
+    def __reduce__(self):
+        return (self.__class__, (self.path, self.selected))
+
+    @property
+    def shards(self):
+        """Numbers of the shards opened by this process"""
+        return sorted(self._stores)
+
+    def shard_store(self, hex_digest):
+        """BinaryHashStore that would hold a digest, or None if that shard is not open"""
+        return self._stores.get(shard_of(hex_digest, self.shard_count))
+
+    def close(self):
+        for store in self._stores.values():
+            store.close()
+
+    def __len__(self):
+        return sum(len(store) for store in self._stores.values())
+
+    def __contains__(self, hex_digest):
+        store = self.shard_store(hex_digest)
+        return store is not None and hex_digest in store
+
+    def __iter__(self):
+        for number in self.shards:
+            yield from self._stores[number]
+
+    @property
+    def digests(self):
+        """Sequence of hex digests of the open shards, in global sorted order"""
+        return _ShardedSequence([self._stores[number] for number in self.shards])
+
+    @property
+    def metadata(self):
+        """Lazy mapping of hex digest -> metadata"""
+        return _ShardedMetadataView(self)
+
+    def shard_perceptual_rows(self):
+        """List of (digest sequence, perceptual rows or None) per open shard"""
+        return [(self._stores[number].digests, self._stores[number].perceptual_rows())
+                for number in self.shards]
+
+    @staticmethod
+    def write(path, hashes: Iterable[str], metadata: Dict[str, Dict], header: Optional[Dict] = None,
+              perceptual_rows=None, shard_count=DEFAULT_SHARD_COUNT, manifest_fields: Optional[Dict] = None):
+        """
+        Write a sharded store (see BinaryHashStore.write for the arguments)
+
+        manifest_fields are stored in the manifest only, for fields that describe
+        the whole database rather than each shard (e.g. its statistics).
+
+        Shard files are written under a new generation name first; the
+        manifest is then replaced atomically and old shard files are removed.
+        """
+        groups = [[] for _ in range(shard_count)]
+        for hex_digest in hashes:
+            shard = shard_of(hex_digest, shard_count)
+            if shard is None:
+                raise ValueError(f"Invalid digest: {hex_digest!r}")
+            groups[shard].append(hex_digest)
+
+        os.makedirs(path, exist_ok=True)
+        generation = time.time_ns()
+        shards = []
+        for number, group in enumerate(groups):
+            file_name = f"shard-{number:04d}-{generation}{BINARY_DB_EXTENSION}"
+            BinaryHashStore.write(os.path.join(path, file_name), group, metadata, header, perceptual_rows)
+            shards.append({'file': file_name, 'count': len(group)})
+
+        manifest = dict(header or {})
+        manifest.update(manifest_fields or {})
+        manifest.update({'format': 'sharded', 'shard_count': shard_count, 'count': sum(len(g) for g in groups),
+                         'shards': shards})
+        manifest_path = os.path.join(path, SHARD_MANIFEST)
+        with open(f"{manifest_path}.tmp", 'w') as f:
+            json.dump(manifest, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(f"{manifest_path}.tmp", manifest_path)
+
+        # Old generations are unlinked; processes that still map them keep their pages
+        current = {shard['file'] for shard in shards}
+        for name in os.listdir(path):
+            if name.startswith('shard-') and name.endswith(BINARY_DB_EXTENSION) and name not in current:
+                os.remove(os.path.join(path, name))
+        logger.info(f"Wrote {manifest['count']} digests to {shard_count} shards in {path}")
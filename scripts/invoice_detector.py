@@ -1,29 +1,303 @@
 import hashlib
 import json
 import os
-from datasets import load_dataset
 from PIL import Image
 import io
 import pickle
-from typing import Set, Dict, Any
+import glob
+import re
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Set, Dict, Any, Iterable
 import logging
 
+from itertools import islice
+
+try:
+    from scripts.perceptual_index import PerceptualIndex, MultiPerceptualIndex, DEFAULT_MAX_DISTANCE
+    from scripts.hash_store import (BinaryHashStore, ShardedHashStore, LayeredHashSet, LayeredMapping,
+                                    is_binary_store, is_sharded_store, DEFAULT_SHARD_COUNT, SHARD_MANIFEST)
+    from scripts.shard_client import (ShardRouter, RemoteHashSet, RemoteMetadata, RemotePerceptualIndex,
+                                      is_remote_database)
+    from scripts.change_log import HashChangeLog, file_lock
+    from scripts.metrics import stage, bind_request_timings
+    from scripts.prefilter import BloomFilter, PREFILTER_EXTENSION, DEFAULT_BITS_PER_ENTRY
+    from scripts.metadata_store import MetadataStore, METADATA_EXTENSION, DEFAULT_CACHE_SIZE
+    from scripts.documents import iter_pages, is_multipage, DEFAULT_PDF_DPI
+    from scripts.tile_hash import TileDigests, TILE_METADATA_KEY
+    from scripts.field_index import FieldIndex, FIELD_INDEX_EXTENSION, normalize
+    from scripts.db_stats import DatabaseStats
+    from scripts.decode_guard import DecodeBudget, DecodeBudgetExceeded, DOWNSAMPLED_KEY
+    from scripts.digests import new_digest, check_algorithm, DEFAULT_DIGEST_ALGORITHM, CONFIRM_METADATA_KEY
+except ImportError:
+    # Running from inside scripts/ (e.g. python invoice_detector.py)
+    from perceptual_index import PerceptualIndex, MultiPerceptualIndex, DEFAULT_MAX_DISTANCE
+    from hash_store import (BinaryHashStore, ShardedHashStore, LayeredHashSet, LayeredMapping,
+                            is_binary_store, is_sharded_store, DEFAULT_SHARD_COUNT, SHARD_MANIFEST)
+    from shard_client import (ShardRouter, RemoteHashSet, RemoteMetadata, RemotePerceptualIndex,
+                              is_remote_database)
+    from change_log import HashChangeLog, file_lock
+    from metrics import stage, bind_request_timings
+    from prefilter import BloomFilter, PREFILTER_EXTENSION, DEFAULT_BITS_PER_ENTRY
+    from metadata_store import MetadataStore, METADATA_EXTENSION, DEFAULT_CACHE_SIZE
+    from documents import iter_pages, is_multipage, DEFAULT_PDF_DPI
+    from tile_hash import TileDigests, TILE_METADATA_KEY
+    from field_index import FieldIndex, FIELD_INDEX_EXTENSION, normalize
+    from db_stats import DatabaseStats
+    from decode_guard import DecodeBudget, DecodeBudgetExceeded, DOWNSAMPLED_KEY
+    from digests import new_digest, check_algorithm, DEFAULT_DIGEST_ALGORITHM, CONFIRM_METADATA_KEY
+
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Hash key schemes. 'png' hashes a PNG re-encoding of the image (the original
+# scheme); 'pixel' hashes a small mode/size header followed by the raw RGB
+# pixel buffer, which avoids the PNG compression entirely.
+HASH_MODE_PNG = 'png'
+HASH_MODE_PIXEL = 'pixel'
+HASH_MODES = (HASH_MODE_PNG, HASH_MODE_PIXEL)
+
+# Pages of one document checked concurrently by detect_document
+DEFAULT_PAGE_WORKERS = min(4, os.cpu_count() or 1)
+
+# How often (seconds) a running detector checks the change log for new entries
+DEFAULT_REFRESH_INTERVAL = 1.0
+
+# Change log size after which additions trigger a background compaction
+DEFAULT_COMPACTION_LOG_BYTES = 16 * 1024 * 1024
+
+# Rows of pixels fed to the digest per update in pixel mode (~8MB of RGB at A4/300dpi)
+PIXEL_HASH_STRIP_BYTES = 8 * 1024 * 1024
+
+class HashDatabaseSnapshot:
+    """
+    One consistent version of the hash database
+    
+    A reload builds a complete new snapshot and then swaps it in with a single
+    reference assignment, so readers holding a snapshot never see a half-loaded
+    database. Change log records are applied to the current snapshot in place.
+    """
+    
+    def __init__(self, legitimate_hashes=None, invoice_metadata=None, hash_mode=HASH_MODE_PIXEL,
+                 perceptual_index=None, version=0, source_id=None, prefilter=None, field_index=None,
+                 stats=None, digest_algorithm=DEFAULT_DIGEST_ALGORITHM, confirm_algorithm=None):
+        self.legitimate_hashes: Set[str] = legitimate_hashes if legitimate_hashes is not None else set()
+        self.invoice_metadata: Dict[str, Dict] = invoice_metadata if invoice_metadata is not None else {}
+        self.hash_mode = hash_mode
+        # Digest of the keys, and in dual-key databases the digest stored in each
+        # entry's metadata and compared when a key matches (see digests.py)
+        self.digest_algorithm = digest_algorithm
+        self.confirm_algorithm = confirm_algorithm
+        self.perceptual_index = perceptual_index if perceptual_index is not None else PerceptualIndex()
+        # Optional BloomFilter over legitimate_hashes that rules out most unknown hashes cheaply
+        self.prefilter = prefilter
+        # Optional FieldIndex over the ground truth of the invoices
+        self.field_index = field_index
+        # DatabaseStats kept up to date with every change (None until stored or computed)
+        self.stats = stats
+        self.version = version
+        # (mtime_ns, size, inode) of the database file this snapshot was read from
+        self.source_id = source_id
+        self.loaded_at = time.time()
+        self.load_seconds = 0.0
+        # Changes made directly in memory rather than through the change log
+        self.unlogged_changes = 0
+    
+    def make_writable(self):
+        """Layer in-memory changes over read-only stores instead of copying them"""
+        if not isinstance(self.legitimate_hashes, (set, LayeredHashSet)):
+            self.legitimate_hashes = LayeredHashSet(self.legitimate_hashes)
+        if not isinstance(self.invoice_metadata, (dict, LayeredMapping)):
+            self.invoice_metadata = LayeredMapping(self.invoice_metadata)
+    
+    def add(self, invoice_hash, perceptual_hash, metadata):
+        self.make_writable()
+        # Prefilter and metadata first, so a concurrent reader that sees the hash also finds its metadata
+        if self.prefilter is not None:
+            self.prefilter.add(invoice_hash)
+        if self.field_index is not None:
+            self.field_index.add(invoice_hash, metadata)
+        if self.stats is not None:
+            if invoice_hash in self.legitimate_hashes:
+                self.stats.remove(invoice_hash, self.invoice_metadata.get(invoice_hash))
+            self.stats.add(invoice_hash, metadata)
+        self.invoice_metadata[invoice_hash] = metadata
+        self.legitimate_hashes.add(invoice_hash)
+        if perceptual_hash is not None:
+            self.perceptual_index.add(invoice_hash, perceptual_hash)
+    
+    def remove(self, invoice_hash):
+        if invoice_hash not in self.legitimate_hashes:
+            return False
+        self.make_writable()
+        self.legitimate_hashes.discard(invoice_hash)
+        metadata = self.invoice_metadata.pop(invoice_hash, None)
+        if self.stats is not None:
+            self.stats.remove(invoice_hash, metadata)
+        return True
+    
+    def contains(self, invoice_hash):
+        """Membership test that skips the store for hashes the prefilter rules out"""
+        if self.prefilter is not None and not self.prefilter.might_contain(invoice_hash):
+            return False
+        return invoice_hash in self.legitimate_hashes
+    
+    def apply_log_record(self, record):
+        """Apply one change log record (see HashChangeLog)"""
+        if record['op'] == 'add':
+            self.add(record['hash'], int(record['perceptual_hash'], 16), record['metadata'])
+        elif record['op'] == 'revoke':
+            self.remove(record['hash'])
+        else:
+            logger.warning(f"Ignoring unknown change log operation: {record['op']}")
+
+def _snapshot_attribute(name):
+    """Detector attribute that reads/writes the current snapshot's field"""
+    return property(
+        lambda self: getattr(self._snapshot, name),
+        lambda self, value: setattr(self._snapshot, name, value),
+        doc=f"{name} of the current database snapshot"
+    )
+
 class InvoiceHashDetector:
-    def __init__(self, hash_db_path = "legitimate_invoice_hashes.pkl"):
+    legitimate_hashes = _snapshot_attribute('legitimate_hashes')
+    invoice_metadata = _snapshot_attribute('invoice_metadata')
+    hash_mode = _snapshot_attribute('hash_mode')
+    digest_algorithm = _snapshot_attribute('digest_algorithm')
+    confirm_algorithm = _snapshot_attribute('confirm_algorithm')
+    perceptual_index = _snapshot_attribute('perceptual_index')
+    
+    def __init__(self, hash_db_path = "legitimate_invoice_hashes.pkl", hash_mode = HASH_MODE_PIXEL, shards = None,
+                 digest_algorithm = DEFAULT_DIGEST_ALGORITHM, confirm_algorithm = None):
         """
         Initialize the Invoice Hash Detector
         
         Args:
-            hash_db_path: Path to store/load the hash database
+            hash_db_path: Path to store/load the hash database: a pickle, a
+                memory-mapped binary store (.ihdb), a sharded store directory
+                (.shards) or shard servers (shard://host:port,unix:/path,...)
+            hash_mode: Hash key scheme for new databases ('pixel' or 'png').
+                Loading an existing database switches to the scheme it was built with.
+            shards: Shard numbers to open from a sharded store (all if None)
+            digest_algorithm: Digest of the keys for new databases ('sha256',
+                'blake2b' or 'blake3'; see digests.py). Loading an existing
+                database switches to the algorithm it was built with.
+            confirm_algorithm: Digest confirmed on every key match (dual-key
+                mode), or None to trust the key alone
         """
+        if hash_mode not in HASH_MODES:
+            raise ValueError(f"Unknown hash mode: {hash_mode}")
+        check_algorithm(digest_algorithm)
+        check_algorithm(confirm_algorithm)
+        if confirm_algorithm == digest_algorithm:
+            raise ValueError("The confirmation digest must differ from the key digest")
         self.hash_db_path = hash_db_path
-        self.legitimate_hashes: Set[str] = set()
-        self.invoice_metadata: Dict[str, Dict] = {}
+        self.shards = shards
+        # Shards written by save_hash_database for a new sharded store
+        self.shard_count = DEFAULT_SHARD_COUNT
+        # Size of the prefilter written next to the database (0 disables it)
+        self.prefilter_bits_per_entry = DEFAULT_BITS_PER_ENTRY
+        # Whether saves also write the ground truth field index
+        self.build_field_index = True
+        # Metadata entries kept decoded per process for pickle databases
+        self.metadata_cache_size = DEFAULT_CACHE_SIZE
+        # Resolution PDF invoices are rasterized at before hashing
+        self.pdf_dpi = DEFAULT_PDF_DPI
+        # Tiles per side stored with newly indexed invoices to localize tampering (None: off)
+        self.tile_grid = None
+        # Decode limits per request for prepare_image/detect_document (None: no limit; see decode_guard)
+        self.max_image_pixels = None
+        self.max_request_pixels = None
+        self.max_decode_seconds = None
+        self.max_pages = None
+        self._snapshot = HashDatabaseSnapshot(hash_mode=hash_mode, digest_algorithm=digest_algorithm,
+                                              confirm_algorithm=confirm_algorithm)
+        self.near_duplicate_distance = DEFAULT_MAX_DISTANCE
+        self._batch_executor = None
+        self._batch_workers = None
+        self._batch_snapshot_version = None
+        # Batches running on each process pool; a pool replaced after a reload is
+        # shut down once its last batch is done
+        self._batch_users = {}
+        self._batch_lock = threading.Lock()
+        
+        # Additions/revocations since the last snapshot live in an append-only log
+        # (kept by the shard servers themselves for remote databases)
+        self.change_log = self._open_change_log()
+        self.refresh_interval = DEFAULT_REFRESH_INTERVAL
+        self.compaction_log_bytes = DEFAULT_COMPACTION_LOG_BYTES
+        self._last_refresh = 0.0
+        self._refresh_lock = threading.RLock()
+        self._compaction_thread = None
+        self._watch_thread = None
+        self._watch_stop = None
+        
+    def _open_change_log(self):
+        if not self.hash_db_path or is_remote_database(self.hash_db_path):
+            return None
+        return HashChangeLog(f"{self.hash_db_path}.log")
+    
+    def open_image(self, source):
+        """Open a PIL Image from a PIL Image, raw file bytes or a binary file object"""
+        if hasattr(source, 'save'):
+            return source
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            return Image.open(io.BytesIO(source))
+        # File-like object (e.g. an upload stream); PIL reads it lazily
+        return Image.open(source)
+    
+    def decode_budget(self):
+        """A new DecodeBudget for one request from the decode limits, or None if there are none"""
+        limits = (self.max_image_pixels, self.max_request_pixels, self.max_decode_seconds, self.max_pages)
+        if not any(limits):
+            return None
+        return DecodeBudget(*limits)
+    
+    def prepare_image(self, source, budget=None):
+        """
+        Open an uploaded invoice (bytes, path or file object) and convert it to RGB
+        
+        The header is checked against the decode budget (a new one from
+        decode_budget() if not given) before any pixels are decoded.
+        
+        Raises:
+            DecodeBudgetExceeded: If the image is over budget
+        """
+        budget = budget if budget is not None else self.decode_budget()
+        with stage('decode'):
+            image = self.open_image(source)
+            if budget is not None:
+                image = budget.admit(image)
+            image.load()
+        if image.mode != 'RGB':
+            with stage('rgb_convert'):
+                image = image.convert('RGB')
+        return image
+    
+    def generate_pixel_hash(self, image, algorithm=None):
+        """
+        Generate the canonical pixel digest for an invoice image
+        
+        The digest (the detector's digest_algorithm unless given, SHA256 by
+        default) is taken over a "RGB:<width>x<height>\n" header followed by
+        the raw RGB pixel buffer, fed in horizontal strips so the whole
+        buffer is never copied at once.
+        """
+        image = self.open_image(image)
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
         
+        width, height = image.size
+        digest = new_digest(algorithm or self.digest_algorithm)
+        digest.update(f"RGB:{width}x{height}\n".encode('ascii'))
+        strip_rows = max(1, PIXEL_HASH_STRIP_BYTES // max(1, width * 3))
+        for top in range(0, height, strip_rows):
+            strip = image.crop((0, top, width, min(height, top + strip_rows)))
+            digest.update(strip.tobytes())
+        return digest.hexdigest()
+    
     def image_to_bytes(self, image):
         """Convert PIL Image to bytes for hashing"""
         if hasattr(image, 'save'):
@@ -35,105 +309,331 @@ class InvoiceHashDetector:
             # Already bytes
             return image
     
-    def generate_sha256_hash(self, image):
-        """Generate SHA256 hash for an invoice image"""
+    def generate_sha256_hash(self, image, hash_mode=None, algorithm=None, timing_stage='digest'):
+        """
+        Generate the key digest for an invoice image using the given (or the
+        detector's) hash mode and digest algorithm (SHA256 unless configured)
+        
+        The digest is timed as timing_stage ('confirm' for confirmation digests).
+        """
         try:
-            image_bytes = self.image_to_bytes(image)
-            sha256_hash = hashlib.sha256(image_bytes).hexdigest()
+            if (hash_mode or self.hash_mode) == HASH_MODE_PIXEL:
+                with stage(timing_stage):
+                    return self.generate_pixel_hash(image, algorithm)
+            
+            if hasattr(image, 'read'):
+                image = image.read()
+            with stage('png_encode'):
+                image_bytes = self.image_to_bytes(image)
+            with stage(timing_stage):
+                digest = new_digest(algorithm or self.digest_algorithm)
+                digest.update(image_bytes)
+                sha256_hash = digest.hexdigest()
             return sha256_hash
         except Exception as e:
             logger.error(f"Error generating hash: {e}")
             return None
     
-    def load_dataset_and_build_hash_db(self):
-        """Load the Hugging Face dataset and build hash database"""
-        logger.info("Loading invoices-donut-data-v1 dataset from Hugging Face...")
+    def fingerprint_invoice(self, image):
+        """
+        Compute the exact and perceptual hashes of an invoice
         
-        try:
-            # Load the dataset
-            dataset = load_dataset("katanaml-org/invoices-donut-data-v1")
-            logger.info(f"Dataset loaded successfully!")
-            logger.info(f"Train samples: {len(dataset['train'])}")
-            logger.info(f"Validation samples: {len(dataset['validation'])}")
-            logger.info(f"Test samples: {len(dataset['test'])}")
-            
-            # Process all splits (train, validation, test) as legitimate invoices
-            total_processed = 0
-
-            for split_name in ['train', 'validation', 'test']:
-                logger.info(f"Processing {split_name} split...")
-                split_data = dataset[split_name]
-                
-                for idx in range(len(split_data)):
-                    try:
-                        # Get individual sample
-                        sample = split_data[idx]
-                        
-                        # Extract image and ground_truth more robustly
-                        if isinstance(sample, dict):
-                            image = sample.get('image')
-                            ground_truth = sample.get('ground_truth', {})
-                        else:
-                            # Handle case where sample might have attributes instead of dict keys
-                            image = getattr(sample, 'image', None)
-                            ground_truth = getattr(sample, 'ground_truth', {})
-                        
-                        if image is None:
-                            logger.warning(f"No image found in sample {idx} of {split_name}")
-                            continue
-                        
-                        # Generate hash for the invoice image
-                        invoice_hash = self.generate_sha256_hash(image)
-                        
-                        if invoice_hash:
-                            self.legitimate_hashes.add(invoice_hash)
-                            
-                            # Store metadata
-                            self.invoice_metadata[invoice_hash] = {
-                                'split': split_name,
-                                'index': idx,
-                                'ground_truth': ground_truth,
-                                'source': 'donut-data-v1'
-                            }
-                            
-                            total_processed += 1
-                            
-                            if total_processed % 50 == 0:
-                                logger.info(f"Processed {total_processed} invoices...")
-                                
-                    except Exception as e:
-                        logger.error(f"Error processing sample {idx} in {split_name}: {e}")
-                        continue
+        Returns:
+            (invoice_hash, perceptual_hash) tuple, or None if it could not be hashed
+        """
+        image = self.open_image(image)
+        invoice_hash = self.generate_sha256_hash(image)
+        if not invoice_hash:
+            return None
+        return invoice_hash, self.perceptual_index.compute_hash(image)
+    
+    def tile_metadata(self, image, metadata):
+        """
+        Metadata with the invoice's tile digests added (see tile_hash.py), if
+        tile_grid is set; otherwise the metadata unchanged
+        """
+        if not self.tile_grid:
+            return metadata
+        tiles = TileDigests.compute(self.open_image(image), self.tile_grid)
+        return {**(metadata or {}), TILE_METADATA_KEY: tiles.to_dict()}
+    
+    def index_metadata(self, image, metadata):
+        """
+        Metadata stored with a newly indexed invoice: its tile digests (see
+        tile_metadata) and, in dual-key databases, its confirmation digest
+        """
+        metadata = self.tile_metadata(image, metadata)
+        if not self.confirm_algorithm:
+            return metadata
+        confirm_hash = self.generate_sha256_hash(image, algorithm=self.confirm_algorithm)
+        if not confirm_hash:
+            raise ValueError("Could not generate the confirmation digest")
+        return {**(metadata or {}), CONFIRM_METADATA_KEY: confirm_hash}
+    
+    def add_fingerprint(self, invoice_hash, perceptual_hash, metadata):
+        """Add a precomputed invoice fingerprint to the in-memory database"""
+        self._snapshot.add(invoice_hash, perceptual_hash, metadata)
+        self._snapshot.unlogged_changes += 1
+    
+    def remove_hash(self, invoice_hash):
+        """Remove a hash from the in-memory database; returns whether it was present"""
+        removed = self._snapshot.remove(invoice_hash)
+        if removed:
+            self._snapshot.unlogged_changes += 1
+        return removed
+    
+    def index_invoice(self, image, metadata):
+        """
+        Add a legitimate invoice to the in-memory database
+        
+        Args:
+            image: PIL Image (or anything open_image accepts)
+            metadata: Metadata stored alongside the hash
             
-            logger.info(f"Successfully processed {total_processed} legitimate invoices")
-            logger.info(f"Unique hashes in database: {len(self.legitimate_hashes)}")
+        Returns:
+            The invoice hash, or None if it could not be hashed
+        """
+        image = self.open_image(image)
+        fingerprint = self.fingerprint_invoice(image)
+        if not fingerprint:
+            return None
+        
+        invoice_hash, perceptual_hash = fingerprint
+        self.add_fingerprint(invoice_hash, perceptual_hash, self.index_metadata(image, metadata))
+        return invoice_hash
+    
+    def load_dataset_and_build_hash_db(self, source='hub', images_dir='images', workers=None,
+                                       checkpoint_dir=None):
+        """
+        Load the dataset and build hash database
+        
+        Builds in parallel with per-shard checkpoints (see build_hash_db.py),
+        so an interrupted build resumes where it stopped.
+        
+        Args:
+            source: 'hub' for the Hugging Face dataset or 'local' for images_dir
+            images_dir: Local images/<split>/ directory (for source='local')
+            workers: Number of worker processes (defaults to the CPU count)
+            checkpoint_dir: Where shard checkpoints are kept
+                (defaults to <hash_db_path>.build/)
+        """
+        try:
+            from scripts.build_hash_db import HashDatabaseBuilder
+        except ImportError:
+            from build_hash_db import HashDatabaseBuilder
+        
+        builder = HashDatabaseBuilder(self, source=source, images_dir=images_dir, workers=workers,
+                                      checkpoint_dir=checkpoint_dir)
+        builder.build()
+    
+    def add_invoice(self, image, metadata=None):
+        """
+        Register a new legitimate invoice without rewriting the database
+        
+        The invoice is appended to the change log (O(1) I/O) and applied in
+        memory; other running detectors pick it up on their next refresh.
+        
+        Args:
+            image: PIL Image, image bytes, file path or binary file object
+            metadata: Metadata stored alongside the hash
             
-            # Save the hash database
+        Returns:
+            The invoice hash, or None if it could not be hashed
+        """
+        self._require_change_log()
+        image = self.open_image(image)
+        fingerprint = self.fingerprint_invoice(image)
+        if not fingerprint:
+            return None
+        
+        invoice_hash, perceptual_hash = fingerprint
+        metadata = self.index_metadata(image, metadata if metadata is not None else {'source': 'manual'})
+        self.change_log.append({
+            'op': 'add',
+            'hash': invoice_hash,
+            'perceptual_hash': format(perceptual_hash, 'x'),
+            'metadata': metadata
+        })
+        # Applied by reading it back, so the in-memory state always matches a log position
+        self.refresh()
+        self._maybe_compact()
+        return invoice_hash
+    
+    def revoke_invoice(self, invoice_hash, reason=None):
+        """
+        Revoke a legitimate invoice without rewriting the database
+        
+        Returns:
+            Whether the hash was in the database
+        """
+        self._require_change_log()
+        was_present = invoice_hash in self.legitimate_hashes
+        self.change_log.append({'op': 'revoke', 'hash': invoice_hash, 'reason': reason})
+        self.refresh()
+        return was_present
+    
+    def _require_change_log(self):
+        if self.change_log is None:
+            raise ValueError(f"{self.hash_db_path} cannot be changed from here "
+                             f"(add and revoke invoices on the database file)")
+    
+    def refresh(self):
+        """
+        Apply changes appended to the change log by other processes
+        
+        Returns:
+            Number of applied records
+        """
+        if is_remote_database(self.hash_db_path):
+            # The shard servers apply changes; only their database token is needed here
+            with self._refresh_lock:
+                self._last_refresh = time.monotonic()
+                if isinstance(self.legitimate_hashes, RemoteHashSet):
+                    self._snapshot.source_id = self.legitimate_hashes.router.token()
+            return 0
+        if self.change_log is None:
+            return 0
+        with self._refresh_lock:
+            self._last_refresh = time.monotonic()
+            reset, records = self.change_log.read_new()
+            if reset:
+                # The log was compacted into a new snapshot, which already contains these records
+                logger.info("Change log was compacted, reloading hash database")
+                self.load_hash_database()
+                return 0
+            snapshot = self._snapshot
+            for record in records:
+                snapshot.apply_log_record(record)
+            return len(records)
+    
+    def _maybe_refresh(self):
+        refreshable = self.change_log is not None or is_remote_database(self.hash_db_path)
+        if refreshable and time.monotonic() - self._last_refresh >= self.refresh_interval:
+            self.refresh()
+    
+    def compact_hash_database(self):
+        """Fold the change log into a new database snapshot and start a new, empty log"""
+        with file_lock(self.change_log.lock_path):
+            self.refresh()
             self.save_hash_database()
-            
-        except Exception as e:
-            logger.error(f"Error loading dataset: {e}")
-            raise
+            self.change_log.reset()
+        logger.info(f"Compacted change log into {self.hash_db_path}")
+    
+    def _maybe_compact(self):
+        """Compact in a background thread once the change log grows past compaction_log_bytes"""
+        try:
+            log_size = os.path.getsize(self.change_log.path)
+        except OSError:
+            return
+        if log_size < self.compaction_log_bytes:
+            return
+        if self._compaction_thread is not None and self._compaction_thread.is_alive():
+            return
+        self._compaction_thread = threading.Thread(target=self.compact_hash_database, name='hash-db-compaction')
+        self._compaction_thread.start()
     
     def save_hash_database(self):
         """Save the hash database to disk"""
         try:
-            db_data = {
-                'legitimate_hashes': self.legitimate_hashes,
-                'invoice_metadata': self.invoice_metadata
+            if is_remote_database(self.hash_db_path):
+                raise ValueError("Databases served by shard servers are saved by the servers")
+            header = {
+                'hash_mode': self.hash_mode,
+                'digest_algorithm': self.digest_algorithm,
+                'confirm_algorithm': self.confirm_algorithm,
+                'perceptual_hash_kind': self.perceptual_index.hash_kind,
+                'perceptual_hash_size': self.perceptual_index.hash_size
             }
             
-            with open(self.hash_db_path, 'wb') as f:
-                pickle.dump(db_data, f)
+            if is_sharded_store(self.hash_db_path):
+                base = self.legitimate_hashes.base if isinstance(self.legitimate_hashes, LayeredHashSet) \
+                    else self.legitimate_hashes
+                if isinstance(base, ShardedHashStore) and base.selected is not None:
+                    raise ValueError("Only some shards are open; load all shards to save the database")
+                os.makedirs(self.hash_db_path, exist_ok=True)
+            
+            # The prefilter and field index are written first and the database records
+            # their ids, so a database is never paired with files that miss some of its hashes
+            if self.prefilter_bits_per_entry:
+                prefilter = BloomFilter.build(self.legitimate_hashes, self.prefilter_bits_per_entry)
+                prefilter.write(self._prefilter_path())
+                header['prefilter_id'] = prefilter.filter_id
+            if self.build_field_index:
+                header['field_index_id'] = FieldIndex.write(self._field_index_path(), self.invoice_metadata)
+            # Stored with the database so /stats and analyze_database.py never walk it
+            stats = DatabaseStats.compute(self.legitimate_hashes, self.invoice_metadata)
+            
+            if is_sharded_store(self.hash_db_path):
+                perceptual_hashes = self.perceptual_index.to_dict() if len(self.perceptual_index) else None
+                ShardedHashStore.write(
+                    self.hash_db_path,
+                    self.legitimate_hashes,
+                    self.invoice_metadata,
+                    header=header,
+                    perceptual_rows=(lambda keys: PerceptualIndex(
+                        self.perceptual_index.hash_kind, self.perceptual_index.hash_size
+                    )._to_rows([perceptual_hashes.get(key, 0) for key in keys])) if perceptual_hashes else None,
+                    # Keep the layout of a loaded sharded store
+                    shard_count=base.shard_count if isinstance(base, ShardedHashStore) else self.shard_count,
+                    manifest_fields={'stats': stats.to_dict()}
+                )
+            elif is_binary_store(self.hash_db_path):
+                BinaryHashStore.write(
+                    self.hash_db_path,
+                    self.legitimate_hashes,
+                    self.invoice_metadata,
+                    header=dict(header, stats=stats.to_dict()),
+                    perceptual_rows=self.perceptual_index.rows_for if len(self.perceptual_index) else None
+                )
+            else:
+                # A plain set, in case the database was loaded from a binary store
+                legitimate_hashes = self.legitimate_hashes
+                if not isinstance(legitimate_hashes, set):
+                    legitimate_hashes = set(legitimate_hashes)
+                
+                # Metadata goes to its own file under a new name, so processes still
+                # reading the previous pickle keep the metadata file it refers to
+                metadata_file = (f"{os.path.basename(self.hash_db_path)}.{os.urandom(8).hex()}"
+                                 f"{METADATA_EXTENSION}")
+                MetadataStore.write(self._metadata_path(metadata_file), self.invoice_metadata)
+                
+                # The header is pickled on its own in front of the entries, so
+                # read_database_summary can stop after it
+                db_header = dict(header, metadata_file=metadata_file, stats=stats.to_dict(), entries_follow=True)
+                db_entries = {
+                    'legitimate_hashes': legitimate_hashes,
+                    'perceptual_hashes': {
+                        key: value for key, value in self.perceptual_index.to_dict().items()
+                        if key in legitimate_hashes
+                    }
+                }
+                
+                # Written to a temporary file and renamed, so a process reloading the
+                # database concurrently never reads a half-written pickle
+                tmp_path = f"{self.hash_db_path}.tmp"
+                with open(tmp_path, 'wb') as f:
+                    pickle.dump(db_header, f)
+                    pickle.dump(db_entries, f)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.hash_db_path)
+                self._remove_stale_metadata(metadata_file)
                 
             logger.info(f"Hash database saved to {self.hash_db_path}")
+            self._snapshot.stats = stats
+            if 'field_index_id' in header:
+                # Invoices added in memory are now in the file
+                self._snapshot.field_index = FieldIndex.load(self._field_index_path(), header['field_index_id'])
             
             # Also save as JSON for human readability
-            json_path = self.hash_db_path.replace('.pkl', '.json')
+            json_path = self._summary_path()
             json_data = {
+                'hash_mode': self.hash_mode,
+                'digest_algorithm': self.digest_algorithm,
+                'confirm_algorithm': self.confirm_algorithm,
                 'legitimate_hashes': list(self.legitimate_hashes),
                 'total_hashes': len(self.legitimate_hashes),
-                'metadata_sample': dict(list(self.invoice_metadata.items())[:5])  # Sample metadata
+                'metadata_sample': dict(islice(self.invoice_metadata.items(), 5))  # Sample metadata
             }
             
             with open(json_path, 'w') as f:
@@ -145,40 +645,308 @@ class InvoiceHashDetector:
             logger.error(f"Error saving hash database: {e}")
             raise
     
-    def load_hash_database(self):
-        """Load the hash database from disk"""
+    def _metadata_path(self, metadata_file):
+        return os.path.join(os.path.dirname(os.path.abspath(self.hash_db_path)), metadata_file)
+    
+    def _remove_stale_metadata(self, current_file):
+        """Delete metadata files of earlier saves of a pickle database"""
+        pattern = f"{glob.escape(self._metadata_path(os.path.basename(self.hash_db_path)))}.*{METADATA_EXTENSION}"
+        for path in glob.glob(pattern):
+            if os.path.basename(path) != current_file:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+    
+    def _summary_path(self):
+        """Where the JSON summary of the database is written"""
+        if is_binary_store(self.hash_db_path) or is_sharded_store(self.hash_db_path):
+            # Named after the whole path so foo.ihdb and foo.shards don't share foo.json
+            return self.hash_db_path + '.json'
+        return os.path.splitext(self.hash_db_path)[0] + '.json'
+    
+    def _prefilter_path(self):
+        """Where the prefilter of the database is kept"""
+        if is_sharded_store(self.hash_db_path):
+            return os.path.join(self.hash_db_path, 'prefilter' + PREFILTER_EXTENSION)
+        return self.hash_db_path + PREFILTER_EXTENSION
+    
+    def _field_index_path(self):
+        """Where the ground truth field index of the database is kept"""
+        if is_sharded_store(self.hash_db_path):
+            return os.path.join(self.hash_db_path, 'index' + FIELD_INDEX_EXTENSION)
+        return self.hash_db_path + FIELD_INDEX_EXTENSION
+    
+    def _database_file_id(self):
+        """(mtime_ns, size, inode) of the database file, or None if it does not exist"""
+        if not self.hash_db_path or is_remote_database(self.hash_db_path):
+            return None
+        path = self.hash_db_path
+        if is_sharded_store(path):
+            # The manifest is replaced atomically whenever the shards are rewritten
+            path = os.path.join(path, SHARD_MANIFEST)
         try:
-            if os.path.exists(self.hash_db_path):
-                with open(self.hash_db_path, 'rb') as f:
-                    db_data = pickle.load(f)
+            stat = os.stat(path)
+        except (OSError, TypeError):
+            return None
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+    
+    def _read_snapshot(self):
+        """Read the database file into a new snapshot, or return None if it does not exist"""
+        if is_remote_database(self.hash_db_path):
+            router = ShardRouter.from_url(self.hash_db_path)
+            snapshot = HashDatabaseSnapshot(RemoteHashSet(router), RemoteMetadata(router), router.hash_mode,
+                                            RemotePerceptualIndex(router),
+                                            digest_algorithm=check_algorithm(router.digest_algorithm),
+                                            confirm_algorithm=check_algorithm(router.confirm_algorithm))
+            snapshot.source_id = router.token()
+            logger.info(f"Connected to {len(router.clients)} shard servers "
+                        f"({router.shard_count} shards, hash mode: {snapshot.hash_mode})")
+            return snapshot
+        
+        source_id = self._database_file_id()
+        if source_id is None:
+            return None
+        
+        if is_sharded_store(self.hash_db_path):
+            # Shards are memory-mapped; only the manifest and shard headers are read here
+            store = ShardedHashStore(self.hash_db_path, self.shards)
+            kind = store.header.get('perceptual_hash_kind', 'phash')
+            size = store.header.get('perceptual_hash_size', 16)
+            perceptual_index = MultiPerceptualIndex(
+                [PerceptualIndex.from_rows(digests, rows, kind, size)
+                 for digests, rows in store.shard_perceptual_rows() if rows is not None]
+                + [PerceptualIndex(kind, size)]
+            )
+            snapshot = HashDatabaseSnapshot(
+                store, store.metadata, store.header.get('hash_mode', HASH_MODE_PNG), perceptual_index
+            )
+            prefilter_id = store.header.get('prefilter_id')
+            field_index_id = store.header.get('field_index_id')
+            header = store.header
+            # The stored statistics cover all shards
+            stats = store.header.get('stats') if store.selected is None else None
+            logger.info(f"Sharded hash store loaded from {self.hash_db_path} "
+                        f"(shards {store.shards} of {store.shard_count}, hash mode: {snapshot.hash_mode})")
+        elif is_binary_store(self.hash_db_path):
+            # Only the header is read here; digests and metadata stay memory-mapped
+            store = BinaryHashStore(self.hash_db_path)
+            rows = store.perceptual_rows()
+            if rows is not None:
+                perceptual_index = PerceptualIndex.from_rows(
+                    store.digests, rows,
+                    store.header.get('perceptual_hash_kind', 'phash'),
+                    store.header.get('perceptual_hash_size', 16)
+                )
+            else:
+                perceptual_index = PerceptualIndex()
+            
+            snapshot = HashDatabaseSnapshot(
+                store, store.metadata, store.header.get('hash_mode', HASH_MODE_PNG), perceptual_index
+            )
+            prefilter_id = store.header.get('prefilter_id')
+            field_index_id = store.header.get('field_index_id')
+            header = store.header
+            stats = store.header.get('stats')
+            logger.info(f"Binary hash store loaded from {self.hash_db_path} (hash mode: {snapshot.hash_mode})")
+        else:
+            with open(self.hash_db_path, 'rb') as f:
+                db_data = pickle.load(f)
+                if db_data.get('entries_follow'):
+                    db_data.update(pickle.load(f))
+            
+            if 'metadata_file' in db_data:
+                invoice_metadata = MetadataStore(self._metadata_path(db_data['metadata_file']),
+                                                 self.metadata_cache_size)
+            else:
+                # Older pickles hold the metadata inline
+                invoice_metadata = db_data['invoice_metadata']
+            
+            snapshot = HashDatabaseSnapshot(
+                db_data['legitimate_hashes'],
+                invoice_metadata,
+                # Databases written before hash modes existed use PNG keys
+                db_data.get('hash_mode', HASH_MODE_PNG),
+                PerceptualIndex.from_dict(
+                    db_data.get('perceptual_hashes', {}),
+                    db_data.get('perceptual_hash_kind', 'phash'),
+                    db_data.get('perceptual_hash_size', 16)
+                )
+            )
+            prefilter_id = db_data.get('prefilter_id')
+            field_index_id = db_data.get('field_index_id')
+            header = db_data
+            stats = db_data.get('stats')
+            logger.info(f"Hash database loaded from {self.hash_db_path} (hash mode: {snapshot.hash_mode})")
+        
+        # Databases written before digest algorithms were configurable use SHA256 keys
+        snapshot.digest_algorithm = check_algorithm(header.get('digest_algorithm') or DEFAULT_DIGEST_ALGORITHM)
+        snapshot.confirm_algorithm = check_algorithm(header.get('confirm_algorithm'))
+        if prefilter_id:
+            snapshot.prefilter = BloomFilter.load(self._prefilter_path(), prefilter_id)
+        if field_index_id:
+            snapshot.field_index = FieldIndex.load(self._field_index_path(), field_index_id)
+        if stats:
+            snapshot.stats = DatabaseStats.from_dict(stats)
+        snapshot.source_id = source_id
+        return snapshot
+    
+    def load_hash_database(self):
+        """
+        Load the hash database from disk
+        
+        The new snapshot (database file plus change log) is built completely
+        before it replaces the current one, so this is safe to call while other
+        threads are detecting; on failure the current snapshot is kept.
+        
+        If another process compacts the database between reading the file and
+        its change log, the log read belongs to the newer file and the records
+        of the older one would be lost, so the database is read again. (A log
+        read just before a compaction can be replayed onto the newer file: the
+        file already holds the state its records lead to.)
+        """
+        with self._refresh_lock:
+            try:
+                start = time.perf_counter()
+                while True:
+                    change_log = self._open_change_log()
+                    log_file_id = change_log.file_id() if change_log is not None else None
+                    snapshot = self._read_snapshot()
+                    if snapshot is None:
+                        logger.warning(f"Hash database file {self.hash_db_path} not found")
+                        return False
                     
-                self.legitimate_hashes = db_data['legitimate_hashes']
-                self.invoice_metadata = db_data['invoice_metadata']
+                    # Replay the changes made since this snapshot was written
+                    records = change_log.read_new()[1] if change_log is not None else []
+                    if change_log is None or change_log.position[0] == log_file_id:
+                        break
+                    logger.info("Change log was compacted while loading, reading the database again")
+                
+                for record in records:
+                    snapshot.apply_log_record(record)
+                if records:
+                    logger.info(f"Applied {len(records)} change log entries")
+                
+                snapshot.version = self._snapshot.version + 1
+                snapshot.load_seconds = time.perf_counter() - start
+                snapshot.loaded_at = time.time()
+                
+                # Atomic swap: readers see either the old or the new snapshot
+                self._snapshot = snapshot
+                self.change_log = change_log
+                self._last_refresh = time.monotonic()
                 
-                logger.info(f"Hash database loaded from {self.hash_db_path}")
-                logger.info(f"Loaded {len(self.legitimate_hashes)} legitimate invoice hashes")
+                logger.info(f"Loaded {len(snapshot.legitimate_hashes)} legitimate invoice hashes "
+                            f"(snapshot v{snapshot.version}, {snapshot.load_seconds:.3f}s)")
                 return True
-            else:
-                logger.warning(f"Hash database file {self.hash_db_path} not found")
-                return False
                 
-        except Exception as e:
-            logger.error(f"Error loading hash database: {e}")
-            return False
+            except Exception as e:
+                logger.error(f"Error loading hash database: {e}")
+                return False
+    
+    def watch_database(self, interval=2.0):
+        """
+        Hot-reload the database in a background thread
+        
+        Every interval seconds the database file is checked (mtime, size and
+        inode); when it changed, a new snapshot is loaded and swapped in.
+        Otherwise new change log entries are applied.
+        """
+        if self._watch_thread is not None and self._watch_thread.is_alive():
+            return
+        self._watch_stop = threading.Event()
+        self._watch_thread = threading.Thread(
+            target=self._watch_loop, args=(interval, self._watch_stop), name='hash-db-watcher', daemon=True
+        )
+        self._watch_thread.start()
+    
+    def stop_watching(self):
+        """Stop the hot-reload thread started by watch_database"""
+        if self._watch_stop is not None:
+            self._watch_stop.set()
+            self._watch_thread.join()
+            self._watch_thread = None
+    
+    def reload_if_changed(self):
+        """
+        Load the database again if its file changed, otherwise apply new change log entries
+        
+        Returns:
+            True if a new snapshot was loaded
+        """
+        file_id = self._database_file_id()
+        if file_id is not None and file_id != self._snapshot.source_id:
+            logger.info(f"{self.hash_db_path} changed, reloading")
+            self.load_hash_database()
+            return True
+        self.refresh()
+        return False
+    
+    def _watch_loop(self, interval, stop):
+        while not stop.wait(interval):
+            try:
+                self.reload_if_changed()
+            except Exception as e:
+                logger.error(f"Error watching hash database: {e}")
+    
+    def cache_token(self):
+        """
+        Token identifying the current database contents, for caching verdicts
+        
+        Built from the database file identity and the change log position, so
+        detectors in different processes that see the same data share tokens.
+        In-memory changes that bypass the log make the token process-specific.
+        """
+        # Pick up changes from other processes first, as detect_fake_invoice would
+        self._maybe_refresh()
+        snapshot = self._snapshot
+        log_id, log_offset = self.change_log.position if self.change_log is not None else (None, 0)
+        token = f"{snapshot.source_id}:{log_id}:{log_offset}"
+        if snapshot.unlogged_changes:
+            token += f"+{os.getpid()}.{snapshot.version}.{snapshot.unlogged_changes}"
+        return token
+    
+    def snapshot_info(self):
+        """Version and load timing of the current database snapshot"""
+        snapshot = self._snapshot
+        return {
+            'snapshot_version': snapshot.version,
+            'snapshot_loaded_at': time.strftime('%Y-%m-%dT%H:%M:%S%z', time.localtime(snapshot.loaded_at)),
+            'snapshot_load_seconds': round(snapshot.load_seconds, 6),
+            'snapshot_age_seconds': round(time.time() - snapshot.loaded_at, 3)
+        }
     
     def detect_fake_invoice(self, invoice_image):
         """
         Detect if an invoice is fake based on hash comparison
         
         Args:
-            invoice_image: PIL Image or image bytes
+            invoice_image: PIL Image, image bytes or a binary file object
             
         Returns:
             Dictionary with detection results
         """
         try:
+            # Pick up invoices added or revoked by other processes
+            self._maybe_refresh()
+            # Use one snapshot throughout, even if a reload swaps in a new one meanwhile
+            snapshot = self._snapshot
+            
+            # Consume streams once so the exact and perceptual checks can share them
+            if hasattr(invoice_image, 'read'):
+                if snapshot.hash_mode == HASH_MODE_PIXEL:
+                    invoice_image = self.open_image(invoice_image)
+                else:
+                    invoice_image = invoice_image.read()
+            
+            downsampled_from = getattr(invoice_image, 'info', {}).get(DOWNSAMPLED_KEY)
+            if downsampled_from:
+                # Decoded at reduced scale (see decode_guard): the exact digest of these
+                # pixels means nothing, but the perceptual hash still finds near matches
+                return self._detect_downsampled(snapshot, invoice_image, downsampled_from)
+            
             # Generate hash for the input invoice
-            invoice_hash = self.generate_sha256_hash(invoice_image)
+            invoice_hash = self.generate_sha256_hash(invoice_image, snapshot.hash_mode)
             
             if not invoice_hash:
                 return {
@@ -189,7 +957,20 @@ class InvoiceHashDetector:
                 }
             
             # Check if hash exists in legitimate database
-            is_legitimate = invoice_hash in self.legitimate_hashes
+            with stage('lookup'):
+                is_legitimate = snapshot.contains(invoice_hash)
+                metadata = snapshot.invoice_metadata.get(invoice_hash) if is_legitimate else None
+            
+            # Dual-key databases confirm every match with the second digest, so the
+            # cheap key alone never vouches for an invoice
+            if is_legitimate and snapshot.confirm_algorithm and \
+                    not self._confirm_match(snapshot, invoice_image, invoice_hash, metadata):
+                return {
+                    'is_fake': True,
+                    'confidence': 0.99,
+                    'hash': invoice_hash,
+                    'reason': 'Hash found in legitimate database, but the confirmation digest does not match'
+                }
             
             result = {
                 'is_fake': not is_legitimate,
@@ -198,9 +979,34 @@ class InvoiceHashDetector:
                 'reason': 'Hash found in legitimate database' if is_legitimate else 'Hash not found in legitimate database'
             }
             
-            # Add metadata if available
-            if is_legitimate and invoice_hash in self.invoice_metadata:
-                result['metadata'] = self.invoice_metadata[invoice_hash]
+            # Add metadata if available (tile and confirmation digests are internal)
+            if metadata is not None:
+                result['metadata'] = {key: value for key, value in metadata.items()
+                                      if key not in (TILE_METADATA_KEY, CONFIRM_METADATA_KEY)}
+            
+            # An unknown hash that is perceptually close to a legitimate invoice
+            # is most likely a recompressed, rescanned or edited copy of it
+            if not is_legitimate and len(snapshot.perceptual_index) > 0:
+                try:
+                    with stage('perceptual'):
+                        nearest = self._find_nearest(snapshot, invoice_image, 3, self.near_duplicate_distance)
+                except Exception as e:
+                    logger.warning(f"Perceptual lookup failed: {e}")
+                    nearest = []
+                if nearest:
+                    result['nearest_matches'] = nearest
+                    result['confidence'] = 0.95
+                    result['reason'] = ('Hash not found in legitimate database, but the image closely '
+                                        'matches a legitimate invoice (possible tampering)')
+                    try:
+                        with stage('tiles'):
+                            regions = self._find_tampered_regions(snapshot, invoice_image, nearest[0]['hash'])
+                    except Exception as e:
+                        logger.warning(f"Tile comparison failed: {e}")
+                        regions = None
+                    if regions is not None:
+                        result['tampered_regions'] = regions
+                        result['image_size'] = list(self.open_image(invoice_image).size)
             
             return result
             
@@ -213,15 +1019,461 @@ class InvoiceHashDetector:
                 'hash': None
             }
     
+    def _confirm_match(self, snapshot, image, invoice_hash, metadata):
+        """
+        Whether an invoice whose key matched also matches the entry's
+        confirmation digest (entries indexed without one are trusted on the key)
+        """
+        expected = (metadata or {}).get(CONFIRM_METADATA_KEY)
+        if not expected:
+            return True
+        # Timed on its own rather than inside the key digest's stage
+        confirm_hash = self.generate_sha256_hash(image, snapshot.hash_mode, snapshot.confirm_algorithm,
+                                                 timing_stage='confirm')
+        if confirm_hash != expected:
+            logger.warning(f"Key {invoice_hash} matched but its {snapshot.confirm_algorithm} digest did not")
+        return confirm_hash == expected
+    
+    def detect_document(self, document, max_workers=None, budget=None):
+        """
+        Detect fake pages in a multi-page invoice (PDF, multi-page TIFF)
+        
+        Pages are read one at a time (see documents.iter_pages) and checked on
+        a small thread pool, with at most two pages per thread in flight, so
+        the whole document is never rasterized in memory at once.
+        
+        Args:
+            document: PIL Image, bytes, path or binary stream of the document
+            max_workers: Pages checked concurrently (defaults to DEFAULT_PAGE_WORKERS)
+            budget: DecodeBudget for all pages (defaults to a new one from decode_budget())
+            
+        Returns:
+            Dictionary with the document verdict (fake if any page is not
+            legitimate), 'page_count', 'fake_pages' (page numbers) and the
+            per-page results under 'pages'
+            
+        Raises:
+            DecodeBudgetExceeded: If the pages are over budget
+        """
+        max_workers = max_workers or DEFAULT_PAGE_WORKERS
+        budget = budget if budget is not None else self.decode_budget()
+        results = {}
+        # The pages' stages count towards the request being served
+        detect_page = bind_request_timings(self.detect_fake_invoice)
+        try:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                # future -> page number
+                pending = {}
+                for number, page in enumerate(iter_pages(document, self.pdf_dpi, budget), 1):
+                    pending[executor.submit(detect_page, page)] = number
+                    if len(pending) >= 2 * max_workers:
+                        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            results[pending.pop(future)] = future.result()
+                for future, number in pending.items():
+                    results[number] = future.result()
+        except DecodeBudgetExceeded:
+            raise
+        except Exception as e:
+            logger.error(f"Error reading document pages: {e}")
+            return {
+                'is_fake': True,
+                'confidence': 0.0,
+                'reason': f'Error reading document pages: {str(e)}',
+                'hash': None
+            }
+        
+        pages = [{'page': number, **results[number]} for number in sorted(results)]
+        fake_pages = [page['page'] for page in pages if page['is_fake']]
+        page_hashes = [page.get('hash') for page in pages]
+        if not pages:
+            reason = 'Document has no pages'
+        elif fake_pages:
+            reason = f'{len(fake_pages)} of {len(pages)} pages not found in legitimate database'
+        else:
+            reason = f'All {len(pages)} pages found in legitimate database'
+        
+        return {
+            'is_fake': bool(fake_pages) or not pages,
+            'confidence': min((page['confidence'] for page in pages), default=0.0),
+            # Digest of the page digests, so identical documents share one verdict
+            'hash': hashlib.sha256('\n'.join(page_hashes).encode('ascii')).hexdigest()
+                    if pages and all(page_hashes) else None,
+            'reason': reason,
+            'page_count': len(pages),
+            'fake_pages': fake_pages,
+            'pages': pages
+        }
+    
+    def _detect_downsampled(self, snapshot, image, original_size):
+        """Verdict for an image too large to decode at full resolution"""
+        result = {
+            'is_fake': True,
+            'confidence': 0.5,
+            'hash': None,
+            'reason': 'Image exceeds the decode pixel limit and was checked at reduced resolution only',
+            'downsampled_from': list(original_size)
+        }
+        if len(snapshot.perceptual_index) > 0:
+            with stage('perceptual'):
+                nearest = self._find_nearest(snapshot, image, 3, self.near_duplicate_distance)
+            if nearest:
+                result['nearest_matches'] = nearest
+                result['reason'] += '; it closely matches a legitimate invoice at a different size'
+        return result
+    
+    def get_batch_executor(self, max_workers=None):
+        """
+        Process pool used by detect_fake_invoices, created on first use
+        
+        Workers receive a copy of this detector when they start (inherited for
+        free under fork), so call this after the database has been loaded.
+        After a reload the next call starts a new pool; batches still running
+        on the previous one keep it until they finish.
+        """
+        with self._batch_lock:
+            return self._current_batch_executor(max_workers)
+    
+    def _current_batch_executor(self, max_workers):
+        # Called with _batch_lock held
+        stale = self._batch_snapshot_version != self._snapshot.version
+        if self._batch_executor is None or stale or (max_workers and max_workers != self._batch_workers):
+            # Workers hold a copy of the snapshot, so replace them after a reload
+            self._retire_batch_executor()
+            # Imported here: it pulls in multiprocessing, which single-image serving never needs
+            from concurrent.futures import ProcessPoolExecutor
+            self._batch_snapshot_version = self._snapshot.version
+            self._batch_workers = max_workers or os.cpu_count() or 1
+            self._batch_executor = ProcessPoolExecutor(
+                max_workers=self._batch_workers,
+                initializer=_init_batch_worker,
+                initargs=(self,)
+            )
+        return self._batch_executor
+    
+    def _retire_batch_executor(self):
+        """Stop using the current pool; shut it down now if no batch is running on it (lock held)"""
+        executor, self._batch_executor = self._batch_executor, None
+        if executor is not None and not self._batch_users.get(executor):
+            self._batch_users.pop(executor, None)
+            executor.shutdown(wait=False)
+    
+    def _acquire_batch_executor(self, max_workers):
+        with self._batch_lock:
+            executor = self._current_batch_executor(max_workers)
+            self._batch_users[executor] = self._batch_users.get(executor, 0) + 1
+            return executor, self._batch_workers
+    
+    def _release_batch_executor(self, executor):
+        with self._batch_lock:
+            users = self._batch_users.get(executor, 1) - 1
+            if users > 0:
+                self._batch_users[executor] = users
+                return
+            self._batch_users.pop(executor, None)
+            if executor is not self._batch_executor:
+                # Replaced while this batch ran; it was the last one using the pool
+                executor.shutdown(wait=False)
+    
+    def shutdown_batch_executor(self):
+        """Stop the batch process pool once no batch is running on it any more"""
+        with self._batch_lock:
+            self._retire_batch_executor()
+    
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # Executors, threads and locks cannot be shipped to worker processes
+        state['_batch_executor'] = None
+        state['_batch_users'] = {}
+        del state['_batch_lock']
+        state['_compaction_thread'] = None
+        state['_watch_thread'] = None
+        state['_watch_stop'] = None
+        del state['_refresh_lock']
+        return state
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._refresh_lock = threading.RLock()
+        self._batch_lock = threading.Lock()
+    
+    def detect_fake_invoices(self, invoices: Iterable, max_workers=None, max_pending=None):
+        """
+        Detect fake invoices in a batch, decoding and hashing across a process pool
+        
+        Args:
+            invoices: Iterable of invoice sources (image bytes, file paths or PIL
+                Images) or of (name, source) tuples. It is consumed lazily.
+            max_workers: Number of worker processes (defaults to the CPU count)
+            max_pending: Maximum number of invoices in flight (defaults to 4 per worker)
+            
+        Yields:
+            Dictionaries with 'index', 'name', 'result' and 'elapsed_ms' (time
+            spent decoding and detecting in the worker), in completion order
+        """
+        # The batch keeps the pool it started on, even if a reload replaces it meanwhile
+        executor, workers = self._acquire_batch_executor(max_workers)
+        max_pending = max_pending or 4 * workers
+        pending = set()
+        try:
+            for index, invoice in enumerate(invoices):
+                if isinstance(invoice, tuple):
+                    name, source = invoice
+                else:
+                    name, source = (invoice if isinstance(invoice, str) else None), invoice
+                pending.add(executor.submit(_detect_in_batch_worker, index, name, source))
+                
+                if len(pending) >= max_pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+            
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        finally:
+            for future in pending:
+                future.cancel()
+            self._release_batch_executor(executor)
+    
+    def find_nearest_invoices(self, invoice_image, k=5, max_distance=None):
+        """
+        Find the legitimate invoices perceptually closest to an image
+        
+        Args:
+            invoice_image: PIL Image, image bytes or a binary file object
+            k: Maximum number of matches to return
+            max_distance: Maximum Hamming distance (defaults to near_duplicate_distance)
+            
+        Returns:
+            List of {'hash', 'distance'} dictionaries, closest first
+        """
+        if max_distance is None:
+            max_distance = self.near_duplicate_distance
+        return self._find_nearest(self._snapshot, invoice_image, k, max_distance)
+    
+    def _find_nearest(self, snapshot, invoice_image, k, max_distance):
+        image = self.open_image(invoice_image)
+        # Over-fetch a little so revoked invoices still in the index can be skipped
+        matches = snapshot.perceptual_index.nearest(image, k + 8, max_distance)
+        return [
+            {'hash': invoice_hash, 'distance': distance}
+            for invoice_hash, distance in matches
+            if invoice_hash in snapshot.legitimate_hashes
+        ][:k]
+    
+    def find_tampered_regions(self, invoice_image, invoice_hash):
+        """
+        Locate the tiles of an image that differ from a legitimate invoice
+        
+        Args:
+            invoice_image: PIL Image, image bytes or a binary file object
+            invoice_hash: Hash of the legitimate invoice to compare against
+                (e.g. the closest of find_nearest_invoices)
+            
+        Returns:
+            List of {'row', 'col', 'x', 'y', 'width', 'height'} pixel rectangles,
+            or None if the invoice has no tile digests or a different size
+        """
+        return self._find_tampered_regions(self._snapshot, invoice_image, invoice_hash)
+    
+    def _find_tampered_regions(self, snapshot, invoice_image, invoice_hash):
+        metadata = snapshot.invoice_metadata.get(invoice_hash) if snapshot.contains(invoice_hash) else None
+        if not metadata or TILE_METADATA_KEY not in metadata:
+            return None
+        reference = TileDigests.from_dict(metadata[TILE_METADATA_KEY])
+        image = self.open_image(invoice_image)
+        if tuple(image.size) != reference.size:
+            # Rescaled copies do not line up with the stored grid
+            return None
+        return TileDigests.compute(image, reference.grid).changed_regions(reference)
+    
+    def lookup_fields(self, fields, invoice_hash=None):
+        """
+        Look up legitimate invoices by ground truth fields
+        
+        Answers "is there a legitimate invoice with this invoice number / IBAN
+        / tax ID / total, and is it this image?" with one index probe per
+        field and no image processing. A known invoice number whose
+        invoices do not share the given IBAN points at an altered invoice.
+        
+        Args:
+            fields: Mapping of field name (see field_index.INDEXED_FIELDS) -> value
+            invoice_hash: Optional image hash to check against the matching invoices
+            
+        Returns:
+            Dictionary with per-field 'value' (normalized) and 'matches' (hashes),
+            'matching_invoices' (hashes matching every given field) and, with
+            invoice_hash, 'hash_matches'
+            
+        Raises:
+            ValueError: For unknown fields or if no field index is loaded
+        """
+        snapshot = self._snapshot
+        if snapshot.field_index is None:
+            raise ValueError("No field index loaded for this database; save or compact it to build one")
+        
+        results = {}
+        matching = None
+        for field, value in fields.items():
+            # Revoked invoices stay in the index file until the next save
+            matches = [h for h in snapshot.field_index.lookup(field, value) if snapshot.contains(h)]
+            results[field] = {'value': normalize(field, value), 'matches': matches}
+            matching = set(matches) if matching is None else matching & set(matches)
+        
+        response = {'fields': results, 'matching_invoices': sorted(matching or ())}
+        if invoice_hash is not None:
+            response['hash_matches'] = invoice_hash in (matching or ())
+        return response
+    
+    def is_legitimate_hash(self, invoice_hash):
+        """Whether a digest is in the database (checked against the prefilter first)"""
+        return self._snapshot.contains(invoice_hash)
+    
+    def _prefilter_stats(self):
+        prefilter = self._snapshot.prefilter
+        if prefilter is None:
+            return None
+        return {'bits': prefilter.num_bits, 'hashes_per_entry': prefilter.num_hashes}
+    
+    def database_statistics(self):
+        """
+        Stored statistics of the database (see DatabaseStats.to_dict)
+        
+        Databases saved before statistics were stored are walked once and the
+        result is kept up to date from then on; saving the database stores
+        them. Returns None for databases served by shard servers.
+        """
+        snapshot = self._snapshot
+        if snapshot.stats is None:
+            if is_remote_database(self.hash_db_path):
+                return None
+            logger.info("No stored statistics for this database, computing them (save the database to store them)")
+            snapshot.stats = DatabaseStats.compute(snapshot.legitimate_hashes, snapshot.invoice_metadata)
+        snapshot.stats.refill_samples(snapshot.legitimate_hashes)
+        return snapshot.stats.to_dict()
+
+    def _read_pickle_header(self):
+        """Header pickled in front of the entries of a pickle database, or None for other formats and older pickles"""
+        if (is_remote_database(self.hash_db_path) or is_sharded_store(self.hash_db_path)
+                or is_binary_store(self.hash_db_path)):
+            return None
+        try:
+            with open(self.hash_db_path, 'rb') as f:
+                header = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        return header if header.get('entries_follow') else None
+
+    def read_database_summary(self):
+        """
+        Entry counts, statistics and digest algorithms of the database
+
+        For pickle databases only the header and the metadata file are read,
+        not the hashes. Other formats (memory-mapped), older pickles and
+        databases with change log entries not yet compacted are loaded, so the
+        summary includes every entry.
+
+        Returns:
+            Dictionary, or None if the database does not exist or has no statistics
+        """
+        header = self._read_pickle_header()
+        if header is not None and header.get('stats') and not self.change_log.pending_records():
+            metadata = MetadataStore(self._metadata_path(header['metadata_file']))
+            return {
+                'total_hashes': header['stats']['count'],
+                'metadata_entries': len(metadata),
+                'stats': header['stats'],
+                'digest_algorithm': check_algorithm(header.get('digest_algorithm') or DEFAULT_DIGEST_ALGORITHM),
+                'confirm_algorithm': check_algorithm(header.get('confirm_algorithm'))
+            }
+
+        if not self.load_hash_database():
+            return None
+        stats = self.database_statistics()
+        if stats is None:
+            return None
+        return {
+            'total_hashes': len(self.legitimate_hashes),
+            'metadata_entries': len(self.invoice_metadata),
+            'stats': stats,
+            'digest_algorithm': self.digest_algorithm,
+            'confirm_algorithm': self.confirm_algorithm
+        }
+
     def get_database_stats(self):
         """Get statistics about the hash database"""
+        stats = self.database_statistics()
         return {
             'total_legitimate_hashes': len(self.legitimate_hashes),
             'database_file': self.hash_db_path,
-            'database_exists': os.path.exists(self.hash_db_path),
-            'sample_hashes': list(self.legitimate_hashes)[:5] if self.legitimate_hashes else []
+            'database_exists': is_remote_database(self.hash_db_path) or os.path.exists(self.hash_db_path),
+            'hash_mode': self.hash_mode,
+            'digest_algorithm': self.digest_algorithm,
+            'confirm_algorithm': self.confirm_algorithm,
+            'perceptual_hashes': len(self.perceptual_index),
+            'prefilter': self._prefilter_stats(),
+            'field_index': self._snapshot.field_index is not None,
+            'split_distribution': stats['distributions']['split'] if stats else None,
+            'source_distribution': stats['distributions']['source'] if stats else None,
+            'sample_hashes': stats['sample_hashes'] if stats else list(islice(self.legitimate_hashes, 5))
         }
 
+# Detector copy used inside batch worker processes
+_batch_detector = None
+
+def _init_batch_worker(detector):
+    global _batch_detector
+    _batch_detector = detector
+
+def _detect_in_batch_worker(index, name, source):
+    """Decode and check one invoice inside a batch worker process"""
+    start = time.perf_counter()
+    try:
+        if is_multipage(source):
+            # Pages run one after another here; the pool already spreads documents over the CPUs
+            result = _batch_detector.detect_document(source, max_workers=1)
+        else:
+            result = _batch_detector.detect_fake_invoice(_batch_detector.prepare_image(source))
+    except Exception as e:
+        result = {
+            'is_fake': True,
+            'confidence': 0.0,
+            'reason': f'Error during detection: {str(e)}',
+            'hash': None
+        }
+    return {
+        'index': index,
+        'name': name,
+        'result': result,
+        'elapsed_ms': round((time.perf_counter() - start) * 1000, 3)
+    }
+
+def iter_local_dataset(images_dir="images", splits=('train', 'validation', 'test')):
+    """
+    Iterate over a local copy of the dataset laid out as
+    images/<split>/<split>_image_<idx>.png with <split>_gt_<idx>.txt sidecars
+    
+    Yields:
+        (split_name, index, image_path, ground_truth) tuples
+    """
+    for split_name in splits:
+        pattern = os.path.join(images_dir, split_name, f"{split_name}_image_*")
+        entries = []
+        for image_path in glob.glob(pattern):
+            match = re.search(r'_image_(\d+)\.[^.]+$', image_path)
+            if match:
+                entries.append((int(match.group(1)), image_path))
+        
+        for idx, image_path in sorted(entries):
+            gt_path = os.path.join(images_dir, split_name, f"{split_name}_gt_{idx}.txt")
+            ground_truth = {}
+            if os.path.exists(gt_path):
+                with open(gt_path, 'r', encoding='utf-8') as f:
+                    ground_truth = f.read()
+            yield split_name, idx, image_path, ground_truth
+
 def main():
     """Main function to demonstrate the invoice detector"""
     logger.info("Starting Fake Invoice Detector using SHA256 Hashing")
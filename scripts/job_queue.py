@@ -0,0 +1,373 @@
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Priority lanes, most urgent first. Interactive jobs are small single-image
+# checks; everything else (batches, multi-page documents, large images) is bulk.
+LANE_INTERACTIVE = 'interactive'
+LANE_BULK = 'bulk'
+LANES = (LANE_INTERACTIVE, LANE_BULK)
+
+JOB_STATES = ('queued', 'running', 'done', 'failed')
+FINISHED_STATES = ('done', 'failed')
+
+DEFAULT_TTL = 3600.0           # seconds finished jobs (and their results) are kept
+DEFAULT_LEASE_SECONDS = 300.0  # a running job not heard from for this long is requeued
+DEFAULT_MAX_ATTEMPTS = 3
+# How often idle workers and long-polling clients look for work or results
+# written by other processes (jobs of this process wake them immediately)
+POLL_INTERVAL = 0.25
+
+class JobQueue:
+    """
+    Local job queue for detections that should not run inside a request
+
+    Jobs live in a SQLite file and their uploaded files in a directory next
+    to it (<path>.payloads/<job id>/), so every worker process on the machine
+    (e.g. all gunicorn workers) shares one queue: a job can be submitted to
+    one process, run by another and polled through a third. No broker is
+    involved; processes claim jobs with a write transaction.
+
+    Each process runs a few worker threads. Some of them only take jobs from
+    the interactive lane, so small checks never wait behind bulk jobs; the
+    others take interactive jobs first and bulk jobs otherwise. While a job
+    runs, its process renews the job's lease; a job whose worker stopped
+    (its lease expired) is requeued up to max_attempts times. Every claim
+    gets a token, and only the holder of the current claim can renew the
+    lease or record the result, so a run that lost its lease cannot
+    overwrite the result of the run that replaced it.
+    """
+
+    def __init__(self, path, ttl=DEFAULT_TTL, lease_seconds=DEFAULT_LEASE_SECONDS,
+                 max_attempts=DEFAULT_MAX_ATTEMPTS):
+        """
+        Args:
+            path: SQLite file of the queue (created on first use)
+            ttl: Seconds finished jobs are kept for polling
+            lease_seconds: Seconds after which a silent running job is requeued
+            max_attempts: Runs of a job before it is marked failed
+        """
+        self.path = path
+        self.payload_dir = f"{path}.payloads"
+        self.ttl = ttl
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._local = threading.local()
+        self._changed = threading.Condition()
+        self._threads = []
+        self._stop = None
+        self._last_purge = 0.0
+        # Jobs running on this process's workers: job id -> claim token
+        self._running = {}
+        self._running_lock = threading.Lock()
+
+    def _connect(self):
+        """Per-thread SQLite connection (connections cannot be shared between threads)"""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=10.0, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS jobs ('
+                'id TEXT PRIMARY KEY, kind TEXT, lane INTEGER, state TEXT, claim TEXT, attempts INTEGER DEFAULT 0, '
+                'created REAL, started REAL, heartbeat REAL, finished REAL, '
+                'payload TEXT, result TEXT, error TEXT)'
+            )
+            connection.execute('CREATE INDEX IF NOT EXISTS jobs_pending ON jobs (state, lane, created)')
+            columns = {row[1] for row in connection.execute('PRAGMA table_info(jobs)')}
+            if 'claim' not in columns:
+                # Queues created before claims were tracked
+                try:
+                    connection.execute('ALTER TABLE jobs ADD COLUMN claim TEXT')
+                except sqlite3.OperationalError:
+                    # Added by another process meanwhile
+                    pass
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def _notify(self):
+        with self._changed:
+            self._changed.notify_all()
+
+    def submit(self, kind, files, lane=LANE_BULK, payload=None):
+        """
+        Queue a job
+
+        Args:
+            kind: What the job does (interpreted by the handler)
+            files: Iterable of (name, binary stream) copied into the job's payload directory
+            lane: LANE_INTERACTIVE or LANE_BULK
+            payload: Extra JSON-serializable fields handed to the handler
+
+        Returns:
+            The job as returned by get()
+        """
+        if lane not in LANES:
+            raise ValueError(f"Unknown lane: {lane}")
+        job_id = uuid.uuid4().hex
+        job_dir = os.path.join(self.payload_dir, job_id)
+        os.makedirs(job_dir)
+        stored = []
+        for number, (name, stream) in enumerate(files):
+            path = os.path.join(job_dir, str(number))
+            with open(path, 'wb') as f:
+                shutil.copyfileobj(stream, f)
+            stored.append({'name': name, 'path': path})
+
+        self._connect().execute(
+            'INSERT INTO jobs (id, kind, lane, state, created, payload) VALUES (?, ?, ?, ?, ?, ?)',
+            (job_id, kind, LANES.index(lane), 'queued', time.time(),
+             json.dumps(dict(payload or {}, files=stored)))
+        )
+        self._notify()
+        self._maybe_purge()
+        return self.get(job_id)
+
+    def get(self, job_id):
+        """Status of a job ('status', 'lane', times and its 'result' or 'error' once finished), or None"""
+        row = self._connect().execute(
+            'SELECT id, kind, lane, state, attempts, created, started, finished, result, error FROM jobs WHERE id = ?',
+            (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        job_id, kind, lane, state, attempts, created, started, finished, result, error = row
+        job = {
+            'job_id': job_id,
+            'kind': kind,
+            'lane': LANES[lane],
+            'status': state,
+            'attempts': attempts,
+            'created': created,
+            'started': started,
+            'finished': finished
+        }
+        if state == 'queued':
+            job['queue_position'] = self._connect().execute(
+                'SELECT COUNT(*) FROM jobs WHERE state = ? AND (lane < ? OR (lane = ? AND created < ?))',
+                ('queued', lane, lane, created)
+            ).fetchone()[0]
+        if result is not None:
+            job['result'] = json.loads(result)
+        if error is not None:
+            job['error'] = error
+        return job
+
+    def wait(self, job_id, timeout):
+        """
+        get() once the job has finished or timeout seconds have passed (long polling)
+
+        Returns:
+            The job, or None if it does not exist
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self.get(job_id)
+            remaining = deadline - time.monotonic()
+            if job is None or job['status'] in FINISHED_STATES or remaining <= 0:
+                return job
+            with self._changed:
+                self._changed.wait(min(remaining, POLL_INTERVAL))
+
+    def claim(self, lanes=LANES):
+        """
+        Take the oldest queued job of the most urgent of the given lanes
+
+        Returns:
+            Dictionary with 'job_id', 'kind', 'lane', the 'claim' token and the
+            payload fields, or None
+        """
+        connection = self._connect()
+        now = time.time()
+        expired = now - self.lease_seconds
+        lane_numbers = [LANES.index(lane) for lane in lanes]
+        placeholders = ', '.join('?' * len(lane_numbers))
+        # Idle workers poll several times a second; only take the write lock
+        # (which submit() also needs) when there is something to claim or requeue
+        runnable = connection.execute(
+            f"SELECT 1 FROM jobs WHERE (state = 'queued' AND lane IN ({placeholders})) "
+            f"OR (state = 'running' AND heartbeat < ?) LIMIT 1",
+            (*lane_numbers, expired)
+        ).fetchone()
+        if runnable is None:
+            return None
+
+        claim = uuid.uuid4().hex
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            # Jobs of workers that stopped (e.g. a recycled or killed process)
+            connection.execute(
+                "UPDATE jobs SET state = 'failed', finished = ?, error = ? "
+                "WHERE state = 'running' AND heartbeat < ? AND attempts >= ?",
+                (now, 'Job was interrupted too many times', expired, self.max_attempts)
+            )
+            connection.execute(
+                "UPDATE jobs SET state = 'queued' WHERE state = 'running' AND heartbeat < ?", (expired,)
+            )
+            row = connection.execute(
+                f"SELECT id, kind, lane, payload FROM jobs WHERE state = 'queued' AND lane IN ({placeholders}) "
+                f"ORDER BY lane, created LIMIT 1",
+                lane_numbers
+            ).fetchone()
+            if row is not None:
+                connection.execute(
+                    "UPDATE jobs SET state = 'running', claim = ?, started = ?, heartbeat = ?, "
+                    "attempts = attempts + 1 WHERE id = ?",
+                    (claim, now, now, row[0])
+                )
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        if row is None:
+            return None
+        job_id, kind, lane, payload = row
+        return {'job_id': job_id, 'kind': kind, 'lane': LANES[lane], 'claim': claim, **json.loads(payload)}
+
+    def heartbeat(self, job):
+        """
+        Extend the lease of a claimed job (the workers do this for running jobs)
+
+        Returns:
+            Whether the claim is still current
+        """
+        cursor = self._connect().execute(
+            "UPDATE jobs SET heartbeat = ? WHERE id = ? AND state = 'running' AND claim = ?",
+            (time.time(), job['job_id'], job['claim'])
+        )
+        return cursor.rowcount > 0
+
+    def finish(self, job, result=None, error=None):
+        """
+        Record a claimed job's result (or error) and delete its uploaded files
+
+        Returns:
+            Whether it was recorded; False if the claim had expired and the
+            job was requeued or claimed again (its files are left to that run)
+        """
+        cursor = self._connect().execute(
+            "UPDATE jobs SET state = ?, finished = ?, result = ?, error = ? "
+            "WHERE id = ? AND state = 'running' AND claim = ?",
+            ('failed' if error is not None else 'done', time.time(),
+             json.dumps(result) if result is not None else None, error, job['job_id'], job['claim'])
+        )
+        if cursor.rowcount == 0:
+            logger.warning(f"Job {job['job_id']} lost its claim; its result was discarded")
+            return False
+        shutil.rmtree(os.path.join(self.payload_dir, job['job_id']), ignore_errors=True)
+        self._notify()
+        return True
+
+    def _maybe_purge(self):
+        """Delete jobs finished more than ttl seconds ago (at most once a minute)"""
+        now = time.time()
+        if now - self._last_purge < 60:
+            return
+        self._last_purge = now
+        try:
+            connection = self._connect()
+            connection.execute("DELETE FROM jobs WHERE state IN ('done', 'failed') AND finished < ?",
+                               (now - self.ttl,))
+            active = {job_id for job_id, in connection.execute(
+                "SELECT id FROM jobs WHERE state IN ('queued', 'running')")}
+        except sqlite3.Error as e:
+            logger.warning(f"Job purge failed: {e}")
+            return
+        # Files of jobs that failed without reaching finish(); recent directories may
+        # belong to a submit() in progress
+        for job_id in os.listdir(self.payload_dir):
+            job_dir = os.path.join(self.payload_dir, job_id)
+            try:
+                stale = job_id not in active and now - os.path.getmtime(job_dir) > 60
+            except OSError:
+                continue
+            if stale:
+                shutil.rmtree(job_dir, ignore_errors=True)
+
+    def stats(self):
+        """Number of jobs per lane and status"""
+        counts = {lane: {state: 0 for state in JOB_STATES} for lane in LANES}
+        for lane, state, count in self._connect().execute(
+                'SELECT lane, state, COUNT(*) FROM jobs GROUP BY lane, state'):
+            counts[LANES[lane]][state] = count
+        return counts
+
+    def start_workers(self, handler, workers, interactive_workers=1):
+        """
+        Run jobs of this queue on background threads of this process
+
+        Args:
+            handler: Called with each claimed job; returns its JSON-serializable
+                result. An exception marks the job failed.
+            workers: Worker threads in total (0 only submits and polls here)
+            interactive_workers: How many of them only take interactive jobs
+        """
+        if self._threads and all(thread.is_alive() for thread in self._threads):
+            return
+        self._stop = threading.Event()
+        interactive_workers = min(interactive_workers, workers)
+        self._threads = []
+        for number in range(workers):
+            lanes = (LANE_INTERACTIVE,) if number < interactive_workers else LANES
+            thread = threading.Thread(target=self._work, args=(handler, lanes, self._stop),
+                                      name=f"job-worker-{number}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        if workers:
+            thread = threading.Thread(target=self._renew_leases, args=(self._stop,), name='job-leases', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Started {workers} job workers ({interactive_workers} reserved for interactive jobs)")
+
+    def stop_workers(self, timeout=None):
+        """Stop the worker threads after their current jobs"""
+        if self._stop is not None:
+            self._stop.set()
+            self._notify()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _renew_leases(self, stop):
+        """Heartbeat every job running in this process, a few times per lease"""
+        while not stop.wait(self.lease_seconds / 4):
+            with self._running_lock:
+                running = list(self._running.items())
+            for job_id, claim in running:
+                try:
+                    self.heartbeat({'job_id': job_id, 'claim': claim})
+                except sqlite3.Error as e:
+                    logger.warning(f"Could not renew the lease of job {job_id}: {e}")
+
+    def _work(self, handler, lanes, stop):
+        while not stop.is_set():
+            try:
+                job = self.claim(lanes)
+            except sqlite3.Error as e:
+                logger.warning(f"Could not claim a job: {e}")
+                job = None
+            if job is None:
+                with self._changed:
+                    self._changed.wait(POLL_INTERVAL)
+                continue
+            with self._running_lock:
+                self._running[job['job_id']] = job['claim']
+            try:
+                result = handler(job)
+            except Exception as e:
+                logger.error(f"Job {job['job_id']} failed: {e}")
+                self.finish(job, error=str(e))
+            else:
+                self.finish(job, result)
+            finally:
+                with self._running_lock:
+                    self._running.pop(job['job_id'], None)
@@ -0,0 +1,82 @@
+import argparse
+import json
+import os
+import logging
+
+try:
+    from scripts.invoice_detector import InvoiceHashDetector
+except ImportError:
+    # Running from inside scripts/ (e.g. python manage_invoices.py)
+    from invoice_detector import InvoiceHashDetector
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def add_invoices(detector, image_paths, metadata=None, source='manual'):
+    """Register image files as legitimate invoices through the change log"""
+    added = 0
+    for image_path in image_paths:
+        invoice_metadata = dict(metadata or {})
+        invoice_metadata.setdefault('source', source)
+        invoice_metadata.setdefault('filename', os.path.basename(image_path))
+        invoice_hash = detector.add_invoice(image_path, invoice_metadata)
+        if invoice_hash:
+            added += 1
+            logger.info(f"Added {image_path}: {invoice_hash}")
+        else:
+            logger.error(f"Could not hash {image_path}")
+    return added
+
+def revoke_invoices(detector, invoice_hashes, reason=None):
+    """Revoke legitimate invoices by hash through the change log"""
+    revoked = 0
+    for invoice_hash in invoice_hashes:
+        if detector.revoke_invoice(invoice_hash, reason):
+            revoked += 1
+            logger.info(f"Revoked {invoice_hash}")
+        else:
+            logger.warning(f"{invoice_hash} was not in the database (revocation recorded anyway)")
+    return revoked
+
+def main():
+    parser = argparse.ArgumentParser(description="Add, revoke and compact legitimate invoices")
+    parser.add_argument('--db', default="legitimate_invoice_hashes.pkl", help="Hash database (.pkl or .ihdb)")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    add_parser = subparsers.add_parser('add', help="Register image files as legitimate invoices")
+    add_parser.add_argument('images', nargs='+', help="Invoice image files")
+    add_parser.add_argument('--source', default='manual', help="Source recorded in the metadata")
+    add_parser.add_argument('--metadata', default=None, help="Extra metadata as a JSON object")
+    add_parser.add_argument('--tiles', type=int, default=None, metavar='GRID',
+                            help="Store GRID x GRID tile digests to localize tampering (e.g. 16)")
+
+    revoke_parser = subparsers.add_parser('revoke', help="Revoke legitimate invoices by hash")
+    revoke_parser.add_argument('hashes', nargs='+', help="Invoice hashes")
+    revoke_parser.add_argument('--reason', default=None, help="Reason recorded in the change log")
+
+    subparsers.add_parser('compact', help="Fold the change log into the database file")
+    subparsers.add_parser('status', help="Show database and change log sizes")
+
+    args = parser.parse_args()
+
+    detector = InvoiceHashDetector(args.db)
+    if not detector.load_hash_database():
+        logger.error(f"Hash database {args.db} not found. Please build it first.")
+        return
+
+    if args.command == 'add':
+        metadata = json.loads(args.metadata) if args.metadata else None
+        detector.tile_grid = args.tiles
+        added = add_invoices(detector, args.images, metadata, args.source)
+        logger.info(f"Added {added} of {len(args.images)} invoices")
+    elif args.command == 'revoke':
+        revoked = revoke_invoices(detector, args.hashes, args.reason)
+        logger.info(f"Revoked {revoked} of {len(args.hashes)} invoices")
+    elif args.command == 'compact':
+        detector.compact_hash_database()
+    elif args.command == 'status':
+        logger.info(f"Legitimate invoice hashes: {len(detector.legitimate_hashes)}")
+        logger.info(f"Pending change log entries: {detector.change_log.pending_records()}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+import json
+import os
+import sqlite3
+import threading
+import weakref
+from collections import OrderedDict
+from collections.abc import Mapping
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Metadata files sit next to the pickle: <database>.<generation>.meta
+METADATA_EXTENSION = '.meta'
+DEFAULT_CACHE_SIZE = 1024
+
+# Open ReadOnlyDatabases, whose locks are held across fork()
+_open_databases = weakref.WeakSet()
+_forking = []
+
+class ReadOnlyDatabase:
+    """
+    Connection to a SQLite file that is never modified in place: later saves
+    write a new file and rename it over this one, or delete it
+
+    The file is opened once, as immutable (no locking, no change checks), and
+    the connection is kept across fork(). A forked gunicorn or batch worker
+    therefore reads the very file its snapshot was loaded from, even after a
+    save replaced or deleted it, instead of re-opening the path. The lock
+    guards every query and is held over fork(), so no query is cut in half
+    in the child. An unpickled copy (a process that was not forked) has to
+    re-open the path and refuses to if the file there is a different one.
+    """
+
+    def __init__(self, path, file_id=None):
+        """
+        Args:
+            path: SQLite file
+            file_id: (device, inode) the file must have, when re-opening a pickled database
+
+        Raises:
+            FileNotFoundError: If the file is missing or is not the expected one
+        """
+        self.path = path
+        self.lock = threading.RLock()
+        stat = os.stat(path)
+        self.file_id = (stat.st_dev, stat.st_ino)
+        if file_id is not None and tuple(file_id) != self.file_id:
+            raise FileNotFoundError(f"{path} was replaced by a newer save")
+        self.connection = sqlite3.connect(f"file:{path}?mode=ro&immutable=1", uri=True, check_same_thread=False)
+        _open_databases.add(self)
+
+    def __reduce__(self):
+        return (self.__class__, (self.path, self.file_id))
+
+    def query(self, sql, parameters=()):
+        """All rows of a query"""
+        with self.lock:
+            return self.connection.execute(sql, parameters).fetchall()
+
+def _before_fork():
+    _forking[:] = list(_open_databases)
+    for database in _forking:
+        database.lock.acquire()
+
+def _after_fork_in_parent():
+    for database in _forking:
+        database.lock.release()
+    _forking.clear()
+
+def _after_fork_in_child():
+    for database in _forking:
+        database.lock = threading.RLock()
+    _forking.clear()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(before=_before_fork, after_in_parent=_after_fork_in_parent,
+                        after_in_child=_after_fork_in_child)
+
+class MetadataStore(Mapping):
+    """
+    Read-only mapping of invoice hash -> metadata kept in a SQLite file
+
+    Keeping the metadata (with every invoice's full ground truth) out of the
+    pickle means loading a database only reads the digests. Entries are
+    fetched one at a time when a hash matches, through a small LRU cache.
+    The file is opened when the store is created and stays readable, in
+    forked workers too, after a newer save has deleted it (see ReadOnlyDatabase).
+    """
+
+    def __init__(self, path, cache_size=DEFAULT_CACHE_SIZE, database=None):
+        """
+        Args:
+            path: SQLite file written by MetadataStore.write
+            cache_size: Number of decoded entries kept in memory
+            database: Already open ReadOnlyDatabase of path (when unpickling)
+        """
+        self.path = path
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._database = database if database is not None else ReadOnlyDatabase(path)
+        self._count = None
+
+    def __reduce__(self):
+        # The cache is left behind
+        return (self.__class__, (self.path, self.cache_size, self._database))
+
+    @property
+    def _lock(self):
+        # The database's lock also guards the cache, so it is released in forked children
+        return self._database.lock
+
+    def _fetch(self, hex_digest):
+        rows = self._database.query('SELECT metadata FROM metadata WHERE hash = ?', (hex_digest,))
+        return json.loads(rows[0][0]) if rows else None
+
+    def __getitem__(self, hex_digest):
+        with self._lock:
+            if hex_digest in self._cache:
+                self._cache.move_to_end(hex_digest)
+                return self._cache[hex_digest]
+            metadata = self._fetch(hex_digest)
+            if metadata is None:
+                raise KeyError(hex_digest)
+            self._cache[hex_digest] = metadata
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+            return metadata
+
+    def __contains__(self, hex_digest):
+        with self._lock:
+            if hex_digest in self._cache:
+                return True
+            return bool(self._database.query('SELECT 1 FROM metadata WHERE hash = ?', (hex_digest,)))
+
+    def __iter__(self):
+        return iter([row[0] for row in self._database.query('SELECT hash FROM metadata')])
+
+    def __len__(self):
+        if self._count is None:
+            self._count = self._database.query('SELECT COUNT(*) FROM metadata')[0][0]
+        return self._count
+
+    @staticmethod
+    def write(path, metadata):
+        """
+        Write a mapping of hash -> metadata to a new SQLite file
+
+        The file is built under a temporary name and renamed when complete.
+        """
+        tmp_path = f"{path}.tmp"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        connection = sqlite3.connect(tmp_path)
+        try:
+            connection.execute('PRAGMA journal_mode=OFF')
+            connection.execute('CREATE TABLE metadata (hash TEXT PRIMARY KEY, metadata TEXT) WITHOUT ROWID')
+            connection.executemany(
+                'INSERT INTO metadata (hash, metadata) VALUES (?, ?)',
+                ((hex_digest, json.dumps(value)) for hex_digest, value in metadata.items())
+            )
+            connection.commit()
+        finally:
+            connection.close()
+        os.replace(tmp_path, path)
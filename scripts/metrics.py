@@ -0,0 +1,117 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Histogram bucket upper bounds in seconds (0.1 ms to 10 s)
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Histogram:
+    """Cumulative latency histogram in the Prometheus style (per label value)"""
+
+    def __init__(self, name, documentation, label, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label = label
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_value, seconds):
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                # Per-bucket counts (last slot is +Inf), sum, count
+                series = self._series[label_value] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][bisect_left(self.buckets, seconds)] += 1
+            series[1] += seconds
+            series[2] += 1
+
+    def render(self):
+        """Text exposition format lines"""
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {key: ([*counts], total, count) for key, (counts, total, count) in self._series.items()}
+        for label_value, (counts, total, count) in sorted(series.items()):
+            label = f'{self.label}="{label_value}"'
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{self.name}_bucket{{{label},le="{le}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{label}}} {total}')
+            lines.append(f'{self.name}_count{{{label}}} {count}')
+        return lines
+
+STAGE_SECONDS = Histogram('invoice_stage_seconds', 'Time spent per detection stage', 'stage')
+REQUEST_SECONDS = Histogram('invoice_request_seconds', 'HTTP request latency per endpoint', 'endpoint')
+
+# Per-thread timings of the request being served, for the X-Timing header
+_request_timings = threading.local()
+# Guards the timings dicts, which worker threads bound to a request share with it
+_request_timings_lock = threading.Lock()
+
+def start_request_timings():
+    """Start collecting per-stage timings for the current thread's request"""
+    _request_timings.stages = {}
+
+def request_timings():
+    """Stage -> seconds recorded since start_request_timings, then stop collecting"""
+    stages = getattr(_request_timings, 'stages', None)
+    _request_timings.stages = None
+    if not stages:
+        return {}
+    with _request_timings_lock:
+        return dict(stages)
+
+def bind_request_timings(fn):
+    """
+    Wrap fn so the stages it records on another thread (e.g. in a thread pool)
+    count towards the calling thread's request timings
+    """
+    stages = getattr(_request_timings, 'stages', None)
+    if stages is None:
+        return fn
+
+    def bound(*args, **kwargs):
+        previous = getattr(_request_timings, 'stages', None)
+        _request_timings.stages = stages
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _request_timings.stages = previous
+    return bound
+
+@contextmanager
+def stage(name):
+    """Time a block into the stage histogram (and the current request's timings)"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(name, elapsed)
+        stages = getattr(_request_timings, 'stages', None)
+        if stages is not None:
+            with _request_timings_lock:
+                stages[name] = stages.get(name, 0.0) + elapsed
+
+def format_timing_header(stages):
+    """X-Timing header value: stage=milliseconds pairs in recording order"""
+    return ', '.join(f"{name}={seconds * 1000:.3f}" for name, seconds in stages.items())
+
+def render_metrics(gauges=None, counters=None):
+    """
+    Render all histograms plus the given gauges and counters in the
+    Prometheus text exposition format
+
+    Args:
+        gauges: Mapping of metric name -> (help text, value)
+        counters: Mapping of metric name -> (help text, value)
+    """
+    lines = STAGE_SECONDS.render() + REQUEST_SECONDS.render()
+    for kind, metrics in (('gauge', gauges or {}), ('counter', counters or {})):
+        for name, (documentation, value) in metrics.items():
+            lines.extend((f"# HELP {name} {documentation}", f"# TYPE {name} {kind}", f"{name} {value}"))
+    return '\n'.join(lines) + '\n'
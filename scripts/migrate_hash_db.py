@@ -0,0 +1,152 @@
+import argparse
+import os
+import shutil
+from contextlib import nullcontext
+import logging
+
+try:
+    from scripts.invoice_detector import InvoiceHashDetector, iter_local_dataset, HASH_MODES, HASH_MODE_PIXEL
+    from scripts.digests import DIGEST_ALGORITHMS, DEFAULT_DIGEST_ALGORITHM, CONFIRM_METADATA_KEY
+    from scripts.change_log import file_lock
+    from scripts.shard_client import is_remote_database
+except ImportError:
+    # Running from inside scripts/ (e.g. python migrate_hash_db.py)
+    from invoice_detector import InvoiceHashDetector, iter_local_dataset, HASH_MODES, HASH_MODE_PIXEL
+    from digests import DIGEST_ALGORITHMS, DEFAULT_DIGEST_ALGORITHM, CONFIRM_METADATA_KEY
+    from change_log import file_lock
+    from shard_client import is_remote_database
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def iter_hub_dataset(splits):
+    """Iterate over the Hugging Face dataset as (split, index, image, ground_truth) tuples"""
+    from datasets import load_dataset
+
+    dataset = load_dataset("katanaml-org/invoices-donut-data-v1")
+    for split_name in splits:
+        split_data = dataset[split_name]
+        for idx in range(len(split_data)):
+            sample = split_data[idx]
+            yield split_name, idx, sample.get('image'), sample.get('ground_truth', {})
+
+def migrate_hash_database(db_path="legitimate_invoice_hashes.pkl", output_path=None,
+                          images_dir="images", use_hub=False, allow_partial=False, hash_mode=HASH_MODE_PIXEL,
+                          digest_algorithm=DEFAULT_DIGEST_ALGORITHM, confirm_algorithm=None):
+    """
+    Rebuild a hash database under another key scheme: the pixel-digest hash
+    mode, a different digest algorithm, or dual-key mode (see digests.py)
+
+    The old keys cannot be converted directly, so every entry is located again
+    in the source dataset through its (split, index) metadata and re-hashed.
+    Entries whose source image is not available abort the migration unless
+    allow_partial is set, in which case they are dropped and reported.
+
+    An in-place migration holds the change log's lock throughout, so
+    invoices added or revoked meanwhile wait and land in the new database.
+
+    Args:
+        db_path: Existing hash database
+        output_path: Where to write the migrated database (defaults to db_path;
+            the old file is kept as <db_path>.bak, and its change log, whose
+            records are in the old scheme, is folded in and kept as <db_path>.log.bak)
+        images_dir: Local images/<split>/ directory used as the image source
+        use_hub: Read images from the Hugging Face dataset instead of images_dir
+        allow_partial: Write the database even if some entries could not be migrated
+        hash_mode: Hash mode of the migrated database
+        digest_algorithm: Digest of the migrated keys
+        confirm_algorithm: Confirmation digest stored per entry (None: single key)
+
+    Returns:
+        Number of migrated entries
+    """
+    output_path = output_path or db_path
+    in_place = output_path == db_path and not is_remote_database(db_path)
+    # Writers append to the change log under its lock
+    with file_lock(f"{db_path}.log.lock") if in_place else nullcontext():
+        return _migrate(db_path, output_path, images_dir, use_hub, allow_partial, hash_mode,
+                        digest_algorithm, confirm_algorithm, in_place)
+
+def _migrate(db_path, output_path, images_dir, use_hub, allow_partial, hash_mode, digest_algorithm,
+             confirm_algorithm, in_place):
+    old_detector = InvoiceHashDetector(db_path)
+    if not old_detector.load_hash_database():
+        raise FileNotFoundError(f"Hash database {db_path} not found")
+
+    scheme = (hash_mode, digest_algorithm, confirm_algorithm)
+    if (old_detector.hash_mode, old_detector.digest_algorithm, old_detector.confirm_algorithm) == scheme:
+        logger.info(f"{db_path} already uses the {hash_mode} hash mode with {digest_algorithm} keys, nothing to do")
+        return len(old_detector.legitimate_hashes)
+
+    # Index the old entries by their position in the source dataset
+    entries_by_position = {}
+    for old_hash, metadata in old_detector.invoice_metadata.items():
+        if old_hash in old_detector.legitimate_hashes:
+            # The confirmation digest is recomputed (or dropped) with the key
+            entries_by_position[(metadata.get('split'), metadata.get('index'))] = {
+                key: value for key, value in metadata.items() if key != CONFIRM_METADATA_KEY
+            }
+
+    splits = sorted({split for split, _ in entries_by_position if split})
+    if use_hub:
+        source = iter_hub_dataset(splits)
+    else:
+        source = iter_local_dataset(images_dir, splits)
+
+    new_detector = InvoiceHashDetector(output_path, hash_mode=hash_mode, digest_algorithm=digest_algorithm,
+                                       confirm_algorithm=confirm_algorithm)
+
+    for split_name, idx, image, _ in source:
+        metadata = entries_by_position.pop((split_name, idx), None)
+        if metadata is None:
+            continue
+
+        if not new_detector.index_invoice(image, metadata):
+            logger.error(f"Could not hash sample {idx} of {split_name}, skipping")
+
+    if entries_by_position:
+        message = f"{len(entries_by_position)} entries have no source image"
+        if not allow_partial:
+            raise RuntimeError(f"{message}; rerun with allow_partial to drop them")
+        logger.warning(f"{message} and were not migrated")
+
+    if in_place and os.path.exists(db_path):
+        backup_path = db_path + '.bak'
+        if os.path.isdir(db_path):
+            shutil.rmtree(backup_path, ignore_errors=True)
+            shutil.copytree(db_path, backup_path)
+        else:
+            shutil.copy2(db_path, backup_path)
+        logger.info(f"Previous database backed up to {backup_path}")
+
+    new_detector.save_hash_database()
+    if in_place and old_detector.change_log.pending_records():
+        # Its records were applied before migrating and hold old-scheme digests,
+        # which must not be replayed on top of the new database
+        shutil.copy2(old_detector.change_log.path, old_detector.change_log.path + '.bak')
+        new_detector.change_log.reset()
+        logger.info(f"Change log folded into the migrated database (kept as {old_detector.change_log.path}.bak)")
+    logger.info(f"Migrated {len(new_detector.legitimate_hashes)} entries to the {hash_mode} hash mode "
+                f"with {digest_algorithm} keys" + (f" confirmed by {confirm_algorithm}" if confirm_algorithm else ""))
+    return len(new_detector.legitimate_hashes)
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild the hash database with another key scheme")
+    parser.add_argument('--db', default="legitimate_invoice_hashes.pkl", help="Existing hash database")
+    parser.add_argument('--output', default=None, help="Output path (defaults to --db, with a .bak backup)")
+    parser.add_argument('--images-dir', default="images", help="Local images/<split>/ directory")
+    parser.add_argument('--hub', action='store_true', help="Read images from the Hugging Face dataset")
+    parser.add_argument('--allow-partial', action='store_true',
+                        help="Drop entries whose source image is missing instead of aborting")
+    parser.add_argument('--hash-mode', choices=HASH_MODES, default=HASH_MODE_PIXEL, help="Target hash mode")
+    parser.add_argument('--algorithm', choices=tuple(DIGEST_ALGORITHMS), default=DEFAULT_DIGEST_ALGORITHM,
+                        help="Target digest of the keys")
+    parser.add_argument('--confirm', choices=tuple(DIGEST_ALGORITHMS), default=None,
+                        help="Dual-key mode: also store this digest and confirm it on every match")
+    args = parser.parse_args()
+
+    migrate_hash_database(args.db, args.output, args.images_dir, args.hub, args.allow_partial,
+                          args.hash_mode, args.algorithm, args.confirm)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,333 @@
+import threading
+import numpy as np
+from PIL import Image
+from functools import lru_cache
+from itertools import combinations
+from typing import List, Tuple
+
+# Hashes are computed from a 16x16 grid of low frequencies (256 bits): invoices
+# share one layout, and 64-bit hashes cannot tell different invoices apart
+DEFAULT_HASH_SIZE = 16
+
+# Multi-index hashing splits each hash into chunks of at most this many bits
+# (chunk values are compared as 64-bit integers) and at least this many, below
+# which buckets get too crowded to pay off against a linear scan
+MAX_CHUNK_BITS = 64
+MIN_CHUNK_BITS = 8
+
+# Hamming distance up to which an image counts as a near-duplicate by default.
+# On the bundled fixtures recompressed/rescaled copies stay within ~4 bits while
+# distinct invoices are 24+ bits apart.
+DEFAULT_MAX_DISTANCE = 12
+
+# Number of set bits for every byte value, used for vectorized popcounts
+_POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+def _grayscale_array(image, width, height):
+    """Downscale an image to width x height grayscale and return it as a float array"""
+    if image.mode != 'L':
+        image = image.convert('L')
+    # reducing_gap lets PIL shrink large scans with a cheap box reduce before resampling
+    small = image.resize((width, height), Image.Resampling.LANCZOS, reducing_gap=2.0)
+    return np.asarray(small, dtype=np.float64)
+
+def _bits_to_int(bits):
+    """Pack a boolean array (most significant bit first) into a Python int"""
+    return int.from_bytes(np.packbits(bits.ravel()).tobytes(), 'big')
+
+def _dct_matrix(size):
+    """Orthonormal DCT-II matrix, so that M @ x @ M.T is the 2D DCT of x"""
+    n = np.arange(size)
+    matrix = np.cos(np.pi * (2 * n[None, :] + 1) * n[:, None] / (2 * size))
+    matrix[0] *= np.sqrt(1.0 / size)
+    matrix[1:] *= np.sqrt(2.0 / size)
+    return matrix
+
+def dhash(image, hash_size=DEFAULT_HASH_SIZE):
+    """
+    Difference hash: one bit per horizontally adjacent pixel pair of a
+    (hash_size + 1) x hash_size grayscale thumbnail
+    """
+    pixels = _grayscale_array(image, hash_size + 1, hash_size)
+    return _bits_to_int(pixels[:, 1:] > pixels[:, :-1])
+
+def phash(image, hash_size=DEFAULT_HASH_SIZE, highfreq_factor=4):
+    """
+    Perceptual hash: sign of the lowest-frequency DCT coefficients of a
+    grayscale thumbnail relative to their median
+    """
+    size = hash_size * highfreq_factor
+    pixels = _grayscale_array(image, size, size)
+    dct_matrix = _dct_matrix(size)
+    low_freq = (dct_matrix @ pixels @ dct_matrix.T)[:hash_size, :hash_size]
+    return _bits_to_int(low_freq > np.median(low_freq))
+
+PERCEPTUAL_HASHES = {
+    'phash': phash,
+    'dhash': dhash,
+}
+
+def hamming_distance(hash_a, hash_b):
+    """Number of differing bits between two integer hashes"""
+    return bin(hash_a ^ hash_b).count('1')
+
+def _chunk_values(rows, start, end):
+    """Bits start..end (most significant first) of every row of a uint8 array, as uint64"""
+    first, last = start // 8, (end - 1) // 8 + 1
+    bits = np.unpackbits(rows[:, first:last], axis=1)[:, start - 8 * first:end - 8 * first]
+    padded = np.zeros((len(rows), MAX_CHUNK_BITS), dtype=np.uint8)
+    padded[:, MAX_CHUNK_BITS - (end - start):] = bits
+    return np.packbits(padded, axis=1).view('>u8')[:, 0].astype(np.uint64)
+
+@lru_cache(maxsize=None)
+def _neighbour_masks(width, max_bits):
+    """XOR masks of all width-bit values with at most max_bits bits set"""
+    masks = [0]
+    for bits in range(1, max_bits + 1):
+        for positions in combinations(range(width), bits):
+            masks.append(sum(1 << p for p in positions))
+    masks = np.array(masks, dtype=np.uint64)
+    masks.flags.writeable = False
+    return masks
+
+class PerceptualIndex:
+    """
+    Hamming-distance index over perceptual hashes
+
+    Uses multi-index hashing: each hash is split into m chunks, and every chunk
+    position keeps a sorted table of chunk values. If chunk i is probed within
+    t_i bits and the t_i add up to r + 1 - m, any hash within distance r of the
+    query is found in at least one of the probes (otherwise the chunks would
+    differ in r + 1 bits or more). m is about (r + 1) / 2, so every chunk is
+    probed within at most one bit: the chunks stay wide (37 bits for the
+    default 256-bit hash and r = 12), and their buckets selective even though
+    invoices share a layout and thereby many hash bits. Candidates are then
+    verified with a vectorized popcount.
+
+    Additions and searches may run on different threads: additions are folded
+    into new arrays and tables, which replace the old ones under a lock.
+    """
+
+    def __init__(self, hash_kind='phash', hash_size=DEFAULT_HASH_SIZE):
+        if hash_kind not in PERCEPTUAL_HASHES:
+            raise ValueError(f"Unknown perceptual hash: {hash_kind}")
+        self.hash_kind = hash_kind
+        self.hash_size = hash_size
+        self.hash_bytes = hash_size * hash_size // 8
+        self.keys: List[str] = []
+        self._pending: List[int] = []
+        self._hashes = np.zeros((0, self.hash_bytes), dtype=np.uint8)
+        # Chunk count -> list of ((start bit, end bit, probe radius), sorted values, row order)
+        self._tables = {}
+        self._rows_filtered = True
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._hashes) + len(self._pending)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # Locks cannot be pickled (e.g. to batch worker processes)
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def compute_hash(self, image):
+        """Compute this index's perceptual hash for a PIL Image"""
+        return PERCEPTUAL_HASHES[self.hash_kind](image, self.hash_size)
+
+    def add(self, key, perceptual_hash):
+        """Add a perceptual hash for the given key (e.g. the invoice's SHA256)"""
+        with self._lock:
+            if not isinstance(self.keys, list):
+                # Wrapped read-only key sequences are copied on the first write
+                self.keys = list(self.keys)
+            self.keys.append(key)
+            self._pending.append(perceptual_hash)
+
+    def to_dict(self):
+        """Mapping of key -> perceptual hash, used for persistence"""
+        keys, hashes = self._current_rows()
+        return {
+            key: int.from_bytes(row.tobytes(), 'big')
+            for key, row in zip(keys, hashes)
+        }
+
+    @classmethod
+    def from_dict(cls, hashes, hash_kind='phash', hash_size=DEFAULT_HASH_SIZE):
+        """Rebuild an index from a key -> perceptual hash mapping"""
+        index = cls(hash_kind, hash_size)
+        for key, perceptual_hash in hashes.items():
+            index.add(key, perceptual_hash)
+        index._current_rows()
+        return index
+
+    @classmethod
+    def from_rows(cls, keys, rows, hash_kind='phash', hash_size=DEFAULT_HASH_SIZE):
+        """
+        Wrap existing hash rows without copying them
+
+        Args:
+            keys: Sequence of keys aligned with rows (any object supporting
+                len() and indexing, e.g. a memory-mapped digest array)
+            rows: (n, hash_bytes) uint8 array; all-zero rows mark missing hashes
+
+        The chunk tables are built lazily on the first search.
+        """
+        index = cls(hash_kind, hash_size)
+        index.keys = keys
+        index._hashes = rows
+        index._rows_filtered = False
+        return index
+
+    def rows_for(self, keys):
+        """(len(keys), hash_bytes) uint8 array of the hashes of keys, all-zero where missing"""
+        hashes = self.to_dict()
+        return self._to_rows([hashes.get(key, 0) for key in keys])
+
+    def _to_rows(self, perceptual_hashes):
+        """Convert integer hashes to an (n, hash_bytes) big-endian uint8 array"""
+        raw = b''.join(h.to_bytes(self.hash_bytes, 'big') for h in perceptual_hashes)
+        return np.frombuffer(raw, dtype=np.uint8).reshape(-1, self.hash_bytes)
+
+    def _build(self):
+        """Fold pending additions into new hash rows; call with the lock held"""
+        if self._pending:
+            self._hashes = np.concatenate([self._hashes, self._to_rows(self._pending)])
+            self._pending = []
+            self._tables = {}
+        if not self._rows_filtered:
+            present = self._hashes.any(axis=1)
+            if not present.all():
+                self.keys = [self.keys[i] for i in np.flatnonzero(present)]
+                self._hashes = self._hashes[present]
+            self._rows_filtered = True
+            self._tables = {}
+
+    def _current_rows(self):
+        """(keys, hash rows) including every addition so far"""
+        with self._lock:
+            self._build()
+            return self.keys, self._hashes
+
+    def _chunk_layout(self, max_distance):
+        """(start bit, end bit, probe radius) of every chunk for a search radius, or None to scan all rows"""
+        bits = self.hash_bytes * 8
+        num_chunks = max((max_distance + 2) // 2, -(-bits // MAX_CHUNK_BITS))
+        if bits // num_chunks < MIN_CHUNK_BITS:
+            return None
+        bounds = np.linspace(0, bits, num_chunks + 1).astype(int)
+        spare = max(max_distance + 1 - num_chunks, 0)
+        return tuple(
+            (int(start), int(end), spare // num_chunks + (1 if chunk < spare % num_chunks else 0))
+            for chunk, (start, end) in enumerate(zip(bounds, bounds[1:]))
+        )
+
+    def _chunk_tables(self, layout):
+        """Sorted chunk values and row order per chunk of a layout; call with the lock held"""
+        tables = self._tables.get(layout)
+        if tables is None:
+            tables = []
+            for start, end, _ in layout:
+                values = _chunk_values(self._hashes, start, end)
+                order = np.argsort(values, kind='stable')
+                tables.append((values[order], order))
+            self._tables[layout] = tables
+        return tables
+
+    def _candidates(self, perceptual_hash, max_distance):
+        """(keys, hash rows, row numbers of the candidates) for a query hash"""
+        layout = self._chunk_layout(max_distance)
+        with self._lock:
+            self._build()
+            keys, hashes = self.keys, self._hashes
+            tables = self._chunk_tables(layout) if layout is not None and len(hashes) else None
+        if tables is None:
+            return keys, hashes, np.arange(len(hashes))
+
+        bits = self.hash_bytes * 8
+        candidates = []
+        for (start, end, radius), (values, order) in zip(layout, tables):
+            chunk = (perceptual_hash >> (bits - end)) & ((1 << (end - start)) - 1)
+            probes = _neighbour_masks(end - start, radius) ^ np.uint64(chunk)
+            starts = np.searchsorted(values, probes, side='left')
+            ends = np.searchsorted(values, probes, side='right')
+            for hit in np.flatnonzero(ends > starts):
+                candidates.append(order[starts[hit]:ends[hit]])
+        if not candidates:
+            return keys, hashes, np.zeros(0, dtype=np.intp)
+        return keys, hashes, np.unique(np.concatenate(candidates))
+
+    def search(self, perceptual_hash, max_distance=DEFAULT_MAX_DISTANCE, k=None) -> List[Tuple[str, int]]:
+        """
+        Find indexed keys within max_distance of a perceptual hash
+
+        Args:
+            perceptual_hash: Query hash (int)
+            max_distance: Maximum Hamming distance
+            k: Return at most the k closest matches (all if None)
+
+        Returns:
+            List of (key, distance) tuples, closest first
+        """
+        query = self._to_rows([perceptual_hash])
+        keys, hashes, candidates = self._candidates(perceptual_hash, max_distance)
+        if len(candidates) == 0:
+            return []
+        distances = _POPCOUNT_TABLE[hashes[candidates] ^ query].sum(axis=1)
+        within = distances <= max_distance
+        candidates, distances = candidates[within], distances[within]
+
+        order = np.argsort(distances, kind='stable')
+        if k is not None:
+            order = order[:k]
+        return [(keys[candidates[i]], int(distances[i])) for i in order]
+
+    def nearest(self, image, k=5, max_distance=DEFAULT_MAX_DISTANCE):
+        """Find the k indexed keys closest to a PIL Image"""
+        return self.search(self.compute_hash(image), max_distance, k)
+
+class MultiPerceptualIndex:
+    """
+    Several indexes (e.g. one per shard) searched as one
+
+    Additions go to the last index, so the others can stay read-only views.
+    """
+
+    def __init__(self, indexes):
+        self.indexes = list(indexes)
+        self.hash_kind = self.indexes[0].hash_kind
+        self.hash_size = self.indexes[0].hash_size
+
+    def __len__(self):
+        return sum(len(index) for index in self.indexes)
+
+    def compute_hash(self, image):
+        return self.indexes[0].compute_hash(image)
+
+    def add(self, key, perceptual_hash):
+        self.indexes[-1].add(key, perceptual_hash)
+
+    def to_dict(self):
+        hashes = {}
+        for index in self.indexes:
+            hashes.update(index.to_dict())
+        return hashes
+
+    def rows_for(self, keys):
+        hashes = self.to_dict()
+        return self.indexes[-1]._to_rows([hashes.get(key, 0) for key in keys])
+
+    def search(self, perceptual_hash, max_distance=DEFAULT_MAX_DISTANCE, k=None) -> List[Tuple[str, int]]:
+        best = {}
+        for index in self.indexes:
+            for key, distance in index.search(perceptual_hash, max_distance, k):
+                best[key] = min(distance, best.get(key, distance))
+        matches = sorted(best.items(), key=lambda match: match[1])
+        return matches[:k] if k is not None else matches
+
+    def nearest(self, image, k=5, max_distance=DEFAULT_MAX_DISTANCE):
+        return self.search(self.compute_hash(image), max_distance, k)
@@ -0,0 +1,137 @@
+import math
+import os
+import struct
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# File layout: preamble (magic, version, hash count, bit count, filter id), then the bit array
+MAGIC = b'IHBF'
+FORMAT_VERSION = 1
+PREFILTER_EXTENSION = '.bloom'
+DEFAULT_BITS_PER_ENTRY = 10
+
+_PREAMBLE = struct.Struct('<4sHHQ16s')
+_HEADER_SIZE = 64
+
+# Digests hashed per vectorized step while building
+_BUILD_CHUNK = 1 << 20
+
+class BloomFilter:
+    """
+    Bloom filter over hex SHA256 digests
+
+    The digests are already uniformly distributed, so the k bit positions
+    come straight from the digest bytes by double hashing (h1 + i * h2) and
+    no extra hashing is needed. At the default 10 bits per entry about 1% of
+    unknown digests pass the filter; none of the indexed digests are ever
+    rejected. Saved filters are memory-mapped copy-on-write: loading takes
+    microseconds and additions stay in memory.
+    """
+
+    def __init__(self, bits, num_hashes, filter_id=None):
+        """
+        Args:
+            bits: uint8 array holding the bit array
+            num_hashes: Number of bit positions per digest (k)
+            filter_id: Hex id tying the filter to the database it was built with
+        """
+        self.bits = bits
+        self.num_bits = len(bits) * 8
+        self.num_hashes = num_hashes
+        self.filter_id = filter_id or os.urandom(16).hex()
+
+    @staticmethod
+    def _split(digests):
+        """(h1, h2) uint64 arrays from an (n, 32) uint8 digest array"""
+        h1 = digests[:, :8].copy().view('<u8')[:, 0]
+        h2 = digests[:, 8:16].copy().view('<u8')[:, 0] | np.uint64(1)
+        return h1, h2
+
+    @classmethod
+    def build(cls, hex_digests, bits_per_entry=DEFAULT_BITS_PER_ENTRY):
+        """Build a filter sized for the given digests"""
+        hex_digests = list(hex_digests)
+        num_bits = max(64, len(hex_digests) * bits_per_entry)
+        num_bits = (num_bits + 7) // 8 * 8
+        num_hashes = max(1, round(bits_per_entry * math.log(2)))
+        flags = np.zeros(num_bits, dtype=bool)
+
+        modulus = np.uint64(num_bits)
+        for start in range(0, len(hex_digests), _BUILD_CHUNK):
+            raw = b''.join(bytes.fromhex(h) for h in hex_digests[start:start + _BUILD_CHUNK])
+            h1, h2 = cls._split(np.frombuffer(raw, dtype=np.uint8).reshape(-1, 32))
+            for i in range(num_hashes):
+                # uint64 arithmetic wraps around, which is fine for hashing
+                flags[(h1 + np.uint64(i) * h2) % modulus] = True
+
+        return cls(np.packbits(flags, bitorder='little'), num_hashes)
+
+    def _positions(self, hex_digest):
+        try:
+            digest = bytes.fromhex(hex_digest)
+        except (TypeError, ValueError):
+            return None
+        if len(digest) < 16:
+            return None
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:16], 'little') | 1
+        mask = (1 << 64) - 1
+        return [((h1 + i * h2) & mask) % self.num_bits for i in range(self.num_hashes)]
+
+    def might_contain(self, hex_digest):
+        """False means the digest is definitely not in the database"""
+        positions = self._positions(hex_digest)
+        if positions is None:
+            return False
+        bits = self.bits
+        return all(bits[p >> 3] >> (p & 7) & 1 for p in positions)
+
+    def add(self, hex_digest):
+        positions = self._positions(hex_digest)
+        if positions is None:
+            return
+        for p in positions:
+            self.bits[p >> 3] |= 1 << (p & 7)
+
+    def fill_ratio(self):
+        """Fraction of bits set (the false positive rate is about fill_ratio ** num_hashes)"""
+        return float(np.unpackbits(np.asarray(self.bits)).mean()) if self.num_bits else 0.0
+
+    def write(self, path):
+        """Write the filter atomically (to a temporary file, then renamed)"""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            preamble = _PREAMBLE.pack(MAGIC, FORMAT_VERSION, self.num_hashes, self.num_bits,
+                                      bytes.fromhex(self.filter_id))
+            f.write(preamble.ljust(_HEADER_SIZE, b'\0'))
+            f.write(np.asarray(self.bits).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, filter_id=None):
+        """
+        Memory-map a saved filter
+
+        Returns:
+            The filter, or None if the file is missing, invalid or was built
+            for a different database (filter_id does not match)
+        """
+        try:
+            with open(path, 'rb') as f:
+                magic, version, num_hashes, num_bits, raw_id = _PREAMBLE.unpack(f.read(_PREAMBLE.size))
+        except (OSError, struct.error):
+            return None
+        if magic != MAGIC or version != FORMAT_VERSION:
+            logger.warning(f"Ignoring invalid prefilter {path}")
+            return None
+        if filter_id is not None and raw_id.hex() != filter_id:
+            logger.warning(f"Ignoring prefilter {path}: it was built for a different database")
+            return None
+        # Copy-on-write: additions change this process's pages, never the file
+        bits = np.memmap(path, dtype=np.uint8, mode='c', offset=_HEADER_SIZE, shape=(num_bits // 8,))
+        return cls(bits, num_hashes, raw_id.hex())
@@ -0,0 +1,308 @@
+import base64
+import json
+import os
+import socket
+import threading
+from collections.abc import Mapping
+from typing import List, Tuple
+import logging
+
+import numpy as np
+
+try:
+    from scripts.hash_store import shard_of
+    from scripts.perceptual_index import PerceptualIndex, DEFAULT_MAX_DISTANCE
+    from scripts.prefilter import BloomFilter
+except ImportError:
+    # Running from inside scripts/
+    from hash_store import shard_of
+    from perceptual_index import PerceptualIndex, DEFAULT_MAX_DISTANCE
+    from prefilter import BloomFilter
+
+logger = logging.getLogger(__name__)
+
+# Database paths of the form shard://host:port,unix:/run/shard.sock,... are served by shard servers
+REMOTE_DB_SCHEME = 'shard://'
+
+# Hashes per request when iterating over a remote database
+PAGE_SIZE = 10000
+# Prefilter bytes per request when copying a server's Bloom filter
+PREFILTER_PAGE_BYTES = 1 << 22
+
+def is_remote_database(path):
+    """Whether a database path refers to shard servers"""
+    return isinstance(path, str) and path.startswith(REMOTE_DB_SCHEME)
+
+def connect(address, timeout=None):
+    """Open a socket to 'host:port' or 'unix:/path/to/socket'"""
+    if address.startswith('unix:'):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        sock.connect(address[len('unix:'):])
+        return sock
+    host, port = address.rsplit(':', 1)
+    sock = socket.create_connection((host, int(port)), timeout=timeout)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return sock
+
+class ShardClient:
+    """
+    Client for one shard server (see shard_server.py)
+
+    The protocol is one JSON object per line in each direction. Every thread
+    (and every process after a fork) gets its own connection; a dropped
+    connection is re-opened once per request.
+    """
+
+    def __init__(self, address, timeout=10.0):
+        self.address = address
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def __reduce__(self):
+        return (self.__class__, (self.address, self.timeout))
+
+    def _stream(self):
+        stream = getattr(self._local, 'stream', None)
+        if stream is None or self._local.pid != os.getpid():
+            sock = connect(self.address, self.timeout)
+            stream = sock.makefile('rwb')
+            self._local.sock, self._local.stream, self._local.pid = sock, stream, os.getpid()
+        return stream
+
+    def _close(self):
+        stream = getattr(self._local, 'stream', None)
+        if stream is not None:
+            try:
+                stream.close()
+                self._local.sock.close()
+            except OSError:
+                pass
+        self._local.stream = None
+
+    def request(self, payload):
+        """Send one request and return the decoded response"""
+        line = json.dumps(payload).encode('utf-8') + b'\n'
+        for attempt in range(2):
+            try:
+                stream = self._stream()
+                stream.write(line)
+                stream.flush()
+                response = stream.readline()
+                if not response:
+                    raise ConnectionError(f"Shard server {self.address} closed the connection")
+                break
+            except OSError:
+                self._close()
+                if attempt:
+                    raise
+        response = json.loads(response)
+        if 'error' in response:
+            raise RuntimeError(f"Shard server {self.address}: {response['error']}")
+        return response
+
+class ShardRouter:
+    """
+    Routes lookups to the shard servers that hold each digest prefix
+
+    Every server reports which shards it serves; together they must cover
+    all shards. Membership and metadata lookups go to exactly one server,
+    perceptual searches fan out to all of them.
+
+    Each server's Bloom filter is copied at connect time, so most unknown
+    digests (typically forgeries) are rejected without a request. The copy
+    is fetched again whenever the server's database token changes, i.e. on
+    the detector's next refresh after an invoice was added there.
+    """
+
+    def __init__(self, addresses):
+        self.addresses = list(addresses)
+        self.clients = [ShardClient(address) for address in self.addresses]
+        self._infos = [client.request({'op': 'info'}) for client in self.clients]
+
+        self.shard_count = self._infos[0]['shard_count']
+        self.hash_mode = self._infos[0]['hash_mode']
+        # Servers older than configurable digests serve SHA256 keys
+        self.digest_algorithm = self._infos[0].get('digest_algorithm')
+        self.confirm_algorithm = self._infos[0].get('confirm_algorithm')
+        self.perceptual_hash_kind = self._infos[0]['perceptual_hash_kind']
+        self.perceptual_hash_size = self._infos[0]['perceptual_hash_size']
+        self._table = [None] * self.shard_count
+        for client, info in zip(self.clients, self._infos):
+            if info['shard_count'] != self.shard_count or info['hash_mode'] != self.hash_mode or \
+                    info.get('digest_algorithm') != self.digest_algorithm:
+                raise ValueError(f"Shard server {client.address} serves a different database layout")
+            for shard in info['shards']:
+                self._table[shard] = client
+        missing = [shard for shard, client in enumerate(self._table) if client is None]
+        if missing:
+            raise ValueError(f"No shard server for shards {missing}")
+
+        # Client -> (database token it was copied at, BloomFilter or None)
+        self._prefilters = {}
+        self._load_prefilters()
+
+    @classmethod
+    def from_url(cls, url):
+        """Router for a shard://address,address,... database path"""
+        return cls(address for address in url[len(REMOTE_DB_SCHEME):].split(',') if address)
+
+    def __reduce__(self):
+        # Worker processes reconnect instead of inheriting sockets
+        return (self.__class__, (self.addresses,))
+
+    def _fetch_prefilter(self, client):
+        """Copy of a server's Bloom filter, or None if it has none"""
+        try:
+            response = client.request({'op': 'prefilter', 'limit': PREFILTER_PAGE_BYTES})
+        except RuntimeError as e:
+            # Servers older than published prefilters answer every digest themselves
+            logger.warning(f"No prefilter from shard server {client.address}: {e}")
+            return None
+        if response['filter_id'] is None:
+            return None
+        bits = bytearray(base64.b64decode(response['bits']))
+        while len(bits) < response['num_bits'] // 8:
+            page = client.request({'op': 'prefilter', 'start': len(bits), 'limit': PREFILTER_PAGE_BYTES})
+            if page['filter_id'] != response['filter_id']:
+                # The server reloaded meanwhile; the next refresh copies the new filter
+                return None
+            bits += base64.b64decode(page['bits'])
+        return BloomFilter(np.frombuffer(bits, dtype=np.uint8), response['num_hashes'], response['filter_id'])
+
+    def _load_prefilters(self):
+        """Copy the filters of the servers whose database changed since they were copied"""
+        for client, info in zip(self.clients, self._infos):
+            copied = self._prefilters.get(client)
+            if copied is None or copied[0] != info['token']:
+                self._prefilters[client] = (info['token'], self._fetch_prefilter(client))
+
+    def client_for(self, hex_digest):
+        shard = shard_of(hex_digest, self.shard_count)
+        return self._table[shard] if shard is not None else None
+
+    def might_contain(self, client, hex_digest):
+        """False if the server's filter rules the digest out, so it need not be asked"""
+        prefilter = self._prefilters[client][1]
+        return prefilter is None or prefilter.might_contain(hex_digest)
+
+    def contains(self, hex_digest):
+        client = self.client_for(hex_digest)
+        if client is None or not self.might_contain(client, hex_digest):
+            return False
+        return client.request({'op': 'contains', 'hashes': [hex_digest]})['found'][0]
+
+    def contains_many(self, hex_digests):
+        """Membership of many digests with one request per server"""
+        found = [False] * len(hex_digests)
+        groups = {}
+        for position, hex_digest in enumerate(hex_digests):
+            client = self.client_for(hex_digest)
+            if client is not None and self.might_contain(client, hex_digest):
+                groups.setdefault(client, []).append(position)
+        for client, positions in groups.items():
+            answers = client.request({'op': 'contains', 'hashes': [hex_digests[p] for p in positions]})['found']
+            for position, answer in zip(positions, answers):
+                found[position] = answer
+        return found
+
+    def metadata(self, hex_digest):
+        client = self.client_for(hex_digest)
+        if client is None or not self.might_contain(client, hex_digest):
+            return None
+        return client.request({'op': 'metadata', 'hash': hex_digest})['metadata']
+
+    def search(self, perceptual_hash, max_distance, k) -> List[Tuple[str, int]]:
+        best = {}
+        for client in self.clients:
+            response = client.request({'op': 'nearest', 'perceptual_hash': format(perceptual_hash, 'x'),
+                                       'max_distance': max_distance, 'k': k})
+            for key, distance in response['matches']:
+                best[key] = min(distance, best.get(key, distance))
+        matches = sorted(best.items(), key=lambda match: match[1])
+        return matches[:k] if k is not None else matches
+
+    def refresh_info(self):
+        """Re-read every server's info (entry counts, database tokens) and copy changed prefilters"""
+        self._infos = [client.request({'op': 'info'}) for client in self.clients]
+        self._load_prefilters()
+
+    def token(self):
+        """Combined database token of all servers (see InvoiceHashDetector.cache_token)"""
+        self.refresh_info()
+        return '|'.join(info['token'] for info in self._infos)
+
+    @property
+    def count(self):
+        return sum(info['count'] for info in self._infos)
+
+    @property
+    def perceptual_count(self):
+        return sum(info['perceptual'] for info in self._infos)
+
+    def iter_hashes(self):
+        for client in self.clients:
+            start = 0
+            while True:
+                page = client.request({'op': 'hashes', 'start': start, 'limit': PAGE_SIZE})['hashes']
+                yield from page
+                if len(page) < PAGE_SIZE:
+                    break
+                start += len(page)
+
+class RemoteHashSet:
+    """Read-only set-like view of the hashes held by shard servers"""
+
+    def __init__(self, router):
+        self.router = router
+
+    def __contains__(self, hex_digest):
+        return self.router.contains(hex_digest)
+
+    def __len__(self):
+        return self.router.count
+
+    def __iter__(self):
+        return self.router.iter_hashes()
+
+class RemoteMetadata(Mapping):
+    """Read-only mapping view of the metadata held by shard servers"""
+
+    def __init__(self, router):
+        self.router = router
+
+    def __getitem__(self, hex_digest):
+        metadata = self.router.metadata(hex_digest)
+        if metadata is None:
+            raise KeyError(hex_digest)
+        return metadata
+
+    def __iter__(self):
+        return self.router.iter_hashes()
+
+    def __len__(self):
+        return self.router.count
+
+class RemotePerceptualIndex:
+    """Perceptual index whose searches run on the shard servers; hashes are computed locally"""
+
+    def __init__(self, router):
+        self.router = router
+        self.hash_kind = router.perceptual_hash_kind
+        self.hash_size = router.perceptual_hash_size
+        self._hasher = PerceptualIndex(self.hash_kind, self.hash_size)
+
+    def __len__(self):
+        return self.router.perceptual_count
+
+    def compute_hash(self, image):
+        return self._hasher.compute_hash(image)
+
+    def add(self, key, perceptual_hash):
+        raise ValueError("Databases served by shard servers are read-only here; add invoices on the servers")
+
+    def search(self, perceptual_hash, max_distance=DEFAULT_MAX_DISTANCE, k=None):
+        return self.router.search(perceptual_hash, max_distance, k)
+
+    def nearest(self, image, k=5, max_distance=DEFAULT_MAX_DISTANCE):
+        return self.search(self.compute_hash(image), max_distance, k)
@@ -0,0 +1,170 @@
+import argparse
+import base64
+import json
+import os
+import socketserver
+from itertools import islice
+import logging
+
+try:
+    from scripts.invoice_detector import InvoiceHashDetector
+    from scripts.hash_store import ShardedHashStore, LayeredHashSet
+except ImportError:
+    # Running from inside scripts/ (e.g. python shard_server.py)
+    from invoice_detector import InvoiceHashDetector
+    from hash_store import ShardedHashStore, LayeredHashSet
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class ShardServer:
+    """
+    Answers lookup requests against one detector's database
+
+    The detector keeps its usual change log refresh and hot reload, so
+    invoices added or revoked on the database show up in every app node
+    that routes to this server.
+    """
+
+    def __init__(self, detector):
+        self.detector = detector
+
+    def layout(self):
+        """(shard count, shards served) of the loaded database; a plain database is one shard"""
+        base = self.detector.legitimate_hashes
+        if isinstance(base, LayeredHashSet):
+            base = base.base
+        if isinstance(base, ShardedHashStore):
+            return base.shard_count, base.shards
+        return 1, [0]
+
+    def handle(self, request):
+        """Answer one decoded request"""
+        detector = self.detector
+        op = request.get('op')
+        if op == 'contains':
+            return {'found': [detector.is_legitimate_hash(invoice_hash) for invoice_hash in request['hashes']]}
+        if op == 'metadata':
+            invoice_hash = request['hash']
+            found = detector.is_legitimate_hash(invoice_hash)
+            return {'metadata': detector.invoice_metadata.get(invoice_hash) if found else None}
+        if op == 'nearest':
+            matches = detector.perceptual_index.search(int(request['perceptual_hash'], 16),
+                                                       request['max_distance'], request.get('k'))
+            hashes = detector.legitimate_hashes
+            return {'matches': [[key, distance] for key, distance in matches if key in hashes]}
+        if op == 'prefilter':
+            # Clients copy the filter and reject most unknown digests without a request
+            prefilter = detector._snapshot.prefilter
+            if prefilter is None:
+                return {'filter_id': None}
+            start = request.get('start', 0)
+            end = start + request.get('limit', len(prefilter.bits))
+            return {
+                'filter_id': prefilter.filter_id,
+                'num_hashes': prefilter.num_hashes,
+                'num_bits': prefilter.num_bits,
+                'bits': base64.b64encode(bytes(prefilter.bits[start:end])).decode('ascii')
+            }
+        if op == 'hashes':
+            start = request.get('start', 0)
+            page = islice(detector.legitimate_hashes, start, start + request.get('limit', 1000))
+            return {'hashes': list(page)}
+        if op == 'info':
+            shard_count, shards = self.layout()
+            return {
+                'shard_count': shard_count,
+                'shards': shards,
+                'hash_mode': detector.hash_mode,
+                'digest_algorithm': detector.digest_algorithm,
+                'confirm_algorithm': detector.confirm_algorithm,
+                'perceptual_hash_kind': detector.perceptual_index.hash_kind,
+                'perceptual_hash_size': detector.perceptual_index.hash_size,
+                'count': len(detector.legitimate_hashes),
+                'perceptual': len(detector.perceptual_index),
+                'token': detector.cache_token()
+            }
+        return {'error': f"Unknown operation: {op}"}
+
+class _ShardRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                response = self.server.shard_server.handle(json.loads(line))
+            except Exception as e:
+                response = {'error': str(e)}
+            self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+
+class _TCPShardRequestHandler(_ShardRequestHandler):
+    # Responses are small and latency-bound
+    disable_nagle_algorithm = True
+
+class _ThreadingTCPServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+if hasattr(socketserver, 'ThreadingUnixStreamServer'):
+    class _ThreadingUnixServer(socketserver.ThreadingUnixStreamServer):
+        daemon_threads = True
+
+def make_server(shard_server, address):
+    """
+    Create a socket server for a ShardServer
+
+    Args:
+        address: 'host:port' for TCP or 'unix:/path/to/socket'
+    """
+    if address.startswith('unix:'):
+        path = address[len('unix:'):]
+        if os.path.exists(path):
+            os.remove(path)
+        server = _ThreadingUnixServer(path, _ShardRequestHandler)
+    else:
+        host, port = address.rsplit(':', 1)
+        server = _ThreadingTCPServer((host, int(port)), _TCPShardRequestHandler)
+    server.shard_server = shard_server
+    return server
+
+def parse_shards(value):
+    """Parse '0-7,12' into [0, 1, ..., 7, 12]"""
+    shards = []
+    for part in value.split(','):
+        if '-' in part:
+            first, last = part.split('-')
+            shards.extend(range(int(first), int(last) + 1))
+        elif part:
+            shards.append(int(part))
+    return shards
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve hash database lookups over TCP or a Unix socket")
+    parser.add_argument('--db', default="legitimate_invoice_hashes.shards",
+                        help="Hash database (.shards directory, .ihdb or .pkl)")
+    parser.add_argument('--listen', default="127.0.0.1:7100", help="host:port or unix:/path/to/socket")
+    parser.add_argument('--shards', default=None, help="Shards to serve from a .shards database, e.g. 0-7")
+    parser.add_argument('--watch-interval', type=float, default=2.0, help="Hot reload check interval (0 disables)")
+    args = parser.parse_args()
+
+    detector = InvoiceHashDetector(args.db, shards=parse_shards(args.shards) if args.shards else None)
+    if not detector.load_hash_database():
+        logger.error(f"Hash database {args.db} not found. Please build it first.")
+        return
+    if args.watch_interval > 0:
+        detector.watch_database(args.watch_interval)
+
+    shard_server = ShardServer(detector)
+    server = make_server(shard_server, args.listen)
+    shard_count, shards = shard_server.layout()
+    logger.info(f"Serving shards {shards} of {shard_count} ({len(detector.legitimate_hashes)} hashes) "
+                f"on {args.listen}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
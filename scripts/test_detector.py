@@ -111,6 +111,9 @@ def test_detector():
             logger.info(f"  Hash: {modified_result['hash'][:16] if modified_result['hash'] else 'None'}...")
             logger.info(f"  Reason: {modified_result['reason']}")
             logger.info(f"  Image size: {modified_image.size}")
+            # Only present when the database was built with tile digests (build_hash_db.py --tiles)
+            for region in modified_result.get('tampered_regions', []):
+                logger.info(f"  Changed region: {region['width']}x{region['height']} at ({region['x']}, {region['y']})")
             
         except Exception as e:
             logger.error(f"Error testing modified invoice: {e}")
@@ -0,0 +1,145 @@
+import hashlib
+from typing import List, Tuple
+
+# Tiles per side; a 16x16 grid cuts an A4 scan at 300dpi into ~155x220 pixel tiles
+DEFAULT_TILE_GRID = 16
+TILE_DIGEST_BYTES = 8
+
+# Metadata key the tile digests of a legitimate invoice are stored under
+TILE_METADATA_KEY = 'tile_digests'
+
+def _tile_edges(length, grid):
+    """Pixel offsets of the grid lines along one axis (grid + 1 values)"""
+    step = -(-length // grid)
+    return [min(i * step, length) for i in range(grid + 1)]
+
+def _node_digest(children):
+    digest = hashlib.blake2b(digest_size=TILE_DIGEST_BYTES)
+    for child in children:
+        digest.update(child)
+    return digest.digest()
+
+class TileDigests:
+    """
+    Grid of per-tile pixel digests of an invoice, with a Merkle quadtree over them
+
+    Comparing two invoices of the same size walks down from the root and only
+    descends into nodes whose digests differ, so locating the changed tiles
+    takes time proportional to the number of changed tiles (times the tree
+    depth), not to the number of tiles.
+    """
+
+    def __init__(self, grid, size, digests):
+        """
+        Args:
+            grid: Tiles per side
+            size: (width, height) of the image in pixels
+            digests: grid * grid * TILE_DIGEST_BYTES bytes, row by row
+        """
+        self.grid = grid
+        self.size = tuple(size)
+        self.digests = digests
+        self._levels = None
+
+    @classmethod
+    def compute(cls, image, grid=DEFAULT_TILE_GRID):
+        """
+        Digest every tile of a PIL Image
+
+        The pixel buffer is read once; each pixel row is then fed to the
+        digests of the tiles it crosses as zero-copy memoryview slices, so no
+        tile is ever copied. A tile's digest covers its rows top to bottom.
+        """
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        width, height = image.size
+        pixels = memoryview(image.tobytes())
+        row_bytes = width * 3
+        col_edges = [edge * 3 for edge in _tile_edges(width, grid)]
+        row_edges = _tile_edges(height, grid)
+
+        digests = bytearray()
+        for top, bottom in zip(row_edges, row_edges[1:]):
+            tiles = [hashlib.blake2b(digest_size=TILE_DIGEST_BYTES) for _ in range(grid)]
+            # (update, first byte, end byte) of each tile within a pixel row
+            spans = [(tile.update, left, right) for tile, left, right in zip(tiles, col_edges, col_edges[1:])]
+            for offset in range(top * row_bytes, bottom * row_bytes, row_bytes):
+                for update, left, right in spans:
+                    update(pixels[offset + left:offset + right])
+            for tile in tiles:
+                digests += tile.digest()
+        return cls(grid, (width, height), bytes(digests))
+
+    def to_dict(self):
+        return {'grid': self.grid, 'size': list(self.size), 'digests': self.digests.hex()}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['grid'], data['size'], bytes.fromhex(data['digests']))
+
+    def tile(self, row, col):
+        offset = (row * self.grid + col) * TILE_DIGEST_BYTES
+        return self.digests[offset:offset + TILE_DIGEST_BYTES]
+
+    def region(self, row, col):
+        """Pixel rectangle of a tile"""
+        row_edges = _tile_edges(self.size[1], self.grid)
+        col_edges = _tile_edges(self.size[0], self.grid)
+        return {
+            'row': row,
+            'col': col,
+            'x': col_edges[col],
+            'y': row_edges[row],
+            'width': col_edges[col + 1] - col_edges[col],
+            'height': row_edges[row + 1] - row_edges[row]
+        }
+
+    def levels(self):
+        """Merkle quadtree levels, leaves first; each level is a list of rows of node digests"""
+        if self._levels is None:
+            level = [[self.tile(row, col) for col in range(self.grid)] for row in range(self.grid)]
+            levels = [level]
+            while len(level) > 1 or len(level[0]) > 1:
+                level = [
+                    [_node_digest(level[r][c] for r in (2 * row, 2 * row + 1) if r < len(level)
+                                  for c in (2 * col, 2 * col + 1) if c < len(level[0]))
+                     for col in range((len(level[0]) + 1) // 2)]
+                    for row in range((len(level) + 1) // 2)
+                ]
+                levels.append(level)
+            self._levels = levels
+        return self._levels
+
+    @property
+    def root(self):
+        return self.levels()[-1][0][0]
+
+    def changed_tiles(self, other) -> List[Tuple[int, int]]:
+        """
+        (row, col) of the tiles that differ from another TileDigests
+
+        Raises:
+            ValueError: If the two were computed for different image sizes or grids
+        """
+        if self.grid != other.grid or self.size != other.size:
+            raise ValueError("Tile digests of different image sizes or grids cannot be compared")
+        ours, theirs = self.levels(), other.levels()
+        changed = []
+        stack = [(len(ours) - 1, 0, 0)]
+        while stack:
+            depth, row, col = stack.pop()
+            if ours[depth][row][col] == theirs[depth][row][col]:
+                continue
+            if depth == 0:
+                changed.append((row, col))
+                continue
+            below = ours[depth - 1]
+            for r in (2 * row, 2 * row + 1):
+                for c in (2 * col, 2 * col + 1):
+                    if r < len(below) and c < len(below[0]):
+                        stack.append((depth - 1, r, c))
+        return sorted(changed)
+
+    def changed_regions(self, other):
+        """Pixel rectangles of the tiles that differ from another TileDigests"""
+        return [self.region(row, col) for row, col in self.changed_tiles(other)]
@@ -0,0 +1,44 @@
+import tempfile
+import logging
+
+try:
+    from scripts.verdict_cache import new_upload_digest
+except ImportError:
+    # Running from inside scripts/
+    from verdict_cache import new_upload_digest
+
+logger = logging.getLogger(__name__)
+
+# Uploads larger than this are spooled to a temporary file while they arrive
+DEFAULT_SPOOL_BYTES = 256 * 1024
+
+class HashingSpooledFile(tempfile.SpooledTemporaryFile):
+    """
+    Upload buffer that digests the bytes as they are received
+
+    The multipart parser writes each chunk of the upload into this file as it
+    reads it from the socket, so the upload digest is ready the moment the
+    body has been parsed, without reading the file again. Data stays in
+    memory up to spool_bytes and is moved to a temporary file beyond that,
+    so memory per request is bounded by the spool size, not the upload size.
+    """
+
+    def __init__(self, spool_bytes=DEFAULT_SPOOL_BYTES):
+        super().__init__(max_size=spool_bytes, mode='w+b')
+        self._digest = new_upload_digest()
+        self.size = 0
+
+    def write(self, data):
+        # Uploads are only ever appended to, so the digest covers the whole file
+        self._digest.update(data)
+        self.size += len(data)
+        return super().write(data)
+
+    @property
+    def digest(self):
+        """Hex digest of the bytes received so far (same scheme as verdict_cache.digest_stream)"""
+        return self._digest.hexdigest()
+
+    @property
+    def spooled_to_disk(self):
+        return self._rolled
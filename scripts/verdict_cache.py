@@ -0,0 +1,200 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_ENTRIES = 4096
+DEFAULT_TTL = 3600.0
+
+# Bytes read per update when digesting an upload
+DIGEST_CHUNK_SIZE = 1024 * 1024
+
+def new_upload_digest():
+    """Hash object behind upload digests (128-bit BLAKE2b: cheap and collision-safe enough for a cache key)"""
+    return hashlib.blake2b(digest_size=16)
+
+def digest_stream(stream, chunk_size=DIGEST_CHUNK_SIZE):
+    """
+    Cheap 128-bit BLAKE2b digest of a seekable binary stream's raw bytes
+
+    The stream is read in chunks and rewound afterwards, so it can still be
+    handed to PIL.
+    """
+    digest = new_upload_digest()
+    start = stream.tell()
+    for chunk in iter(lambda: stream.read(chunk_size), b''):
+        digest.update(chunk)
+    stream.seek(start)
+    return digest.hexdigest()
+
+def digest_bytes(data):
+    """digest_stream for bytes already in memory"""
+    digest = new_upload_digest()
+    digest.update(data)
+    return digest.hexdigest()
+
+class VerdictCache:
+    """
+    LRU/TTL cache of detection results keyed on a digest of the raw upload
+
+    Every entry is tagged with the database token it was computed under (see
+    InvoiceHashDetector.cache_token); entries from another token are misses,
+    so adding, revoking or reloading invoices invalidates the cache. With a
+    path, entries are also kept in a local SQLite file shared by all worker
+    processes on the machine.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL, path=None):
+        """
+        Args:
+            max_entries: Maximum number of cached verdicts (0 disables the cache)
+            ttl: Seconds a verdict stays valid (None for no expiry)
+            path: Optional SQLite file shared across processes
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._token = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        if path:
+            self._connect().execute(
+                'CREATE TABLE IF NOT EXISTS verdicts ('
+                'key TEXT PRIMARY KEY, token TEXT, expires REAL, used REAL, result TEXT)'
+            )
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def _connect(self):
+        """Per-thread SQLite connection (connections cannot be shared between threads)"""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def _expiry(self):
+        return time.time() + self.ttl if self.ttl else float('inf')
+
+    def get(self, key, token):
+        """
+        Cached result for an upload digest under a database token
+
+        Returns:
+            A fresh copy of the cached result dictionary, or None on a miss
+        """
+        if not self.enabled:
+            return None
+        now = time.time()
+        with self._lock:
+            if token != self._token:
+                # The database changed: nothing cached so far is valid any more
+                self._entries.clear()
+                self._token = token
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires, result = entry
+                if expires > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return json.loads(result)
+                del self._entries[key]
+
+        result = self._get_shared(key, token, now) if self.path else None
+        with self._lock:
+            if result is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._remember(key, token, result[0], result[1])
+        return json.loads(result[1])
+
+    def put(self, key, token, result):
+        """Cache a result dictionary for an upload digest under a database token"""
+        if not self.enabled:
+            return
+        expires = self._expiry()
+        encoded = json.dumps(result)
+        with self._lock:
+            if token != self._token:
+                self._entries.clear()
+                self._token = token
+            self._remember(key, token, expires, encoded)
+        if self.path:
+            self._put_shared(key, token, expires, encoded)
+
+    def _remember(self, key, token, expires, encoded):
+        if token != self._token:
+            return
+        self._entries[key] = (expires, encoded)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _get_shared(self, key, token, now):
+        try:
+            connection = self._connect()
+            row = connection.execute(
+                'SELECT expires, result FROM verdicts WHERE key = ? AND token = ? AND expires > ?',
+                (key, token, now)
+            ).fetchone()
+            if row is not None:
+                connection.execute('UPDATE verdicts SET used = ? WHERE key = ?', (now, key))
+            return row
+        except sqlite3.Error as e:
+            logger.warning(f"Verdict cache read failed: {e}")
+            return None
+
+    def _put_shared(self, key, token, expires, encoded):
+        try:
+            connection = self._connect()
+            connection.execute(
+                'INSERT OR REPLACE INTO verdicts (key, token, expires, used, result) VALUES (?, ?, ?, ?, ?)',
+                (key, token, expires, time.time(), encoded)
+            )
+            # Drop entries of other database versions, expired ones and the least
+            # recently used beyond max_entries
+            connection.execute('DELETE FROM verdicts WHERE token != ? OR expires <= ?', (token, time.time()))
+            connection.execute(
+                'DELETE FROM verdicts WHERE key IN ('
+                'SELECT key FROM verdicts ORDER BY used DESC LIMIT -1 OFFSET ?)',
+                (self.max_entries,)
+            )
+        except sqlite3.Error as e:
+            logger.warning(f"Verdict cache write failed: {e}")
+
+    def clear(self):
+        """Remove every cached verdict (including the shared store)"""
+        with self._lock:
+            self._entries.clear()
+        if self.path:
+            self._connect().execute('DELETE FROM verdicts')
+
+    def stats(self):
+        """Hit/miss counters of this process and the number of cached verdicts"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'enabled': self.enabled,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl,
+                'shared_store': self.path
+            }
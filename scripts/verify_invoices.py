@@ -0,0 +1,214 @@
+import argparse
+import csv
+import json
+import os
+import tarfile
+import time
+import zipfile
+import logging
+
+try:
+    from scripts.invoice_detector import InvoiceHashDetector
+except ImportError:
+    # Running from inside scripts/
+    from invoice_detector import InvoiceHashDetector
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Files checked when walking a directory or archive
+VERIFY_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.tiff', '.tif', '.pdf')
+RESULT_FIELDS = ('name', 'is_fake', 'confidence', 'hash', 'reason', 'page_count', 'nearest_match',
+                 'size_bytes', 'elapsed_ms')
+PROGRESS_INTERVAL = 10.0  # seconds between throughput reports
+
+def _wanted(name):
+    return name.lower().endswith(VERIFY_EXTENSIONS)
+
+def iter_invoice_files(source):
+    """
+    Yield (name, invoice, size in bytes) for every invoice file in a directory
+    tree or a .zip/.tar(.gz/.bz2/.xz) archive, in a stable order
+
+    Directory entries are yielded as paths, so worker processes read the files
+    themselves; archive members are read one at a time as bytes. Tar archives
+    are read as a stream, front to back.
+    """
+    if os.path.isdir(source):
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for file_name in sorted(files):
+                if _wanted(file_name):
+                    path = os.path.join(root, file_name)
+                    yield os.path.relpath(path, source), path, os.path.getsize(path)
+    elif zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as archive:
+            for member in archive.infolist():
+                if not member.is_dir() and _wanted(member.filename):
+                    yield member.filename, archive.read(member), member.file_size
+    elif tarfile.is_tarfile(source):
+        with tarfile.open(source, 'r|*') as archive:
+            for member in archive:
+                if member.isfile() and _wanted(member.name):
+                    yield member.name, archive.extractfile(member).read(), member.size
+    else:
+        raise ValueError(f"{source} is not a directory, zip or tar archive")
+
+class ResultWriter:
+    """
+    Appends verification results to a CSV or JSONL file (by extension), one
+    flushed line per invoice, so an interrupted run loses at most the line
+    being written
+    """
+
+    def __init__(self, path, append=True):
+        self.path = path
+        self.format = 'csv' if path.lower().endswith('.csv') else 'jsonl'
+        if not append and os.path.exists(path):
+            os.remove(path)
+        self._repair_tail()
+        new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+        self._file = open(path, 'a', newline='', encoding='utf-8')
+        self._csv = csv.DictWriter(self._file, RESULT_FIELDS) if self.format == 'csv' else None
+        if self._csv is not None and new_file:
+            self._csv.writeheader()
+
+    def _repair_tail(self):
+        """Cut a partial last line left by an interrupted run"""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb+') as f:
+            data = f.read()
+            if data and not data.endswith(b'\n'):
+                f.truncate(data.rfind(b'\n') + 1)
+
+    def completed(self):
+        """Names already in the file"""
+        if not os.path.exists(self.path):
+            return set()
+        with open(self.path, newline='', encoding='utf-8') as f:
+            if self.format == 'csv':
+                return {row['name'] for row in csv.DictReader(f)}
+            return {json.loads(line)['name'] for line in f if line.strip()}
+
+    def write(self, record):
+        if self._csv is not None:
+            self._csv.writerow(record)
+        else:
+            self._file.write(json.dumps(record) + '\n')
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+def _record(name, size, item):
+    result = item['result']
+    nearest = result.get('nearest_matches') or [{}]
+    return {
+        'name': name,
+        'is_fake': result['is_fake'],
+        'confidence': result.get('confidence'),
+        'hash': result.get('hash'),
+        'reason': result.get('reason'),
+        'page_count': result.get('page_count'),
+        'nearest_match': nearest[0].get('hash'),
+        'size_bytes': size,
+        'elapsed_ms': item['elapsed_ms']
+    }
+
+def verify_invoices(detector, source, output, workers=None, resume=True, max_pending=None):
+    """
+    Check every invoice in a directory or archive against the database
+
+    Files are decoded and hashed on the detector's process pool, with a
+    bounded number in flight (see InvoiceHashDetector.detect_fake_invoices),
+    and results are appended to output as they complete.
+
+    Args:
+        detector: Detector with the database loaded (workers inherit it once)
+        source: Directory, .zip or .tar archive
+        output: Results file (.csv or .jsonl)
+        workers: Worker processes (defaults to the CPU count)
+        resume: Skip invoices already in output
+        max_pending: Invoices read ahead of the workers (defaults to 4 per worker)
+
+    Returns:
+        Dictionary with 'checked', 'fake', 'skipped', 'seconds', 'files_per_second'
+        and 'mb_per_second'
+    """
+    writer = ResultWriter(output, append=resume)
+    done = writer.completed()
+    if done:
+        logger.info(f"Resuming: {len(done)} invoices already in {output}")
+
+    # Size of each invoice in flight, by its position among the submitted ones
+    # (the 'index' of its result); archives may repeat names
+    sizes = {}
+    skipped = submitted = 0
+
+    def invoices():
+        nonlocal skipped, submitted
+        for name, invoice, size in iter_invoice_files(source):
+            if name in done:
+                skipped += 1
+                continue
+            sizes[submitted] = size
+            submitted += 1
+            yield name, invoice
+
+    checked = fake = total_bytes = 0
+    start = last_report = time.perf_counter()
+
+    def report(label):
+        seconds = max(time.perf_counter() - start, 1e-9)
+        stats = {
+            'checked': checked,
+            'fake': fake,
+            'skipped': skipped,
+            'seconds': round(seconds, 2),
+            'files_per_second': round(checked / seconds, 2),
+            'mb_per_second': round(total_bytes / seconds / 1e6, 2)
+        }
+        logger.info(f"{label}: {checked} checked ({fake} fake, {skipped} skipped), "
+                    f"{stats['files_per_second']} files/s, {stats['mb_per_second']} MB/s")
+        return stats
+
+    try:
+        for item in detector.detect_fake_invoices(invoices(), workers, max_pending):
+            size = sizes.pop(item['index'], None)
+            writer.write(_record(item['name'], size, item))
+            checked += 1
+            fake += bool(item['result']['is_fake'])
+            total_bytes += size or 0
+            if time.perf_counter() - last_report >= PROGRESS_INTERVAL:
+                last_report = time.perf_counter()
+                report("Progress")
+    except KeyboardInterrupt:
+        logger.warning("Interrupted; run again with the same output to resume")
+    finally:
+        writer.close()
+        detector.shutdown_batch_executor()
+    return report("Done")
+
+def main():
+    parser = argparse.ArgumentParser(description="Verify a directory or archive of invoices against the database")
+    parser.add_argument('source', help="Directory, .zip or .tar(.gz) archive of invoices")
+    parser.add_argument('--db', default="legitimate_invoice_hashes.pkl", help="Hash database")
+    parser.add_argument('--output', default="verify_results.jsonl", help="Results file (.jsonl or .csv)")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument('--max-pending', type=int, default=None,
+                        help="Invoices read ahead of the workers (default: 4 per worker)")
+    parser.add_argument('--max-image-pixels', type=int, default=None,
+                        help="Skip images larger than this many pixels without decoding them")
+    parser.add_argument('--no-resume', action='store_true', help="Check everything again, even if already in the output")
+    args = parser.parse_args()
+
+    detector = InvoiceHashDetector(args.db)
+    if not detector.load_hash_database():
+        logger.error(f"Hash database {args.db} not found. Please build it first.")
+        return
+    detector.max_image_pixels = args.max_image_pixels
+    verify_invoices(detector, args.source, args.output, args.workers, not args.no_resume, args.max_pending)
+
+if __name__ == "__main__":
+    main()
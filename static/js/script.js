@@ -1,5 +1,6 @@
 // Global variables
 let currentResult = null
+let currentImageUrl = null
 
 // DOM Elements
 const uploadArea = document.getElementById("uploadArea")
@@ -66,9 +67,9 @@ function handleFileSelect(e) {
 
 function handleFile(file) {
   // Validate file type
-  const allowedTypes = ["image/jpeg", "image/jpg", "image/png", "image/gif", "image/bmp", "image/tiff"]
+  const allowedTypes = ["image/jpeg", "image/jpg", "image/png", "image/gif", "image/bmp", "image/tiff", "application/pdf"]
   if (!allowedTypes.includes(file.type)) {
-    showError("Please upload a valid image file (JPG, PNG, GIF, BMP, TIFF)")
+    showError("Please upload a valid image or PDF file (JPG, PNG, GIF, BMP, TIFF, PDF)")
     return
   }
 
@@ -81,9 +82,16 @@ function handleFile(file) {
   uploadFile(file)
 }
 
+function previewableInBrowser(file) {
+  return file.type !== "application/pdf" && file.type !== "image/tiff"
+}
+
 function uploadFile(file) {
   const formData = new FormData()
   formData.append("file", file)
+  // The browser already has the image, so skip the server-side preview
+  // (except for PDFs and TIFFs, which it cannot show in an <img>)
+  formData.append("preview", previewableInBrowser(file) ? "none" : "thumbnail")
 
   // Show progress
   showProgress()
@@ -96,7 +104,7 @@ function uploadFile(file) {
     .then((data) => {
       hideProgress()
       if (data.success) {
-        displayResults(data)
+        displayResults(data, file)
       } else {
         showError(data.error || "An error occurred while processing the image")
       }
@@ -118,12 +126,21 @@ function hideProgress() {
   uploadProgress.style.display = "none"
 }
 
-function displayResults(data) {
+function displayResults(data, file) {
   currentResult = data
   const result = data.result
 
-  // Update result image
-  document.getElementById("resultImage").src = data.image
+  // Update result image from the local file (or a server thumbnail, if one was requested)
+  if (currentImageUrl) {
+    URL.revokeObjectURL(currentImageUrl)
+    currentImageUrl = null
+  }
+  if (file && previewableInBrowser(file)) {
+    currentImageUrl = URL.createObjectURL(file)
+    document.getElementById("resultImage").src = currentImageUrl
+  } else if (data.thumbnail) {
+    document.getElementById("resultImage").src = data.thumbnail
+  }
 
   // Update status
   const statusElement = document.getElementById("resultStatus")
@@ -154,11 +171,53 @@ function displayResults(data) {
     metadataInfo.style.display = "none"
   }
 
+  // Per-page verdicts of multi-page documents
+  const pagesInfo = document.getElementById("pagesInfo")
+  if (result.pages) {
+    pagesInfo.style.display = "flex"
+    document.getElementById("pagesValue").textContent = result.fake_pages.length
+      ? `${result.page_count} (not found: ${result.fake_pages.join(", ")})`
+      : `${result.page_count} (all found)`
+  } else {
+    pagesInfo.style.display = "none"
+  }
+
   // Show results section
   resultsSection.style.display = "block"
+  drawTamperedRegions(result)
   resultsSection.scrollIntoView({ behavior: "smooth" })
 }
 
+function drawTamperedRegions(result) {
+  const frame = document.querySelector(".result-image")
+  frame.querySelectorAll(".tamper-box").forEach((box) => box.remove())
+  if (!result.tampered_regions || !result.image_size) return
+
+  const img = document.getElementById("resultImage")
+  const draw = () => {
+    const [width, height] = result.image_size
+    // The image is scaled with object-fit: contain, so find the area it is drawn in first
+    const scale = Math.min(img.clientWidth / width, img.clientHeight / height)
+    const left = img.offsetLeft + (img.clientWidth - width * scale) / 2
+    const top = img.offsetTop + (img.clientHeight - height * scale) / 2
+    for (const region of result.tampered_regions) {
+      const box = document.createElement("div")
+      box.className = "tamper-box"
+      box.title = `Changed region (tile ${region.row}, ${region.col})`
+      box.style.left = `${left + region.x * scale}px`
+      box.style.top = `${top + region.y * scale}px`
+      box.style.width = `${region.width * scale}px`
+      box.style.height = `${region.height * scale}px`
+      frame.appendChild(box)
+    }
+  }
+  if (img.complete && img.naturalWidth) {
+    draw()
+  } else {
+    img.addEventListener("load", draw, { once: true })
+  }
+}
+
 function resetUpload() {
   // Hide results
   resultsSection.style.display = "none"
@@ -197,6 +256,8 @@ Status: ${reportData.status}
 Confidence: ${reportData.confidence}
 Hash: ${reportData.hash}
 Analysis: ${reportData.reason}
+${result.tampered_regions ? `Changed regions: ${result.tampered_regions.map((r) => `${r.width}x${r.height} at (${r.x}, ${r.y})`).join(", ")}` : ""}
+${result.pages ? result.pages.map((page) => `Page ${page.page}: ${page.is_fake ? "FAKE" : "LEGITIMATE"} (${page.hash})`).join("\n") : ""}
 
 ${reportData.metadata ? `Source: ${reportData.metadata.source}` : ""}
 
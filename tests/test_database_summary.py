@@ -0,0 +1,50 @@
+import pickle
+
+from scripts.invoice_detector import InvoiceHashDetector
+
+def digest(number):
+    return f"{number:064x}"[::-1]
+
+def write_database(db_path, entries=20):
+    writer = InvoiceHashDetector(db_path)
+    for number in range(entries):
+        writer.add_fingerprint(digest(number), number + 1, {'split': 'train' if number % 2 else 'test'})
+    # One hash without metadata
+    writer.add_fingerprint(digest(entries), None, {})
+    writer.invoice_metadata.pop(digest(entries))
+    writer.save_hash_database()
+    return writer
+
+def test_pickle_summary_reads_only_the_header(tmp_path):
+    db_path = str(tmp_path / 'db.pkl')
+    write_database(db_path)
+    # Drop the entries behind the header; the summary must not need them
+    reader = InvoiceHashDetector(db_path)
+    header_size = len(pickle.dumps(reader._read_pickle_header()))
+    with open(db_path, 'r+b') as f:
+        f.truncate(header_size)
+
+    summary = InvoiceHashDetector(db_path).read_database_summary()
+    assert summary['total_hashes'] == 21
+    assert summary['metadata_entries'] == 20
+    assert summary['stats']['distributions']['split'] == {'train': 10, 'test': 10, 'unknown': 1}
+    assert summary['digest_algorithm'] == 'sha256'
+
+def test_summary_includes_change_log_entries(tmp_path):
+    db_path = str(tmp_path / 'db.pkl')
+    write_database(db_path)
+    writer = InvoiceHashDetector(db_path)
+    assert writer.load_hash_database()
+    writer.change_log.append({'op': 'add', 'hash': digest(99), 'perceptual_hash': 'ff', 'metadata': {'split': 'val'}})
+
+    summary = InvoiceHashDetector(db_path).read_database_summary()
+    assert summary['total_hashes'] == 22
+    assert summary['stats']['distributions']['split']['val'] == 1
+
+def test_summary_of_a_binary_store_and_a_missing_database(tmp_path):
+    db_path = str(tmp_path / 'db.ihdb')
+    write_database(db_path)
+    summary = InvoiceHashDetector(db_path).read_database_summary()
+    assert summary['total_hashes'] == 21
+    assert summary['stats']['count'] == 21
+    assert InvoiceHashDetector(str(tmp_path / 'missing.pkl')).read_database_summary() is None
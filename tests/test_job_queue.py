@@ -0,0 +1,100 @@
+import io
+import os
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from scripts.job_queue import JobQueue, LANE_BULK, LANE_INTERACTIVE
+
+LEASE = 0.2
+
+@pytest.fixture
+def queue(tmp_path):
+    return JobQueue(str(tmp_path / 'jobs.sqlite'), lease_seconds=LEASE, max_attempts=2)
+
+def submit(queue, lane=LANE_BULK, data=b'invoice'):
+    return queue.submit('detect', [('invoice.png', io.BytesIO(data))], lane)
+
+def test_claim_takes_interactive_jobs_first(queue):
+    assert queue.claim() is None
+    bulk = submit(queue, LANE_BULK)
+    interactive = submit(queue, LANE_INTERACTIVE)
+    assert queue.claim()['job_id'] == interactive['job_id']
+    assert queue.claim((LANE_INTERACTIVE,)) is None
+    job = queue.claim()
+    assert job['job_id'] == bulk['job_id']
+    with open(job['files'][0]['path'], 'rb') as f:
+        assert f.read() == b'invoice'
+
+def test_idle_claim_does_not_wait_for_the_write_lock(queue):
+    submit(queue)
+    assert queue.claim() is not None
+    writer = sqlite3.connect(queue.path, isolation_level=None)
+    writer.execute('BEGIN IMMEDIATE')
+    try:
+        start = time.monotonic()
+        assert queue.claim() is None
+        assert time.monotonic() - start < 1
+    finally:
+        writer.execute('ROLLBACK')
+        writer.close()
+
+def test_expired_lease_is_requeued_and_old_claim_is_rejected(queue):
+    submitted = submit(queue)
+    first = queue.claim()
+    time.sleep(LEASE * 1.5)
+    second = queue.claim()
+    assert second['job_id'] == submitted['job_id']
+    assert second['claim'] != first['claim']
+    assert queue.get(submitted['job_id'])['attempts'] == 2
+
+    # The run that lost its lease can neither renew it nor record a result
+    assert not queue.heartbeat(first)
+    assert not queue.finish(first, {'is_fake': True})
+    assert os.path.exists(second['files'][0]['path'])
+
+    assert queue.heartbeat(second)
+    assert queue.finish(second, {'is_fake': False})
+    job = queue.get(submitted['job_id'])
+    assert job['status'] == 'done'
+    assert job['result'] == {'is_fake': False}
+    assert not os.path.exists(second['files'][0]['path'])
+
+def test_heartbeat_keeps_the_lease(queue):
+    submit(queue)
+    job = queue.claim()
+    for _ in range(3):
+        time.sleep(LEASE / 2)
+        assert queue.heartbeat(job)
+    assert queue.claim() is None
+
+def test_job_fails_after_max_attempts(queue):
+    submitted = submit(queue)
+    for _ in range(2):
+        assert queue.claim() is not None
+        time.sleep(LEASE * 1.5)
+    assert queue.claim() is None
+    job = queue.get(submitted['job_id'])
+    assert job['status'] == 'failed'
+    assert 'interrupted' in job['error']
+
+def test_workers_run_jobs_and_renew_leases(queue):
+    release = threading.Event()
+
+    def handler(job):
+        # Outlives several leases; the workers' renewals keep it from being requeued
+        release.wait(LEASE * 3)
+        return {'name': job['files'][0]['name']}
+
+    queue.start_workers(handler, workers=2, interactive_workers=1)
+    try:
+        submitted = submit(queue)
+        job = queue.wait(submitted['job_id'], LEASE * 10)
+    finally:
+        release.set()
+        queue.stop_workers(timeout=5)
+    assert job['status'] == 'done'
+    assert job['attempts'] == 1
+    assert job['result'] == {'name': 'invoice.png'}
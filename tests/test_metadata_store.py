@@ -0,0 +1,85 @@
+import os
+import pickle
+
+import pytest
+
+from scripts.field_index import FieldIndex
+from scripts.invoice_detector import InvoiceHashDetector
+from scripts.metadata_store import MetadataStore
+
+def ground_truth(invoice_no):
+    return {'ground_truth': {'gt_parse': {'header': {'invoice_no': invoice_no}}}}
+
+def in_forked_child(function):
+    """Run function in a forked child and return its result"""
+    read_end, write_end = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            result = pickle.dumps(function())
+        except BaseException as e:
+            result = pickle.dumps(e)
+        os.write(write_end, result)
+        os._exit(0)
+    os.close(write_end)
+    with os.fdopen(read_end, 'rb') as f:
+        result = pickle.loads(f.read())
+    os.waitpid(pid, 0)
+    if isinstance(result, BaseException):
+        raise result
+    return result
+
+def test_store_reads_the_file_it_opened_after_a_replacement(tmp_path):
+    path = str(tmp_path / 'db.meta')
+    MetadataStore.write(path, {'a' * 64: {'index': 1}})
+    store = MetadataStore(path)
+    MetadataStore.write(path, {'a' * 64: {'index': 2}})
+    assert store['a' * 64] == {'index': 1}
+    assert in_forked_child(lambda: store['a' * 64]) == {'index': 1}
+
+def test_store_survives_deletion_in_forked_children(tmp_path):
+    path = str(tmp_path / 'db.meta')
+    MetadataStore.write(path, {'a' * 64: {'index': 1}})
+    store = MetadataStore(path)
+    os.remove(path)
+    assert in_forked_child(lambda: (store['a' * 64], len(store))) == ({'index': 1}, 1)
+
+def test_unpickled_store_refuses_a_newer_generation(tmp_path):
+    path = str(tmp_path / 'db.meta')
+    MetadataStore.write(path, {'a' * 64: {'index': 1}})
+    store = MetadataStore(path)
+    assert pickle.loads(pickle.dumps(store))['a' * 64] == {'index': 1}
+    MetadataStore.write(path, {'a' * 64: {'index': 2}})
+    with pytest.raises(FileNotFoundError):
+        pickle.loads(pickle.dumps(store))
+
+def test_field_index_reads_the_file_it_opened(tmp_path):
+    path = str(tmp_path / 'db.fields')
+    index_id = FieldIndex.write(path, {'a' * 64: ground_truth('FV-1')})
+    index = FieldIndex.load(path, index_id)
+    assert pickle.loads(pickle.dumps(index)).lookup('invoice_no', 'fv1') == ['a' * 64]
+
+    FieldIndex.write(path, {'b' * 64: ground_truth('FV-1')})
+    assert index.lookup('invoice_no', 'FV-1') == ['a' * 64]
+    assert in_forked_child(lambda: index.lookup('invoice_no', 'FV-1')) == ['a' * 64]
+    with pytest.raises(FileNotFoundError):
+        pickle.loads(pickle.dumps(index))
+
+def test_detector_metadata_after_a_newer_save(tmp_path):
+    db_path = str(tmp_path / 'db.pkl')
+    writer = InvoiceHashDetector(db_path)
+    writer.add_fingerprint('a' * 64, 1, {'index': 1})
+    writer.save_hash_database()
+
+    reader = InvoiceHashDetector(db_path)
+    assert reader.load_hash_database()
+    writer.add_fingerprint('b' * 64, 2, {'index': 2})
+    # Writes the next generation's metadata file and deletes this one
+    writer.save_hash_database()
+    assert len([name for name in os.listdir(tmp_path) if name.endswith('.meta')]) == 1
+
+    assert reader.invoice_metadata['a' * 64] == {'index': 1}
+    assert in_forked_child(lambda: (reader.invoice_metadata['a' * 64], 'b' * 64 in reader.invoice_metadata)) \
+        == ({'index': 1}, False)
+    assert reader.load_hash_database()
+    assert reader.invoice_metadata['b' * 64] == {'index': 2}
@@ -0,0 +1,22 @@
+from PIL import Image
+
+from scripts.invoice_detector import InvoiceHashDetector
+from scripts.metrics import STAGE_SECONDS, start_request_timings, request_timings
+
+def stage_count(name):
+    series = STAGE_SECONDS._series.get(name)
+    return series[2] if series else 0
+
+def test_confirm_digest_is_not_timed_as_the_key_digest(tmp_path):
+    detector = InvoiceHashDetector(str(tmp_path / 'db.pkl'), confirm_algorithm='blake2b')
+    image = Image.new('RGB', (64, 32), 'white')
+    detector.index_invoice(image, {'split': 'train'})
+
+    digests, confirms = stage_count('digest'), stage_count('confirm')
+    start_request_timings()
+    result = detector.detect_fake_invoice(image)
+    timings = request_timings()
+    assert not result['is_fake']
+    assert stage_count('digest') - digests == 1
+    assert stage_count('confirm') - confirms == 1
+    assert set(timings) >= {'digest', 'confirm'}
@@ -0,0 +1,74 @@
+import threading
+
+import numpy as np
+import pytest
+
+from scripts.perceptual_index import PerceptualIndex, hamming_distance, DEFAULT_MAX_DISTANCE
+
+ENTRIES = 20000
+
+@pytest.fixture(scope='module')
+def hashes():
+    rng = np.random.default_rng(0)
+    return [int.from_bytes(rng.bytes(32), 'big') for _ in range(ENTRIES)]
+
+@pytest.fixture(scope='module')
+def index(hashes):
+    return PerceptualIndex.from_dict({str(number): value for number, value in enumerate(hashes)})
+
+def flip_bits(value, count, rng):
+    for position in rng.choice(256, count, replace=False):
+        value ^= 1 << int(position)
+    return value
+
+def brute_force(hashes, query, max_distance):
+    distances = ((str(number), hamming_distance(query, value)) for number, value in enumerate(hashes))
+    return sorted(match for match in distances if match[1] <= max_distance)
+
+@pytest.mark.parametrize('max_distance', [0, 4, DEFAULT_MAX_DISTANCE, 20])
+def test_search_matches_brute_force(index, hashes, max_distance):
+    rng = np.random.default_rng(max_distance)
+    for _ in range(25):
+        query = flip_bits(hashes[rng.integers(len(hashes))], int(rng.integers(0, max_distance + 3)), rng)
+        assert sorted(index.search(query, max_distance)) == brute_force(hashes, query, max_distance)
+
+def test_search_probes_few_candidates(index, hashes):
+    rng = np.random.default_rng(1)
+    for _ in range(25):
+        query = flip_bits(hashes[rng.integers(len(hashes))], DEFAULT_MAX_DISTANCE, rng)
+        _, _, candidates = index._candidates(query, DEFAULT_MAX_DISTANCE)
+        assert 1 <= len(candidates) <= 10
+
+def test_search_sees_rows_and_additions():
+    rows = np.zeros((3, 32), dtype=np.uint8)
+    rows[0, 0], rows[2, 31] = 0x80, 0x01  # row 1 is missing (all zero)
+    index = PerceptualIndex.from_rows(['a', 'b', 'c'], rows)
+    index.add('d', 1 << 100)
+    assert index.search(1 << 255, 0) == [('a', 0)]
+    assert index.search(1, 0) == [('c', 0)]
+    assert index.search(1 << 100, 1) == [('d', 0)]
+    assert index.search(0, 0) == []
+
+def test_concurrent_add_and_search(hashes):
+    index = PerceptualIndex()
+    errors = []
+
+    def add():
+        for number, value in enumerate(hashes[:5000]):
+            index.add(str(number), value)
+
+    def search():
+        try:
+            for number in range(1000):
+                index.search(hashes[number % 200])
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=add)] + [threading.Thread(target=search) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert len(index.to_dict()) == 5000
+    assert all(index.search(value, 0) == [(str(number), 0)] for number, value in enumerate(hashes[:5000]))
@@ -0,0 +1,80 @@
+import os
+import threading
+
+import pytest
+
+from scripts.invoice_detector import InvoiceHashDetector
+from scripts.shard_client import ShardClient, ShardRouter
+from scripts.shard_server import ShardServer, make_server
+
+def digest(number):
+    return f"{number:064x}"[::-1]
+
+@pytest.fixture
+def server(tmp_path):
+    db_path = str(tmp_path / 'db.ihdb')
+    writer = InvoiceHashDetector(db_path)
+    for number in range(100):
+        writer.add_fingerprint(digest(number), number + 1, {'split': 'train', 'index': number})
+    writer.save_hash_database()
+
+    detector = InvoiceHashDetector(db_path)
+    assert detector.load_hash_database()
+    address = f"unix:{tmp_path / 'shard.sock'}"
+    socket_server = make_server(ShardServer(detector), address)
+    thread = threading.Thread(target=socket_server.serve_forever, daemon=True)
+    thread.start()
+    yield detector, address
+    socket_server.shutdown()
+    socket_server.server_close()
+
+@pytest.fixture
+def requests(monkeypatch):
+    """Operations sent to shard servers"""
+    sent = []
+    request = ShardClient.request
+
+    def counting_request(self, payload):
+        sent.append(payload['op'])
+        return request(self, payload)
+
+    monkeypatch.setattr(ShardClient, 'request', counting_request)
+    return sent
+
+def test_hits_are_answered_by_the_server(server, requests):
+    _, address = server
+    router = ShardRouter([address])
+    requests.clear()
+    assert router.contains(digest(7))
+    assert router.metadata(digest(7)) == {'split': 'train', 'index': 7}
+    assert router.contains_many([digest(1), digest(2)]) == [True, True]
+    assert requests == ['contains', 'metadata', 'contains']
+
+def test_misses_are_rejected_without_a_request(server, requests):
+    _, address = server
+    router = ShardRouter([address])
+    unknown = [os.urandom(32).hex() for _ in range(200)]
+    requests.clear()
+    assert not any(router.contains(hex_digest) for hex_digest in unknown)
+    assert router.contains_many(unknown) == [False] * len(unknown)
+    assert all(router.metadata(hex_digest) is None for hex_digest in unknown)
+    # About 1% of unknown digests pass a 10 bits per entry filter
+    assert len(requests) < 20
+
+def test_prefilter_is_copied_again_after_the_server_changes(server, requests):
+    detector, address = server
+    router = ShardRouter([address])
+    added = os.urandom(32).hex()
+    detector.add_fingerprint(added, 1, {'source': 'manual'})
+    router.refresh_info()
+    assert 'prefilter' in requests
+    assert router.contains(added)
+    assert router.contains_many([added, digest(3)]) == [True, True]
+
+def test_detector_on_shard_servers(server):
+    _, address = server
+    detector = InvoiceHashDetector(f"shard://{address}")
+    assert detector.load_hash_database()
+    assert detector.is_legitimate_hash(digest(42))
+    assert not detector.is_legitimate_hash(os.urandom(32).hex())
+    assert detector.invoice_metadata[digest(42)]['index'] == 42
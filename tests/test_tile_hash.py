@@ -0,0 +1,35 @@
+import hashlib
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from scripts.tile_hash import TileDigests, TILE_DIGEST_BYTES, _tile_edges
+
+def row_by_row(pixels, grid):
+    """Tile digests taken one pixel row at a time"""
+    height, width = pixels.shape[:2]
+    row_edges, col_edges = _tile_edges(height, grid), _tile_edges(width, grid)
+    digests = b''
+    for top, bottom in zip(row_edges, row_edges[1:]):
+        for left, right in zip(col_edges, col_edges[1:]):
+            digest = hashlib.blake2b(digest_size=TILE_DIGEST_BYTES)
+            for row in pixels[top:bottom, left:right]:
+                digest.update(row.tobytes())
+            digests += digest.digest()
+    return digests
+
+@pytest.mark.parametrize('size', [(1, 1), (10, 7), (17, 33), (255, 301)])
+@pytest.mark.parametrize('grid', [1, 3, 16, 40])
+def test_digests_cover_each_tile_row_by_row(size, grid):
+    width, height = size
+    pixels = np.random.default_rng(width * grid).integers(0, 256, (height, width, 3), dtype=np.uint8)
+    assert TileDigests.compute(Image.fromarray(pixels), grid).digests == row_by_row(pixels, grid)
+
+def test_changed_tiles_locate_an_edit():
+    pixels = np.random.default_rng(0).integers(0, 256, (200, 160, 3), dtype=np.uint8)
+    original = TileDigests.compute(Image.fromarray(pixels), 8)
+    pixels[130, 45] ^= 1
+    edited = TileDigests.compute(Image.fromarray(pixels), 8)
+    assert edited.changed_tiles(original) == [(5, 2)]
+    assert edited.changed_regions(original) == [{'row': 5, 'col': 2, 'x': 40, 'y': 125, 'width': 20, 'height': 25}]